@@ -1,14 +1,39 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 
+from cache import DocumentChangeListener
 from controllers.company_controller import CompanyController
+from controllers.metrics_controller import MetricsController
+from db import AsyncDatabaseConnection
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    database = AsyncDatabaseConnection()
+    await database.open()
+    change_listener = DocumentChangeListener(database, company_controller.cache)
+    change_listener.start()
+    try:
+        yield
+    finally:
+        await change_listener.stop()
+        if company_controller.cache.shared is not None:
+            await company_controller.cache.shared.close()
+        await database.close()
+
 
 app = FastAPI(
     title = "Company Finder API",
     description = "Find a company by its name, website, phone number and facebook profile.",
     version = "0.1",
     docs_url = "/",
+    lifespan = lifespan,
 )
 
 
 company_controller = CompanyController(app)
-company_controller.register()
\ No newline at end of file
+company_controller.register()
+
+metrics_controller = MetricsController(app)
+metrics_controller.register()
@@ -0,0 +1,381 @@
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+import msgpack
+from elasticsearch.exceptions import NotFoundError
+
+try:
+    import redis.asyncio as redis
+except ImportError:
+    redis = None
+
+from common.change_log import CHANGES_INDEX, CHANGES_RETENTION, async_prune_changes
+from common.log import get_logger
+
+logger = get_logger(__name__)
+
+CACHE_MAX_SIZE = int(os.getenv('CACHE_MAX_SIZE', '100000'))
+CACHE_TTL = float(os.getenv('CACHE_TTL', '300'))
+CACHE_NEGATIVE_TTL = float(os.getenv('CACHE_NEGATIVE_TTL', '30'))
+CACHE_INVALIDATION_INTERVAL = float(os.getenv('CACHE_INVALIDATION_INTERVAL', '5'))
+# Changes are re-read for this long so a writer whose clock is slightly behind is not missed
+CACHE_INVALIDATION_OVERLAP = float(os.getenv('CACHE_INVALIDATION_OVERLAP', '30'))
+# Seconds between two deletions of the change log entries older than WEBSITE_DATA_CHANGES_RETENTION
+CACHE_CHANGES_PRUNE_INTERVAL = float(os.getenv('CACHE_CHANGES_PRUNE_INTERVAL', '600'))
+
+# Optional cache tier shared by every API worker, any server speaking the Redis protocol works
+CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL')
+CACHE_REDIS_PREFIX = os.getenv('CACHE_REDIS_PREFIX', 'company:')
+CACHE_REDIS_TIMEOUT = float(os.getenv('CACHE_REDIS_TIMEOUT', '0.05'))
+# After a failure the shared tier is skipped for this long and only the in-process cache is used
+CACHE_REDIS_RETRY_INTERVAL = float(os.getenv('CACHE_REDIS_RETRY_INTERVAL', '10'))
+
+
+@dataclass
+class CacheEntry:
+    value: Any
+    document_id: Optional[str]
+    expires_at: float
+
+
+class TTLCache:
+    """
+    Bounded LRU cache with a TTL per entry, used in front of the /company search.
+
+    Loaders return a `(value, document_id)` tuple, a `None` value is a miss and is kept for `negative_ttl` seconds.
+    Concurrent `get_or_load()` calls for the same key share a single load.
+    """
+
+    def __init__(self, max_size = CACHE_MAX_SIZE, ttl = CACHE_TTL, negative_ttl = CACHE_NEGATIVE_TTL,
+                 shared: Optional['SharedCache'] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.shared = shared
+
+        self.entries = OrderedDict()
+        self.keys_by_document = {}
+        self.in_flight = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.coalesced = 0
+        self.shared_hits = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return False, None
+        if entry.expires_at <= time.monotonic():
+            self.expirations += 1
+            self._remove(key)
+            return False, None
+        self.entries.move_to_end(key)
+        return True, entry.value
+
+    def set(self, key, value, document_id = None):
+        if key in self.entries:
+            self._remove(key)
+
+        ttl = self.ttl if value is not None else self.negative_ttl
+        self.entries[key] = CacheEntry(value = value, document_id = document_id, expires_at = time.monotonic() + ttl)
+        if document_id is not None:
+            self.keys_by_document.setdefault(document_id, set()).add(key)
+
+        while len(self.entries) > self.max_size:
+            oldest_key = next(iter(self.entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    async def get_or_load(self, key, loader):
+        found, value = self.get(key)
+        if found:
+            self.hits += 1
+            return value
+
+        pending = self.in_flight.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        pending = asyncio.get_running_loop().create_future()
+        self.in_flight[key] = pending
+        try:
+            found, value, document_id = await self._get_shared(key)
+            if found:
+                self.shared_hits += 1
+            else:
+                value, document_id = await loader()
+                await self._set_shared(key, value, document_id)
+        except asyncio.CancelledError:
+            pending.cancel()
+            raise
+        except Exception as e:
+            pending.set_exception(e)
+            # Waiters re-raise the exception, retrieve it here so an unobserved one is not logged
+            pending.exception()
+            raise
+        else:
+            self.set(key, value, document_id)
+            pending.set_result(value)
+            return value
+        finally:
+            del self.in_flight[key]
+
+    async def _get_shared(self, key):
+        if self.shared is None:
+            return False, None, None
+        return await self.shared.get(key)
+
+    async def _set_shared(self, key, value, document_id):
+        if self.shared is not None:
+            await self.shared.set(key, value, document_id, self.ttl if value is not None else self.negative_ttl)
+
+    def invalidate_documents(self, document_ids):
+        for document_id in document_ids:
+            for key in self.keys_by_document.pop(document_id, ()):
+                if key in self.entries:
+                    del self.entries[key]
+                    self.invalidations += 1
+
+    async def invalidate_shared_documents(self, document_ids):
+        if self.shared is not None:
+            await self.shared.invalidate_documents(document_ids)
+
+    def clear(self):
+        self.entries.clear()
+        self.keys_by_document.clear()
+
+    async def clear_shared(self):
+        if self.shared is not None:
+            await self.shared.clear()
+
+    def stats(self):
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "coalesced": self.coalesced,
+            "shared_hits": self.shared_hits,
+            "shared": self.shared.stats() if self.shared is not None else None,
+        }
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        if entry.document_id is not None:
+            keys = self.keys_by_document.get(entry.document_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.keys_by_document[entry.document_id]
+
+
+class SharedCache:
+    """
+    Cache tier shared by every API process, stored in a server speaking the Redis protocol.
+
+    Values are stored msgpack encoded, with a set per document id holding the keys to drop when it is rewritten.
+    Any error marks the tier as down for `retry_interval` seconds, during which it behaves as an empty cache so
+    lookups fall back to the in-process cache and Elasticsearch.
+    """
+
+    def __init__(self, url = CACHE_REDIS_URL, encode: Callable = None, decode: Callable = None,
+                 prefix = CACHE_REDIS_PREFIX, timeout = CACHE_REDIS_TIMEOUT,
+                 retry_interval = CACHE_REDIS_RETRY_INTERVAL):
+        if redis is None:
+            raise RuntimeError('The redis package is required for the shared cache, install it or unset CACHE_REDIS_URL')
+
+        self.client = redis.Redis.from_url(url, socket_timeout = timeout, socket_connect_timeout = timeout)
+        self.encode = encode or (lambda value: value)
+        self.decode = decode or (lambda value: value)
+        self.prefix = prefix
+        self.retry_interval = retry_interval
+        self.down_until = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _key(self, key):
+        return self.prefix + hashlib.sha1(msgpack.packb(key)).hexdigest()
+
+    def _document_key(self, document_id):
+        return self.prefix + 'doc:' + document_id
+
+    def _available(self):
+        return time.monotonic() >= self.down_until
+
+    def _failed(self, e):
+        self.errors += 1
+        self.down_until = time.monotonic() + self.retry_interval
+        logger.warning("Shared cache unavailable, using the in-process cache only: %s", e)
+
+    async def get(self, key):
+        if not self._available():
+            return False, None, None
+        try:
+            payload = await self.client.get(self._key(key))
+        except Exception as e:
+            self._failed(e)
+            return False, None, None
+
+        if payload is None:
+            self.misses += 1
+            return False, None, None
+
+        self.hits += 1
+        value, document_id = msgpack.unpackb(payload)
+        return True, self.decode(value) if value is not None else None, document_id
+
+    async def set(self, key, value, document_id, ttl):
+        if not self._available():
+            return
+
+        cache_key = self._key(key)
+        payload = msgpack.packb([self.encode(value) if value is not None else None, document_id])
+        try:
+            async with self.client.pipeline(transaction = False) as pipe:
+                pipe.set(cache_key, payload, px = int(ttl * 1000))
+                if document_id is not None:
+                    pipe.sadd(self._document_key(document_id), cache_key)
+                    # The key set has to outlive every cached value it points to
+                    pipe.pexpire(self._document_key(document_id), int(max(ttl, CACHE_TTL) * 1000))
+                await pipe.execute()
+        except Exception as e:
+            self._failed(e)
+
+    async def invalidate_documents(self, document_ids):
+        if not self._available() or not document_ids:
+            return
+        try:
+            document_keys = [self._document_key(document_id) for document_id in document_ids]
+            async with self.client.pipeline(transaction = False) as pipe:
+                for document_key in document_keys:
+                    pipe.smembers(document_key)
+                members = await pipe.execute()
+
+            keys = [key for document_members in members for key in document_members]
+            await self.client.delete(*keys, *document_keys)
+        except Exception as e:
+            self._failed(e)
+
+    async def clear(self, batch_size = 1000):
+        if not self._available():
+            return
+        try:
+            batch = []
+            async for key in self.client.scan_iter(match = self.prefix + '*', count = batch_size):
+                batch.append(key)
+                if len(batch) >= batch_size:
+                    await self.client.unlink(*batch)
+                    batch = []
+            if batch:
+                await self.client.unlink(*batch)
+        except Exception as e:
+            self._failed(e)
+
+    async def close(self):
+        await self.client.aclose()
+
+    def stats(self):
+        return {
+            "available": self._available(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+        }
+
+
+# Polls the change log written by the scrapers and the merge tool and drops cached results for rewritten documents
+class DocumentChangeListener:
+    def __init__(self, database, cache: TTLCache, interval = CACHE_INVALIDATION_INTERVAL,
+                 overlap = CACHE_INVALIDATION_OVERLAP, prune_interval = CACHE_CHANGES_PRUNE_INTERVAL,
+                 retention = CHANGES_RETENTION):
+        self.database = database
+        self.cache = cache
+        self.interval = interval
+        self.overlap = overlap
+        self.prune_interval = prune_interval
+        self.retention = max(retention, overlap * 2)
+        self.last_seen = None
+        self.next_prune = 0
+        # Reset records are re-read during the overlap, the cache is only cleared the first time. Record id ->
+        # timestamp, forgotten once the overlap window has moved past them
+        self.resets_seen = {}
+        self._task = None
+
+    def start(self):
+        self.last_seen = time.time() * 1000
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.poll()
+                await self.prune()
+            except NotFoundError:
+                # Nothing was written since the change log index was last removed
+                pass
+            except Exception as e:
+                logger.warning("Failed to read document changes: %s", e)
+
+    async def poll(self, page_size = 1000):
+        since = self.last_seen - self.overlap * 1000
+        while True:
+            response = await self.database.db.search(index = CHANGES_INDEX, body = {
+                "query": {"range": {"timestamp": {"gte": since}}},
+                "sort": [{"timestamp": "asc"}],
+                "size": page_size,
+            })
+            hits = response['hits']['hits']
+
+            for hit in hits:
+                # The alias moved to another index, every cached result may be stale
+                if hit['_source'].get('reset') and hit['_id'] not in self.resets_seen:
+                    self.resets_seen[hit['_id']] = hit['_source']['timestamp']
+                    self.cache.clear()
+                    await self.cache.clear_shared()
+                self.cache.invalidate_documents(hit['_source']['ids'])
+                await self.cache.invalidate_shared_documents(hit['_source']['ids'])
+                self.last_seen = max(self.last_seen, hit['_source']['timestamp'])
+
+            # Invalidating twice is harmless, so the next page simply starts at the last timestamp read
+            if len(hits) < page_size or hits[-1]['_source']['timestamp'] == since:
+                break
+            since = hits[-1]['_source']['timestamp']
+
+        # The next poll starts at last_seen - overlap, older reset records are never read again
+        window_start = self.last_seen - self.overlap * 1000
+        self.resets_seen = {
+            record_id: timestamp for record_id, timestamp in self.resets_seen.items() if timestamp >= window_start
+        }
+
+    async def prune(self):
+        now = time.monotonic()
+        if now < self.next_prune:
+            return
+        self.next_prune = now + self.prune_interval
+        await async_prune_changes(self.database.db, self.retention)
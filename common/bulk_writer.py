@@ -0,0 +1,234 @@
+import asyncio
+import json
+import random
+import time
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+from elasticsearch.exceptions import ConnectionError, ConnectionTimeout, TransportError
+
+from common.change_log import async_record_changes
+from common.documents import document_id, to_document
+from common.elastic import WEBSITE_DATA_INDEX
+from common.log import get_logger
+from common.metrics import DOCUMENTS_INDEXED, INDEX, INDEX_FAILURES, stage_timer
+
+logger = get_logger(__name__)
+
+# Statuses worth retrying, everything else is reported as a permanent per-item failure
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+_FLUSH = object()
+_STOP = object()
+
+
+@dataclass
+class BulkItem:
+    key: str
+    action: dict
+    source: Optional[dict]
+    size: int
+    attempts: int = 0
+    status: int = 0
+    document_id: Optional[str] = None
+
+
+@dataclass
+class BulkFailure:
+    key: str
+    status: int
+    error: str
+
+
+class BulkWriter:
+    """
+    Buffers documents and writes them to Elasticsearch through the _bulk API.
+
+    A flush happens when `max_docs` documents or `max_bytes` of payload are buffered, or `flush_interval` seconds
+    after the first buffered document. Producers block on `add()` once `max_pending` documents are queued, items
+    rejected with 429/5xx are retried with backoff and anything else ends up in `failures`.
+    """
+
+    def __init__(self, es, index = WEBSITE_DATA_INDEX, max_docs = 500, max_bytes = 5 * 1024 * 1024,
+                 flush_interval = 5.0, max_pending = 2000, max_retries = 3, retry_backoff = 0.5,
+                 on_failure: Optional[Callable[[BulkFailure], None]] = None):
+        self.es = es
+        self.index = index
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.on_failure = on_failure
+
+        self.queue = asyncio.Queue(maxsize = max_pending)
+        self.failures: List[BulkFailure] = []
+        self.indexed = 0
+        self.requests = 0
+
+        self._buffer: List[BulkItem] = []
+        self._buffer_bytes = 0
+        self._task = None
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def add(self, data, key = None):
+        # Idempotent partial upsert, fields written by other tools (e.g. the merge tool) are left untouched
+        doc = to_document(data)
+        action = {"update": {"_index": self.index, "_id": document_id(doc['url'])}}
+        await self.add_action(action, {"doc": doc, "doc_as_upsert": True}, key = key or doc['url'])
+
+    async def add_error(self, data, key = None):
+        # A failed crawl only creates a missing document, the empty doc leaves the fields of an earlier good crawl as
+        # they are instead of clearing them and hiding the document behind its error
+        doc = to_document(data)
+        action = {"update": {"_index": self.index, "_id": document_id(doc['url'])}}
+        await self.add_action(action, {"doc": {}, "upsert": doc}, key = key or doc['url'])
+
+    async def touch(self, url, fields, key = None):
+        # Partial update of an existing document with fields the API does not serve, so no change is recorded
+        action = {"update": {"_index": self.index, "_id": document_id(url)}}
+        await self.add_action(action, {"doc": fields}, key = key or url, record_change = False)
+
+    async def add_action(self, action, source = None, key = None, record_change = True):
+        size = len(json.dumps(action)) + (len(json.dumps(source)) if source is not None else 0)
+        changed_id = next(iter(action.values())).get('_id') if record_change else None
+        await self.queue.put(BulkItem(key = key, action = action, source = source, size = size,
+                                      document_id = changed_id))
+
+    async def flush(self):
+        done = asyncio.get_running_loop().create_future()
+        await self.queue.put((_FLUSH, done))
+        await done
+
+    async def close(self):
+        if self._task is None:
+            return
+        await self.queue.put(_STOP)
+        await self._task
+        self._task = None
+
+    async def _run(self):
+        deadline = None
+        while True:
+            try:
+                timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+                item = await asyncio.wait_for(self.queue.get(), timeout = timeout)
+            except asyncio.TimeoutError:
+                await self._flush_buffer()
+                deadline = None
+                continue
+
+            if item is _STOP:
+                await self._flush_buffer()
+                return
+
+            if isinstance(item, tuple) and item[0] is _FLUSH:
+                await self._flush_buffer()
+                deadline = None
+                item[1].set_result(None)
+                continue
+
+            self._buffer.append(item)
+            self._buffer_bytes += item.size
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+
+            if len(self._buffer) >= self.max_docs or self._buffer_bytes >= self.max_bytes:
+                await self._flush_buffer()
+                deadline = None
+
+    async def _flush_buffer(self):
+        items, self._buffer, self._buffer_bytes = self._buffer, [], 0
+        changed_ids = [item.document_id for item in items if item.document_id]
+
+        try:
+            await self._write(items)
+        finally:
+            await self._record_changes(changed_ids)
+
+    async def _record_changes(self, document_ids):
+        try:
+            await async_record_changes(self.es, document_ids)
+        except Exception as e:
+            logger.warning("Failed to record changed documents: %s", e)
+
+    async def _write(self, items: List[BulkItem]):
+        while items:
+            retry = await self._send(items)
+            if not retry:
+                return
+
+            for item in retry:
+                item.attempts += 1
+
+            items = []
+            for item in retry:
+                if item.attempts > self.max_retries:
+                    self._fail(item, item.status, 'Retries exhausted')
+                else:
+                    items.append(item)
+
+            if items:
+                backoff = self.retry_backoff * 2 ** (items[0].attempts - 1)
+                await asyncio.sleep(backoff + random.uniform(0, backoff))
+
+    async def _send(self, items: List[BulkItem]) -> List[BulkItem]:
+        body = []
+        for item in items:
+            body.append(item.action)
+            if item.source is not None:
+                body.append(item.source)
+
+        self.requests += 1
+        try:
+            with stage_timer(INDEX):
+                response = await self.es.bulk(body = body)
+        except (ConnectionError, ConnectionTimeout):
+            for item in items:
+                item.status = 503
+            return items
+        except TransportError as e:
+            if e.status_code in RETRYABLE_STATUSES:
+                for item in items:
+                    item.status = e.status_code
+                return items
+            for item in items:
+                self._fail(item, e.status_code, str(e))
+            return []
+
+        if not response.get('errors'):
+            self.indexed += len(items)
+            DOCUMENTS_INDEXED.inc(len(items))
+            return []
+
+        retry = []
+        for item, result in zip(items, response['items']):
+            outcome = next(iter(result.values()))
+            status = outcome.get('status', 500)
+            if status < 300:
+                self.indexed += 1
+                DOCUMENTS_INDEXED.inc()
+            elif status in RETRYABLE_STATUSES:
+                item.status = status
+                retry.append(item)
+            else:
+                self._fail(item, status, json.dumps(outcome.get('error')))
+        return retry
+
+    def _fail(self, item: BulkItem, status, error):
+        failure = BulkFailure(key = item.key, status = status, error = error)
+        self.failures.append(failure)
+        INDEX_FAILURES.labels(str(status)).inc()
+        logger.error("Failed to index data for %s: %s %s", item.key, status, error)
+        if self.on_failure:
+            self.on_failure(failure)
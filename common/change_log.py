@@ -0,0 +1,48 @@
+import os
+import time
+
+from elasticsearch import helpers
+
+from common.elastic import WEBSITE_DATA_INDEX
+
+# Ids of rewritten website_data documents, read by the API to invalidate its cached /company results
+CHANGES_INDEX = os.getenv('WEBSITE_DATA_CHANGES_INDEX', WEBSITE_DATA_INDEX + '_changes')
+CHANGES_BATCH_SIZE = 1000
+# Seconds a change is kept, readers only look back a few seconds so older entries are pruned
+CHANGES_RETENTION = float(os.getenv('WEBSITE_DATA_CHANGES_RETENTION', '3600'))
+
+
+def change_actions(document_ids):
+    document_ids = list(document_ids)
+    timestamp = int(time.time() * 1000)
+    for offset in range(0, len(document_ids), CHANGES_BATCH_SIZE):
+        yield {"index": {"_index": CHANGES_INDEX}}
+        yield {"ids": document_ids[offset:offset + CHANGES_BATCH_SIZE], "timestamp": timestamp}
+
+
+def record_changes(es, document_ids):
+    document_ids = list(document_ids)
+    if document_ids:
+        timestamp = int(time.time() * 1000)
+        helpers.bulk(es, (
+            {"_index": CHANGES_INDEX, "ids": document_ids[offset:offset + CHANGES_BATCH_SIZE], "timestamp": timestamp}
+            for offset in range(0, len(document_ids), CHANGES_BATCH_SIZE)
+        ))
+
+
+# Written when the alias moves to a new index, the API then drops its whole cache
+def record_reset(es):
+    es.index(index = CHANGES_INDEX, body = {"ids": [], "reset": True, "timestamp": int(time.time() * 1000)})
+
+
+async def async_record_changes(es, document_ids):
+    body = list(change_actions(document_ids))
+    if body:
+        await es.bulk(body = body)
+
+
+# Every API worker may send it, entries already deleted by another one are skipped
+async def async_prune_changes(es, retention = CHANGES_RETENTION):
+    older_than = int((time.time() - retention) * 1000)
+    await es.delete_by_query(index = CHANGES_INDEX, body = {"query": {"range": {"timestamp": {"lt": older_than}}}},
+                             conflicts = 'proceed')
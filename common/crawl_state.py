@@ -0,0 +1,87 @@
+import hashlib
+import os
+from datetime import datetime, timedelta, timezone
+
+from common.documents import document_id
+from common.elastic import WEBSITE_DATA_INDEX
+from common.log import get_logger
+
+logger = get_logger(__name__)
+
+# Incremental crawls skip the websites crawled (or found unchanged) less than this many hours ago
+CRAWL_STALE_AFTER_HOURS = float(os.getenv('CRAWL_STALE_AFTER_HOURS', '144'))
+CRAWL_STATE_BATCH_SIZE = int(os.getenv('CRAWL_STATE_BATCH_SIZE', '500'))
+
+# Fields of a website_data document describing its last crawl
+CRAWL_STATE_FIELDS = ['etag', 'last_modified', 'content_hash', 'crawled_at']
+
+
+def now():
+    return datetime.now(timezone.utc)
+
+
+def crawled_at():
+    return now().isoformat(timespec = 'seconds')
+
+
+def content_hash(body: bytes):
+    return hashlib.sha1(body).hexdigest()
+
+
+def is_fresh(state, stale_after_hours = CRAWL_STALE_AFTER_HOURS):
+    if not state or not state.get('crawled_at'):
+        return False
+    try:
+        last_crawl = datetime.fromisoformat(state['crawled_at'])
+    except ValueError:
+        return False
+    if last_crawl.tzinfo is None:
+        last_crawl = last_crawl.replace(tzinfo = timezone.utc)
+    return now() - last_crawl < timedelta(hours = stale_after_hours)
+
+
+def conditional_headers(state):
+    headers = {}
+    if state and state.get('etag'):
+        headers['If-None-Match'] = state['etag']
+    if state and state.get('last_modified'):
+        headers['If-Modified-Since'] = state['last_modified']
+    return headers
+
+
+async def fetch_crawl_states(es, urls, index = WEBSITE_DATA_INDEX):
+    """
+    Reads the crawl state of websites in one _mget, keyed by their deterministic document id.
+
+    Returns the states by URL, websites never crawled (or crawled before the state was stored) map to None.
+    """
+    urls = list(urls)
+    if not urls:
+        return {}
+    response = await es.mget(index = index, body = {"ids": [document_id(url) for url in urls]},
+                             _source_includes = CRAWL_STATE_FIELDS)
+    return {url: doc.get('_source') if doc.get('found') else None for url, doc in zip(urls, response['docs'])}
+
+
+# Adds the stored crawl state to (row, url) pairs, reading it in batches
+async def with_crawl_states(es, sites, batch_size = CRAWL_STATE_BATCH_SIZE, index = WEBSITE_DATA_INDEX):
+    batch = []
+    for site in sites:
+        batch.append(site)
+        if len(batch) >= batch_size:
+            async for site_state in _batch_states(es, batch, index):
+                yield site_state
+            batch = []
+    async for site_state in _batch_states(es, batch, index):
+        yield site_state
+
+
+async def _batch_states(es, batch, index):
+    try:
+        states = await fetch_crawl_states(es, [url for _, url in batch], index)
+    except Exception as e:
+        # Without the stored state the websites are crawled in full, as in a regular run
+        logger.warning("Failed to read the crawl state of %d websites: %s", len(batch), e)
+        states = {}
+    for row, url in batch:
+        yield row, url, states.get(url)
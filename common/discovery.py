@@ -0,0 +1,104 @@
+import html
+import os
+import re
+from urllib.parse import urljoin, urlsplit, urlunsplit
+
+from common.documents import normalize_domain
+
+# Pages fetched per website besides the home page, and whether sitemap.xml is read for more candidates
+SITE_PAGE_BUDGET = int(os.getenv('SITE_PAGE_BUDGET', '3'))
+SITE_FETCH_SITEMAP = os.getenv('SITE_FETCH_SITEMAP', 'true').lower() == 'true'
+
+SITEMAP_CONTENT_TYPES = {'application/xml', 'text/xml', 'text/plain', 'application/rss+xml'}
+SITEMAP_LOC_PATTERN = re.compile(r'<loc>\s*([^<\s]+)\s*</loc>', re.IGNORECASE)
+
+# Keywords found in the path of pages that usually hold contact details, with their weight
+CANDIDATE_KEYWORDS = [
+    (re.compile(r'contact|kontakt|contacto|contatti|get-in-touch'), 100),
+    (re.compile(r'impressum|imprint|legal-notice|mentions-legales'), 90),
+    (re.compile(r'about|ueber-uns|uber-uns|qui-sommes|chi-siamo'), 60),
+    (re.compile(r'location|office|team|company|support'), 30),
+]
+CONTACT_KEYWORDS = CANDIDATE_KEYWORDS[0][0]
+FOOTER_BONUS = 20
+SKIPPED_EXTENSIONS = ('.pdf', '.jpg', '.jpeg', '.png', '.gif', '.svg', '.webp', '.zip', '.doc', '.docx', '.xls',
+                      '.xlsx', '.mp3', '.mp4', '.xml', '.css', '.js')
+
+
+def sitemap_url(url):
+    parts = urlsplit(url)
+    return urlunsplit((parts.scheme or 'http', parts.netloc, '/sitemap.xml', '', ''))
+
+
+def parse_sitemap(xml_content):
+    return [html.unescape(loc) for loc in SITEMAP_LOC_PATTERN.findall(xml_content)]
+
+
+def normalize_candidate(link):
+    parts = urlsplit(link)
+    if parts.scheme not in ('http', 'https'):
+        return None
+    if parts.path.lower().endswith(SKIPPED_EXTENSIONS):
+        return None
+    # Fragments point into the same page
+    return urlunsplit((parts.scheme, parts.netloc, parts.path or '/', parts.query, ''))
+
+
+def page_key(link):
+    parts = urlsplit(link)
+    return normalize_domain(link), parts.path.rstrip('/').lower(), parts.query
+
+
+def score_candidate(link, in_footer):
+    path = urlsplit(link).path.lower()
+    score = max((weight for pattern, weight in CANDIDATE_KEYWORDS if pattern.search(path)), default = 0)
+    if score and in_footer:
+        score += FOOTER_BONUS
+    return score
+
+
+def rank_candidates(url, links, sitemap_links = (), budget = SITE_PAGE_BUDGET):
+    """
+    Picks the pages of a website most likely to hold contact details.
+
+    `links` are the (link, in_footer) pairs of the home page, `sitemap_links` the URLs listed by its sitemap. Only
+    pages of the same website matching a keyword are kept, without duplicates, the best `budget` of them are returned.
+    """
+    domain = normalize_domain(url)
+    home = normalize_candidate(urljoin(url, '/'))
+    own_page = normalize_candidate(url)
+
+    skipped = {page_key(home), page_key(own_page)}
+
+    # www. and bare host links to one page are the same candidate
+    scores = {}
+    candidates = {}
+    for link, in_footer in list(links) + [(link, False) for link in sitemap_links]:
+        candidate = normalize_candidate(link)
+        if candidate is None or normalize_domain(candidate) != domain:
+            continue
+        key = page_key(candidate)
+        score = score_candidate(candidate, in_footer)
+        if key in skipped or not score:
+            continue
+        if score > scores.get(key, 0):
+            scores[key] = score
+            candidates.setdefault(key, candidate)
+
+    ranked = sorted(scores, key = lambda key: (-scores[key], len(candidates[key])))
+    return [candidates[key] for key in ranked[:budget]]
+
+
+def pick_contact_page(candidates):
+    for candidate in candidates:
+        if CONTACT_KEYWORDS.search(urlsplit(candidate).path.lower()):
+            return candidate
+    return None
+
+
+# Sitemaps are optional, a missing or broken one just yields no candidates
+async def read_sitemap(fetcher, url):
+    try:
+        return parse_sitemap(await fetcher.fetch_text(sitemap_url(url), SITEMAP_CONTENT_TYPES))
+    except Exception:
+        return []
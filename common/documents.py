@@ -0,0 +1,74 @@
+import hashlib
+import re
+from urllib.parse import urlsplit
+
+DEFAULT_COUNTRY_CODE = '1'
+
+
+def normalize_domain(url):
+    url = url.strip().lower()
+    if '://' not in url:
+        url = 'http://' + url
+
+    domain = urlsplit(url).hostname or ''
+    if domain.startswith('www.'):
+        domain = domain[4:]
+    return domain.rstrip('.')
+
+
+# website_data documents are keyed on the normalized domain, so re-crawls and merges address the same document
+def document_id(url):
+    return hashlib.sha1(normalize_domain(url).encode('utf-8')).hexdigest()
+
+
+def normalize_phone(phone_number, country_code = DEFAULT_COUNTRY_CODE):
+    digits = re.sub(r'\D', '', phone_number)
+    if not digits:
+        return None
+    # National numbers, as found on the scraped (North American) pages, get the default country code
+    if not phone_number.strip().startswith('+') and len(digits) == 10:
+        return '+' + country_code + digits
+    return '+' + digits
+
+
+def normalize_facebook_profile(profile):
+    profile = profile.strip().lower()
+    profile = re.sub(r'^(https?://)?(www\.|m\.)?', '', profile)
+    return profile.rstrip('/')
+
+
+# Per-document value counts, summed by the statistics aggregations instead of reading every document
+def count_values(doc):
+    social_links = {platform: len(links or []) for platform, links in (doc.get('social_links') or {}).items()}
+    counts = {
+        'phone_numbers': len(doc.get('phone_numbers') or []),
+        'emails': len(doc.get('emails') or []),
+        'social_links': social_links,
+    }
+    counts['data_points'] = counts['phone_numbers'] + counts['emails'] + sum(social_links.values())
+    return counts
+
+
+# Source written to website_data, the scraped fields plus the normalized keys and counts used for lookups and stats
+def to_document(data):
+    doc = dict(data) if isinstance(data, dict) else dict(data.__dict__)
+
+    doc['domain'] = normalize_domain(doc['url'])
+    doc['phone_numbers_e164'] = sorted(
+        {normalize_phone(number) for number in doc.get('phone_numbers') or []} - {None})
+
+    if doc.get('social_links') and doc['social_links'].get('facebook'):
+        doc['social_links'] = dict(doc['social_links'])
+        doc['social_links']['facebook'] = [
+            normalize_facebook_profile(profile) for profile in doc['social_links']['facebook']]
+
+    doc['counts'] = count_values(doc)
+    if doc.get('error') and not doc.get('error_class'):
+        doc['error_class'] = 'unknown'
+    return doc
+
+
+# Stored documents copied by reindex or the dedup tool get the derived fields of the current to_document, documents
+# written before they existed would otherwise stay unreachable by website or phone lookups
+def refresh_document(source):
+    return to_document(source) if source.get('url') else source
@@ -0,0 +1,33 @@
+from elasticsearch import Elasticsearch, AsyncElasticsearch
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+ELASTIC_USERNAME = os.getenv('ELASTIC_USERNAME')
+ELASTIC_PASSWORD = os.getenv('ELASTIC_PASSWORD')
+ELASTIC_URL = os.getenv('ELASTIC_URL')
+
+# Alias read by the API and written by the tools, it points at one versioned index (see tools/manage_index)
+WEBSITE_DATA_INDEX = os.getenv('WEBSITE_DATA_INDEX', 'website_data')
+# Index the crawlers write to, the alias unless a full re-crawl fills a new versioned index
+CRAWL_INDEX = os.getenv('CRAWL_INDEX', WEBSITE_DATA_INDEX)
+
+
+def create_client(**kwargs):
+    return Elasticsearch(
+        [ELASTIC_URL],
+        basic_auth = (ELASTIC_USERNAME, ELASTIC_PASSWORD),
+        headers = {"Content-Type": "application/json"},
+        api_version = '7.10.1',
+        **kwargs
+    )
+
+
+def create_async_client(**kwargs):
+    return AsyncElasticsearch(
+        [ELASTIC_URL],
+        basic_auth = (ELASTIC_USERNAME, ELASTIC_PASSWORD),
+        headers = {"Content-Type": "application/json"},
+        api_version = '7.10.1',
+        **kwargs
+    )
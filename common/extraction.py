@@ -0,0 +1,122 @@
+import re
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from common.html_links import extract_links
+from common.metrics import EXTRACT, PARSE, stage_timer
+from common.website_data import WebsiteData
+
+PHONE_NUMBERS = 'phone_numbers'
+SOCIAL_LINKS = 'social_links'
+EMAILS = 'emails'
+
+NON_PHONE_CHARACTERS = re.compile(r'[^\d+]')
+# Retina image names (logo@2x.png) look like email addresses
+NON_EMAIL_SUFFIXES = ('.png', '.jpg', '.jpeg', '.gif', '.svg', '.webp')
+
+
+def normalize_phone_match(match):
+    return NON_PHONE_CHARACTERS.sub('', match)
+
+
+def normalize_email_match(match):
+    match = match.lower()
+    return None if match.endswith(NON_EMAIL_SUFFIXES) else match
+
+
+@dataclass(frozen = True)
+class ExtractionRule:
+    name: str
+    pattern: str
+    # WebsiteData field the matches go to, social links are grouped by rule name
+    target: str
+    normalize: Callable[[str], Optional[str]] = str.lower
+
+
+@dataclass
+class Extraction:
+    phone_numbers: List[str] = field(default_factory = list)
+    social_links: Dict[str, List[str]] = field(default_factory = dict)
+    emails: List[str] = field(default_factory = list)
+
+
+DEFAULT_RULES = [
+    ExtractionRule('facebook', r'facebook\.com/[a-zA-Z0-9_.-]+', SOCIAL_LINKS),
+    ExtractionRule('twitter', r'twitter\.com/[a-zA-Z0-9_.-]+', SOCIAL_LINKS),
+    ExtractionRule('linkedin', r'linkedin\.com/[a-zA-Z0-9_.-]+', SOCIAL_LINKS),
+    ExtractionRule('instagram', r'instagram\.com/[a-zA-Z0-9_.-]+', SOCIAL_LINKS),
+    ExtractionRule('youtube', r'youtube\.com/(?:channel/|c/|user/|@)?[a-zA-Z0-9_.-]+', SOCIAL_LINKS),
+    ExtractionRule('tiktok', r'tiktok\.com/@[a-zA-Z0-9_.-]+', SOCIAL_LINKS),
+    ExtractionRule('phone', r'\(\d{3}\) \d{3}-\d{4}', PHONE_NUMBERS, normalize_phone_match),
+    # Local parts only start at the beginning of a run and are bounded like the RFC 5321 limits, an unbounded local
+    # part was retried at every position of a long word, quadratic in its length
+    ExtractionRule('email', r'(?<![a-zA-Z0-9._%+-])[a-zA-Z0-9._%+-]{1,64}'
+                            r'@[a-zA-Z0-9-]{1,63}(?:\.[a-zA-Z0-9-]{1,63})*\.[a-zA-Z]{2,63}', EMAILS, normalize_email_match),
+]
+
+
+class Extractor:
+    """
+    Extracts phone numbers, social links and emails from a document with a set of pluggable rules.
+
+    Every rule is compiled once, when it is registered. Each rule scans the document on its own: CPython's `re` finds
+    the literal prefix of a single pattern (facebook.com/, tiktok.com/@) with a fast search, while an alternation of
+    every rule is tried branch by branch at every position and measured several times slower (tools/benchmark_parsing).
+    Matches are de-duplicated before they are normalized.
+    """
+
+    def __init__(self, rules = None):
+        self.rules = {}
+        for rule in rules if rules is not None else DEFAULT_RULES:
+            self.rules[rule.name] = rule
+        self._compile()
+
+    def register(self, rule: ExtractionRule):
+        self.rules[rule.name] = rule
+        self._compile()
+
+    @property
+    def social_platforms(self):
+        return [rule.name for rule in self.rules.values() if rule.target == SOCIAL_LINKS]
+
+    def _compile(self):
+        self.patterns = {name: re.compile(rule.pattern) for name, rule in self.rules.items()}
+
+    def extract(self, text) -> Extraction:
+        extraction = Extraction()
+        for name, rule in self.rules.items():
+            matches = {match.group() for match in self.patterns[name].finditer(text)}
+            values = {rule.normalize(value) for value in matches} - {None}
+            if rule.target == SOCIAL_LINKS:
+                extraction.social_links[name] = list(values)
+            else:
+                getattr(extraction, rule.target).extend(values)
+        return extraction
+
+
+EXTRACTOR = Extractor()
+
+
+def parse_page(url, html_content, extractor: Extractor = EXTRACTOR) -> WebsiteData:
+    with stage_timer(EXTRACT):
+        extraction = extractor.extract(html_content)
+
+    return WebsiteData(url = url, phone_numbers = extraction.phone_numbers, social_links = extraction.social_links,
+                       emails = extraction.emails)
+
+
+# Home pages also return their (link, in_footer) pairs, the crawler picks the other pages to fetch from them
+def parse_home_page(url, html_content, extractor: Extractor = EXTRACTOR, parser = None):
+    data = parse_page(url, html_content, extractor)
+    with stage_timer(PARSE):
+        links = extract_links(url, html_content, parser)
+    return data, links
+
+
+# Adds the values found on another page of the same website, without duplicates
+def merge_website_data(data: WebsiteData, other: WebsiteData):
+    data.phone_numbers = list(dict.fromkeys(data.phone_numbers + other.phone_numbers))
+    data.emails = list(dict.fromkeys(data.emails + other.emails))
+    for platform, links in other.social_links.items():
+        data.social_links[platform] = list(dict.fromkeys(data.social_links.get(platform, []) + links))
+    return data
@@ -0,0 +1,285 @@
+import asyncio
+import codecs
+import os
+import random
+import re
+import ssl
+from dataclasses import dataclass
+from typing import Optional
+
+import aiohttp
+
+try:
+    import aiodns
+except ImportError:
+    aiodns = None
+
+try:
+    from charset_normalizer import from_bytes as detect_charset
+except ImportError:
+    detect_charset = None
+
+from common.crawl_state import content_hash
+from common.metrics import FETCH, FETCH_ERRORS, FETCHED_BYTES, PAGES_FETCHED, stage_timer
+
+# Headers to mimic a regular browser
+HEADERS_LIST = [
+    {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
+    },
+    {
+        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.0.3 Safari/605.1.15'
+    },
+    {
+        'User-Agent': 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:88.0) Gecko/20100101 Firefox/88.0'
+    }
+]
+
+# Connection pool settings of the crawler sessions
+HTTP_LIMIT = int(os.getenv('HTTP_LIMIT', '200'))
+HTTP_LIMIT_PER_HOST = int(os.getenv('HTTP_LIMIT_PER_HOST', '4'))
+HTTP_DNS_CACHE_TTL = int(os.getenv('HTTP_DNS_CACHE_TTL', '600'))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv('HTTP_KEEPALIVE_TIMEOUT', '30'))
+HTTP_ASYNC_RESOLVER = os.getenv('HTTP_ASYNC_RESOLVER', 'true').lower() == 'true'
+
+# Pages are read in chunks and cut at FETCH_MAX_BYTES, which bounds the memory used by every concurrent fetch
+FETCH_MAX_BYTES = int(os.getenv('FETCH_MAX_BYTES', str(2 * 1024 * 1024)))
+FETCH_CHUNK_SIZE = int(os.getenv('FETCH_CHUNK_SIZE', str(64 * 1024)))
+# Reading stops at the end of the body. Stopping after the first footer is opt-in: pages with a footer per article or
+# card would lose everything below it.
+FETCH_STOP_AT_FOOTER = os.getenv('FETCH_STOP_AT_FOOTER', 'false').lower() == 'true'
+HTML_CONTENT_TYPES = {'text/html', 'application/xhtml+xml', 'text/plain'}
+
+END_OF_BODY_MARKERS = (b'</body',)
+END_OF_FOOTER_MARKERS = (b'</footer', b'</body')
+META_CHARSET_PATTERN = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?([a-zA-Z0-9_-]+)', re.IGNORECASE)
+
+RETRYABLE_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+RETRYABLE = 'retryable'
+PERMANENT = 'permanent'
+
+
+@dataclass
+class Page:
+    url: str
+    status: int
+    # None when the server answered 304 Not Modified
+    text: Optional[str] = None
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    content_hash: Optional[str] = None
+
+    @property
+    def not_modified(self):
+        return self.status == 304
+
+
+class FetchError(Exception):
+    def __init__(self, url, kind, message, status = None, reason = None):
+        super().__init__(f"{message} ({kind})")
+        self.url = url
+        self.kind = kind
+        self.status = status
+        # Short error class used as a metric label
+        self.reason = reason or (f'http_{status}' if status else 'fetch_error')
+
+
+def classify_error(e):
+    if isinstance(e, FetchError):
+        return e.kind
+    # TLS problems are worth a second attempt, it is made without certificate verification
+    if isinstance(e, (aiohttp.ClientSSLError, ssl.SSLError)):
+        return RETRYABLE
+    # DNS failures and refused connections will not fix themselves within a crawl
+    if isinstance(e, aiohttp.ClientConnectorError):
+        return PERMANENT
+    if isinstance(e, (asyncio.TimeoutError, aiohttp.ServerDisconnectedError, aiohttp.ClientPayloadError,
+                      aiohttp.ClientOSError, ConnectionResetError)):
+        return RETRYABLE
+    if isinstance(e, (aiohttp.InvalidURL, aiohttp.TooManyRedirects, UnicodeDecodeError, ValueError)):
+        return PERMANENT
+    return RETRYABLE if isinstance(e, aiohttp.ClientError) else PERMANENT
+
+
+def error_class(e):
+    return e.reason if isinstance(e, FetchError) else type(e).__name__
+
+
+def create_session(limit = HTTP_LIMIT, limit_per_host = HTTP_LIMIT_PER_HOST, dns_cache_ttl = HTTP_DNS_CACHE_TTL,
+                   keepalive_timeout = HTTP_KEEPALIVE_TIMEOUT, async_resolver = HTTP_ASYNC_RESOLVER):
+    # aiodns resolves without the default thread pool resolver, it is used when installed
+    resolver = aiohttp.AsyncResolver() if async_resolver and aiodns is not None else None
+    connector = aiohttp.TCPConnector(
+        limit = limit,
+        limit_per_host = limit_per_host,
+        ttl_dns_cache = dns_cache_ttl,
+        keepalive_timeout = keepalive_timeout,
+        enable_cleanup_closed = True,
+        resolver = resolver
+    )
+    return aiohttp.ClientSession(connector = connector)
+
+
+def create_fallback_session():
+    # Second attempt settings: no certificate verification, no connection reuse and plain HTTP/1.0
+    connector = aiohttp.TCPConnector(ssl = False, force_close = True, limit = 0)
+    return aiohttp.ClientSession(connector = connector, version = aiohttp.HttpVersion10)
+
+
+def is_known_encoding(encoding):
+    try:
+        codecs.lookup(encoding)
+        return True
+    except LookupError:
+        return False
+
+
+# Header charset first, then a <meta> charset, then UTF-8, the charset detector only runs when all of those fail
+def decode_body(body: bytes, header_charset = None):
+    declared = header_charset
+    if not declared:
+        match = META_CHARSET_PATTERN.search(body, 0, 4096)
+        if match:
+            declared = match.group(1).decode('ascii')
+
+    if declared and is_known_encoding(declared):
+        return body.decode(declared, errors = 'replace')
+
+    try:
+        return body.decode('utf-8')
+    except UnicodeDecodeError:
+        pass
+
+    if detect_charset is not None:
+        best = detect_charset(body).best()
+        if best is not None:
+            return str(best)
+    return body.decode('latin-1')
+
+
+class Fetcher:
+    """
+    Fetches pages without blocking the event loop.
+
+    The first attempt goes through the crawler session, retryable failures (timeouts, dropped connections, TLS errors,
+    429/5xx) are retried through a fallback session with different connection settings, after a jittered exponential
+    backoff. Permanent failures raise a `FetchError` straight away.
+
+    Responses that are not HTML are rejected from their headers, bodies are streamed in `chunk_size` chunks and cut at
+    `max_bytes`, or at the end of the body (of the first footer when `stop_at_footer` is set).
+    """
+
+    def __init__(self, session, timeout = 10, max_attempts = 2, backoff = 0.5, max_backoff = 8.0,
+                 max_bytes = FETCH_MAX_BYTES, chunk_size = FETCH_CHUNK_SIZE, stop_at_footer = FETCH_STOP_AT_FOOTER):
+        self.session = session
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.end_markers = END_OF_FOOTER_MARKERS if stop_at_footer else END_OF_BODY_MARKERS
+        self._fallback_session = None
+
+        self.bytes_read = 0
+        self.peak_body_bytes = 0
+        self.truncated = 0
+        self.stopped_early = 0
+        self.rejected_content_types = 0
+        self.not_modified = 0
+
+    def stats(self):
+        return {
+            "bytes_read": self.bytes_read,
+            "peak_body_bytes": self.peak_body_bytes,
+            "truncated": self.truncated,
+            "stopped_early": self.stopped_early,
+            "rejected_content_types": self.rejected_content_types,
+            "not_modified": self.not_modified,
+        }
+
+    @property
+    def fallback_session(self):
+        if self._fallback_session is None:
+            self._fallback_session = create_fallback_session()
+        return self._fallback_session
+
+    async def close(self):
+        if self._fallback_session is not None:
+            await self._fallback_session.close()
+            self._fallback_session = None
+
+    async def fetch_text(self, url, content_types = HTML_CONTENT_TYPES):
+        return (await self.fetch_page(url, content_types = content_types)).text
+
+    # Conditional headers (If-None-Match, If-Modified-Since) turn an unchanged page into a bodiless 304
+    async def fetch_page(self, url, headers = None, content_types = HTML_CONTENT_TYPES) -> Page:
+        try:
+            with stage_timer(FETCH):
+                page = await self._fetch_page(url, headers, content_types)
+        except FetchError as e:
+            FETCH_ERRORS.labels(e.kind, e.reason).inc()
+            raise
+        PAGES_FETCHED.labels('not_modified' if page.not_modified else 'ok').inc()
+        return page
+
+    async def _fetch_page(self, url, headers, content_types):
+        for attempt in range(self.max_attempts):
+            session = self.session if attempt == 0 else self.fallback_session
+            try:
+                return await self._get(session, url, content_types, headers)
+            except Exception as e:
+                kind = classify_error(e)
+                if kind == PERMANENT or attempt == self.max_attempts - 1:
+                    if isinstance(e, FetchError):
+                        raise
+                    raise FetchError(url, kind, f"{type(e).__name__}: {e}", reason = type(e).__name__) from e
+
+            # Full jitter, so failures clustered on one network blip do not retry in lockstep
+            delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+            await asyncio.sleep(random.uniform(0, delay))
+
+    async def _get(self, session, url, content_types = HTML_CONTENT_TYPES, extra_headers = None):
+        headers = {**random.choice(HEADERS_LIST), **(extra_headers or {})}
+        async with session.get(url, headers = headers, timeout = aiohttp.ClientTimeout(total = self.timeout)) as response:
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+            if response.status == 304 and extra_headers:
+                self.not_modified += 1
+                return Page(url, 304, etag = etag, last_modified = last_modified)
+
+            if response.status != 200:
+                kind = RETRYABLE if response.status in RETRYABLE_STATUSES else PERMANENT
+                raise FetchError(url, kind, f"HTTP {response.status}", status = response.status)
+
+            content_type = response.content_type if response.headers.get('Content-Type') else None
+            if content_type and content_type not in content_types:
+                self.rejected_content_types += 1
+                raise FetchError(url, PERMANENT, f"Unsupported content type {content_type}", reason = 'content_type')
+
+            body = await self._read_body(response)
+            return Page(url, 200, decode_body(body, response.charset), etag = etag, last_modified = last_modified,
+                        content_hash = content_hash(body))
+
+    async def _read_body(self, response):
+        body = bytearray()
+        async for chunk in response.content.iter_chunked(self.chunk_size):
+            # Markers may straddle two chunks, so the search starts a few bytes before the new chunk
+            search_from = max(len(body) - 8, 0)
+            body += chunk
+
+            if len(body) >= self.max_bytes:
+                del body[self.max_bytes:]
+                self.truncated += 1
+                break
+
+            window = bytes(body[search_from:]).lower()
+            if any(marker in window for marker in self.end_markers):
+                self.stopped_early += 1
+                break
+
+        self.bytes_read += len(body)
+        FETCHED_BYTES.inc(len(body))
+        self.peak_body_bytes = max(self.peak_body_bytes, len(body))
+        return bytes(body)
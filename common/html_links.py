@@ -0,0 +1,84 @@
+import html
+import os
+import re
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+
+try:
+    from selectolax.parser import HTMLParser as SelectolaxParser
+except ImportError:
+    SelectolaxParser = None
+
+try:
+    import lxml.html as lxml_html
+except ImportError:
+    lxml_html = None
+
+STREAM = 'stream'
+SELECTOLAX = 'selectolax'
+LXML = 'lxml'
+BS4 = 'bs4'
+
+# Link discovery backend: stream only tokenizes anchors, the others build a DOM, bs4 being the slowest
+HTML_PARSER = os.getenv('HTML_PARSER', STREAM)
+
+ANCHOR_HREF_PATTERN = re.compile(
+    r'<a\s[^>]*?\bhref\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))',
+    re.IGNORECASE
+)
+
+
+FOOTER_PATTERN = re.compile(r'<footer\b', re.IGNORECASE)
+
+
+# Backends yield (href, in_footer) for every anchor of the page
+def stream_hrefs(html_content):
+    footer = FOOTER_PATTERN.search(html_content)
+    footer_start = footer.start() if footer else len(html_content)
+    for match in ANCHOR_HREF_PATTERN.finditer(html_content):
+        href = html.unescape(match.group(1) or match.group(2) or match.group(3) or '')
+        yield href, match.start() > footer_start
+
+
+def selectolax_hrefs(html_content):
+    tree = SelectolaxParser(html_content)
+    footer_hrefs = {node.attributes.get('href') for node in tree.css('footer a[href]')}
+    for node in tree.css('a[href]'):
+        href = node.attributes.get('href') or ''
+        yield href, href in footer_hrefs
+
+
+def lxml_hrefs(html_content):
+    try:
+        tree = lxml_html.fromstring(html_content)
+    except (ValueError, lxml_html.etree.ParserError):
+        return
+    footer_hrefs = set(tree.xpath('//footer//a/@href'))
+    for href in tree.xpath('//a/@href'):
+        yield href, href in footer_hrefs
+
+
+def bs4_hrefs(html_content):
+    soup = BeautifulSoup(html_content, 'html.parser')
+    footer_hrefs = {a['href'] for a in soup.select('footer a[href]')}
+    for a in soup.find_all('a', href = True):
+        yield a['href'], a['href'] in footer_hrefs
+
+
+BACKENDS = {
+    STREAM: stream_hrefs,
+    SELECTOLAX: selectolax_hrefs if SelectolaxParser is not None else None,
+    LXML: lxml_hrefs if lxml_html is not None else None,
+    BS4: bs4_hrefs,
+}
+
+
+def get_backend(name = None):
+    backend = BACKENDS.get(name or HTML_PARSER)
+    # A backend whose package is not installed falls back to BeautifulSoup
+    return backend if backend is not None else bs4_hrefs
+
+
+def extract_links(url, html_content, backend = None):
+    return [(urljoin(url, href), in_footer) for href, in_footer in get_backend(backend)(html_content) if href]
@@ -0,0 +1,92 @@
+import time
+
+from elasticsearch import helpers
+
+from common.change_log import record_reset
+from common.documents import refresh_document
+from common.elastic import WEBSITE_DATA_INDEX
+from common.mappings import WEBSITE_DATA_MAPPINGS, WEBSITE_DATA_SETTINGS
+
+# Settings of an index being filled by a full crawl or a reindex, restored by `finish_bulk_load`
+BULK_LOAD_SETTINGS = {"refresh_interval": "-1", "number_of_replicas": 0}
+
+
+# website_data is an alias, the data lives in versioned indices named after the alias and their creation time
+def versioned_index_name(alias = WEBSITE_DATA_INDEX):
+    return f"{alias}-{time.strftime('%Y%m%d%H%M%S')}"
+
+
+def create_versioned_index(es, alias = WEBSITE_DATA_INDEX, shards = 1, replicas = 1, bulk_load = True):
+    index = versioned_index_name(alias)
+    settings = {"number_of_shards": shards, "number_of_replicas": replicas, **WEBSITE_DATA_SETTINGS}
+    if bulk_load:
+        settings.update(BULK_LOAD_SETTINGS)
+    es.indices.create(index = index, body = {"settings": settings, "mappings": WEBSITE_DATA_MAPPINGS})
+    return index
+
+
+def finish_bulk_load(es, index, replicas = 1):
+    es.indices.put_settings(index = index, body = {"refresh_interval": None, "number_of_replicas": replicas})
+    es.indices.refresh(index = index)
+
+
+def alias_indices(es, alias = WEBSITE_DATA_INDEX):
+    if not es.indices.exists_alias(name = alias):
+        return []
+    return list(es.indices.get_alias(name = alias))
+
+
+def is_concrete_index(es, name = WEBSITE_DATA_INDEX):
+    return es.indices.exists(index = name) and not es.indices.exists_alias(name = name)
+
+
+def swap_alias(es, index, alias = WEBSITE_DATA_INDEX, drop_old = True):
+    """
+    Points the alias at `index` in a single atomic update, readers and writers never see a missing alias.
+
+    Indices previously behind the alias are deleted afterwards unless `drop_old` is False. An index named like the
+    alias (from before aliases were used) is removed in the same update, as an alias cannot share its name, so it
+    cannot be kept: a ValueError is raised when `drop_old` is False. Returns the indices that were behind the alias.
+    """
+    legacy_index = is_concrete_index(es, alias)
+    if legacy_index and not drop_old:
+        raise ValueError(f'{alias} is an index from before the alias and would be deleted by the swap, copy it into a '
+                         f'versioned index with reindex first')
+
+    old_indices = [name for name in alias_indices(es, alias) if name != index]
+    actions = [{"remove": {"index": name, "alias": alias}} for name in old_indices]
+    if legacy_index:
+        actions.append({"remove_index": {"index": alias}})
+    actions.append({"add": {"index": index, "alias": alias}})
+    es.indices.update_aliases(body = {"actions": actions})
+
+    # Cached API results may come from the previous index
+    record_reset(es)
+
+    if drop_old and old_indices:
+        es.indices.delete(index = ','.join(old_indices))
+    return old_indices
+
+
+def generate_reindex_actions(es, source, destination, chunk_size):
+    for hit in helpers.scan(es, index = source, query = {"query": {"match_all": {}}}, size = chunk_size):
+        yield {"_op_type": "index", "_index": destination, "_id": hit['_id'],
+               "_source": refresh_document(hit['_source'])}
+
+
+def reindex(es, source, destination, chunk_size = 1000):
+    """
+    Copies every document of `source` into `destination` under the same id.
+
+    Documents go through the client instead of the _reindex API so they are rewritten by `refresh_document` and get
+    the derived lookup fields of the current mapping. Returns the totals in the shape of a _reindex response.
+    """
+    start_time = time.time()
+    total = 0
+    failures = []
+    for ok, result in helpers.streaming_bulk(es, generate_reindex_actions(es, source, destination, chunk_size),
+                                             chunk_size = chunk_size, raise_on_error = False, max_retries = 3):
+        total += 1
+        if not ok:
+            failures.append(next(iter(result.values())))
+    return {"total": total, "took": int((time.time() - start_time) * 1000), "failures": failures}
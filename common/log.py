@@ -0,0 +1,41 @@
+import logging
+import os
+import random
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+# Share of the DEBUG records kept, per-page records are logged at DEBUG so a large crawl can log a sample of them
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '1.0'))
+LOG_FORMAT = '%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s'
+
+_configured = False
+
+
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate, max_level = logging.DEBUG):
+        super().__init__()
+        self.rate = rate
+        self.max_level = max_level
+
+    def filter(self, record):
+        return record.levelno > self.max_level or self.rate >= 1 or random.random() < self.rate
+
+
+def configure_logging(level = LOG_LEVEL, sample_rate = LOG_SAMPLE_RATE):
+    global _configured
+    if _configured:
+        return
+    _configured = True
+
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    # Records dropped by the filter are never formatted
+    handler.addFilter(SamplingFilter(sample_rate))
+
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level)
+
+
+def get_logger(name):
+    configure_logging()
+    return logging.getLogger(name)
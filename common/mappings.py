@@ -0,0 +1,126 @@
+WEBSITE_DATA_SETTINGS = {
+    "analysis": {
+        "normalizer": {
+            "lowercase_normalizer": {
+                "type": "custom",
+                "filter": ["lowercase"]
+            }
+        },
+        "filter": {
+            "phone_suffix_ngram": {
+                "type": "edge_ngram",
+                "min_gram": 4,
+                "max_gram": 16
+            },
+            "name_prefix_ngram": {
+                "type": "edge_ngram",
+                "min_gram": 2,
+                "max_gram": 20
+            }
+        },
+        "analyzer": {
+            # Numbers are reversed before being split in edge n-grams, so a partial number matches on its suffix
+            "phone_suffix": {
+                "type": "custom",
+                "tokenizer": "keyword",
+                "filter": ["reverse", "phone_suffix_ngram"]
+            },
+            "phone_suffix_search": {
+                "type": "custom",
+                "tokenizer": "keyword",
+                "filter": ["reverse"]
+            },
+            # Every word of a normalized name is indexed with its prefixes, so partial words match without fuzziness
+            "name_prefix": {
+                "type": "custom",
+                "tokenizer": "whitespace",
+                "filter": ["name_prefix_ngram"]
+            },
+            "name_prefix_search": {
+                "type": "custom",
+                "tokenizer": "whitespace"
+            }
+        }
+    }
+}
+
+SOCIAL_LINK_FIELD = {"type": "keyword", "normalizer": "lowercase_normalizer"}
+
+NAME_FIELD = {
+    "type": "text",
+    "fields": {
+        "keyword": {"type": "keyword", "ignore_above": 256}
+    }
+}
+
+WEBSITE_DATA_MAPPINGS = {
+    "dynamic": True,
+    "properties": {
+        "url": {
+            "type": "text",
+            "fields": {
+                "keyword": {"type": "keyword", "ignore_above": 2048}
+            }
+        },
+        "domain": {"type": "keyword"},
+        "phone_numbers": {"type": "keyword"},
+        "phone_numbers_e164": {
+            "type": "keyword",
+            "fields": {
+                "suffix": {
+                    "type": "text",
+                    "analyzer": "phone_suffix",
+                    "search_analyzer": "phone_suffix_search"
+                }
+            }
+        },
+        "social_links": {
+            "properties": {
+                "facebook": SOCIAL_LINK_FIELD,
+                "twitter": SOCIAL_LINK_FIELD,
+                "linkedin": SOCIAL_LINK_FIELD,
+                "instagram": SOCIAL_LINK_FIELD,
+                "youtube": SOCIAL_LINK_FIELD,
+                "tiktok": SOCIAL_LINK_FIELD
+            }
+        },
+        "emails": {"type": "keyword", "normalizer": "lowercase_normalizer"},
+        "contact_page": {"type": "keyword", "index": False},
+        "error": {"type": "text"},
+        "error_class": {"type": "keyword"},
+        "counts": {
+            "properties": {
+                "phone_numbers": {"type": "integer"},
+                "emails": {"type": "integer"},
+                "data_points": {"type": "integer"},
+                "social_links": {
+                    "properties": {
+                        "facebook": {"type": "integer"},
+                        "twitter": {"type": "integer"},
+                        "linkedin": {"type": "integer"},
+                        "instagram": {"type": "integer"},
+                        "youtube": {"type": "integer"},
+                        "tiktok": {"type": "integer"}
+                    }
+                }
+            }
+        },
+        "etag": {"type": "keyword", "index": False},
+        "last_modified": {"type": "keyword", "index": False},
+        "content_hash": {"type": "keyword", "index": False},
+        "crawled_at": {"type": "date"},
+        "legal_name": NAME_FIELD,
+        "commercial_names": NAME_FIELD,
+        "all_company_names": NAME_FIELD,
+        # Written by the merge tool from common.names, queried with cheap term queries before any fuzzy matching
+        "names_normalized": {
+            "type": "keyword",
+            "fields": {
+                "prefix": {"type": "text", "analyzer": "name_prefix", "search_analyzer": "name_prefix_search"}
+            }
+        },
+        "names_stripped": {"type": "keyword"},
+        "names_phonetic": {"type": "keyword"},
+        "name_suggest": {"type": "completion"}
+    }
+}
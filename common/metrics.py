@@ -0,0 +1,62 @@
+import os
+
+from prometheus_client import (CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest,
+                               start_http_server)
+from prometheus_client import multiprocess
+
+# Processes forked by Celery or the parse pool report through files in this directory, when it is set
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+# Port of the /metrics endpoint of the scrapers and Celery workers, 0 disables it
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+
+FETCH = 'fetch'
+PARSE = 'parse'
+EXTRACT = 'extract'
+FOLLOW_UP = 'follow_up'
+INDEX = 'index'
+
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+STAGE_SECONDS = Histogram(
+    'crawler_stage_seconds', 'Time spent in a crawl stage.', ['stage'], buckets = STAGE_BUCKETS
+)
+PAGES_FETCHED = Counter('crawler_pages_fetched_total', 'Pages fetched, by response.', ['result'])
+FETCHED_BYTES = Counter('crawler_fetched_bytes_total', 'Bytes of page bodies read.')
+FETCH_ERRORS = Counter('crawler_fetch_errors_total', 'Failed fetches, by error kind and reason.', ['kind', 'reason'])
+DOCUMENTS_INDEXED = Counter('crawler_documents_indexed_total', 'Documents written to Elasticsearch.')
+INDEX_FAILURES = Counter('crawler_index_failures_total', 'Documents rejected by Elasticsearch.', ['status'])
+
+NAME_LOOKUPS = Counter('api_name_lookups_total', 'Name lookups by the tier that answered them.', ['tier'])
+SNAPSHOT_LOOKUPS = Counter('api_snapshot_lookups_total', 'Exact lookups answered from the snapshot.', ['result'])
+API_REQUEST_SECONDS = Histogram(
+    'api_request_seconds', 'Time spent answering an API request.', ['route', 'method', 'status'],
+    buckets = STAGE_BUCKETS
+)
+
+
+def stage_timer(stage):
+    return STAGE_SECONDS.labels(stage).time()
+
+
+def registry():
+    if not PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import REGISTRY
+        return REGISTRY
+    collector_registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(collector_registry)
+    return collector_registry
+
+
+def metrics_payload():
+    return generate_latest(registry()), CONTENT_TYPE_LATEST
+
+
+def start_metrics_server(port = METRICS_PORT):
+    if port:
+        start_http_server(port, registry = registry())
+
+
+def mark_process_dead(pid):
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(pid)
+
@@ -0,0 +1,78 @@
+import re
+import unicodedata
+
+# Legal forms dropped from the end of a company name, "Acme Widgets Inc." and "ACME Widgets, LLC" both become
+# "acme widgets"
+LEGAL_SUFFIXES = {
+    'inc', 'incorporated', 'corp', 'corporation', 'co', 'company', 'llc', 'llp', 'lp', 'pllc', 'pc', 'ltd', 'limited',
+    'plc', 'lc', 'gmbh', 'mbh', 'ag', 'kg', 'ug', 'sa', 'sas', 'sarl', 'srl', 'spa', 'bv', 'nv', 'ab', 'as', 'oy',
+    'pty', 'pte', 'sl', 'kft', 'doo', 'ou', 'group', 'holdings',
+}
+LEADING_ARTICLES = {'the'}
+
+NON_ALPHANUMERIC = re.compile(r'[^a-z0-9]+')
+# Abbreviations written with dots or spaces ("L.L.C.", "L L C") are joined before suffixes are dropped
+SPLIT_ABBREVIATION = re.compile(r'\b((?:[a-z] ){1,3}[a-z])\b')
+
+SOUNDEX_CODES = {
+    **dict.fromkeys('bfpv', '1'), **dict.fromkeys('cgjkqsxz', '2'), **dict.fromkeys('dt', '3'), 'l': '4',
+    **dict.fromkeys('mn', '5'), 'r': '6',
+}
+
+
+def normalize_name(name):
+    name = unicodedata.normalize('NFKD', name or '').encode('ascii', 'ignore').decode('ascii').lower()
+    name = name.replace('&', ' and ').replace("'", '')
+    name = NON_ALPHANUMERIC.sub(' ', name).strip()
+    return SPLIT_ABBREVIATION.sub(lambda match: match.group(1).replace(' ', ''), name)
+
+
+def strip_legal_suffixes(normalized_name):
+    tokens = normalized_name.split()
+    while len(tokens) > 1 and tokens[-1] in LEGAL_SUFFIXES:
+        tokens.pop()
+    if len(tokens) > 1 and tokens[0] in LEADING_ARTICLES:
+        tokens.pop(0)
+    return ' '.join(tokens)
+
+
+def soundex(token):
+    if not token:
+        return ''
+    if token.isdigit():
+        return token
+    code = token[0]
+    previous = SOUNDEX_CODES.get(token[0])
+    for character in token[1:]:
+        digit = SOUNDEX_CODES.get(character)
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        # h and w do not separate two letters with the same code, vowels do
+        if character not in 'hw':
+            previous = digit
+    return code.ljust(4, '0')
+
+
+# Sounds-alike key of a name, "Jonsons Plumbing" and "Johnsons Plumbing" share it
+def phonetic_key(stripped_name):
+    return ' '.join(soundex(token) for token in stripped_name.split())
+
+
+def name_fields(names):
+    """
+    Precomputed lookup fields of the names of a company, written next to all_company_names.
+
+    The API normalizes a queried name the same way and looks these fields up with term queries, fuzzy matching is only
+    a fallback.
+    """
+    normalized = list(dict.fromkeys(filter(None, (normalize_name(name) for name in names or []))))
+    stripped = list(dict.fromkeys(filter(None, (strip_legal_suffixes(name) for name in normalized))))
+    suggest_inputs = list(dict.fromkeys(list(names or []) + stripped))
+    return {
+        'names_normalized': normalized,
+        'names_stripped': stripped,
+        'names_phonetic': list(dict.fromkeys(filter(None, (phonetic_key(name) for name in stripped)))),
+        'name_suggest': {'input': suggest_inputs} if suggest_inputs else None,
+    }
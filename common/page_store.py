@@ -0,0 +1,182 @@
+import asyncio
+import glob
+import gzip
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import List, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Fetched pages are kept in PAGE_STORE_DIR when set, for re-extraction without crawling again
+PAGE_STORE_DIR = os.getenv('PAGE_STORE_DIR')
+PAGE_STORE_SEGMENT_BYTES = int(os.getenv('PAGE_STORE_SEGMENT_BYTES', str(256 * 1024 * 1024)))
+PAGE_STORE_COMPRESSION = os.getenv('PAGE_STORE_COMPRESSION', 'zstd' if zstandard is not None else 'gzip')
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+SEGMENT_SUFFIXES = {GZIP: '.warc.gz', ZSTD: '.warc.zst'}
+INDEX_SUFFIX = '.idx'
+
+SITE_HEADER = 'X-Crawl-Site'
+
+
+@dataclass
+class PageRecord:
+    site: str
+    url: str
+    offset: int
+    length: int
+
+
+def compress(record: bytes, compression):
+    if compression == ZSTD:
+        return zstandard.ZstdCompressor(level = 3).compress(record)
+    return gzip.compress(record, compresslevel = 6)
+
+
+def decompress(member: bytes, compression):
+    if compression == ZSTD:
+        return zstandard.ZstdDecompressor().decompress(member)
+    return gzip.decompress(member)
+
+
+def segment_compression(path):
+    return ZSTD if path.endswith(SEGMENT_SUFFIXES[ZSTD]) else GZIP
+
+
+# WARC resource record holding the decoded page, the site header groups the pages of one website
+def build_record(site, url, html_content):
+    body = html_content.encode('utf-8')
+    headers = (
+        f"WARC/1.0\r\n"
+        f"WARC-Type: resource\r\n"
+        f"WARC-Record-ID: <urn:uuid:{uuid.uuid4()}>\r\n"
+        f"WARC-Date: {datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')}\r\n"
+        f"WARC-Target-URI: {url}\r\n"
+        f"{SITE_HEADER}: {site}\r\n"
+        f"Content-Type: text/html; charset=utf-8\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"\r\n"
+    )
+    return headers.encode('utf-8') + body + b'\r\n\r\n'
+
+
+def parse_record(record: bytes):
+    head, _, rest = record.partition(b'\r\n\r\n')
+    headers = {}
+    for line in head.decode('utf-8').split('\r\n')[1:]:
+        name, _, value = line.partition(':')
+        headers[name.strip()] = value.strip()
+    body = rest[:int(headers.get('Content-Length', len(rest)))]
+    return headers, body.decode('utf-8')
+
+
+class PageStore:
+    """
+    Appends fetched pages to compressed, append-only WARC segment files.
+
+    Every record is compressed on its own (a gzip member or a zstd frame), so a record is read back by seeking to the
+    offset stored in the `.idx` file next to its segment. The pages of a website are written together, home page
+    first. Segments roll over at `segment_bytes`, and names include the process id so several crawler processes can
+    share a directory. Writes made through `async_write_site` are compressed and written on one background thread.
+    """
+
+    def __init__(self, directory, segment_bytes = PAGE_STORE_SEGMENT_BYTES, compression = PAGE_STORE_COMPRESSION):
+        if compression == ZSTD and zstandard is None:
+            compression = GZIP
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.compression = compression
+        self.sequence = 0
+        self.segment = None
+        self.index = None
+        self.executor = ThreadPoolExecutor(max_workers = 1)
+
+        self.pages_written = 0
+        self.bytes_written = 0
+        os.makedirs(directory, exist_ok = True)
+
+    def _open_segment(self):
+        self._close_segment()
+        self.sequence += 1
+        name = f"segment-{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}-{self.sequence:05d}"
+        path = os.path.join(self.directory, name + SEGMENT_SUFFIXES[self.compression])
+        self.segment = open(path, 'ab')
+        self.index = open(path + INDEX_SUFFIX, 'a', encoding = 'utf-8')
+
+    def _close_segment(self):
+        if self.segment is not None:
+            self.segment.close()
+            self.index.close()
+            self.segment = None
+            self.index = None
+
+    def write_site(self, site, pages: List[Tuple[str, str]]):
+        if self.segment is None or self.segment.tell() >= self.segment_bytes:
+            self._open_segment()
+
+        entries = []
+        for url, html_content in pages:
+            member = compress(build_record(site, url, html_content), self.compression)
+            offset = self.segment.tell()
+            self.segment.write(member)
+            entries.append(f"{site}\t{url}\t{offset}\t{len(member)}\n")
+            self.bytes_written += len(member)
+
+        # Index entries only point at records already written, a crash leaves at most unindexed records
+        self.segment.flush()
+        self.index.write(''.join(entries))
+        self.index.flush()
+        self.pages_written += len(pages)
+
+    async def async_write_site(self, site, pages: List[Tuple[str, str]]):
+        await asyncio.get_running_loop().run_in_executor(self.executor, self.write_site, site, pages)
+
+    def close(self):
+        self.executor.shutdown(wait = True)
+        self._close_segment()
+
+
+def list_segments(directory):
+    return sorted(
+        path for suffix in SEGMENT_SUFFIXES.values() for path in glob.glob(os.path.join(directory, '*' + suffix))
+    )
+
+
+def read_index(segment_path) -> List[PageRecord]:
+    records = []
+    if not os.path.exists(segment_path + INDEX_SUFFIX):
+        return records
+    with open(segment_path + INDEX_SUFFIX, encoding = 'utf-8') as index_file:
+        for line in index_file:
+            parts = line.rstrip('\n').split('\t')
+            if len(parts) == 4:
+                records.append(PageRecord(parts[0], parts[1], int(parts[2]), int(parts[3])))
+    return records
+
+
+# Groups consecutive records of the same website, the first one being its home page
+def group_sites(records: List[PageRecord]):
+    sites = []
+    for record in records:
+        if sites and sites[-1][0].site == record.site:
+            sites[-1].append(record)
+        else:
+            sites.append([record])
+    return sites
+
+
+def read_pages(segment_path, records: List[PageRecord]):
+    compression = segment_compression(segment_path)
+    with open(segment_path, 'rb') as segment:
+        for record in records:
+            segment.seek(record.offset)
+            _, html_content = parse_record(decompress(segment.read(record.length), compression))
+            yield record.url, html_content
@@ -0,0 +1,39 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from common.extraction import parse_home_page, parse_page
+
+PARSE_WORKERS = int(os.getenv('PARSE_WORKERS', '0'))
+
+
+class PageParser:
+    """
+    Runs `parse_page` and `parse_home_page` for the crawler, inline or in a pool of worker processes.
+
+    With `workers` > 0 pages are parsed in a ProcessPoolExecutor so parsing uses every core while fetching stays on
+    the event loop. At most `max_pending` pages wait for or sit in the pool, fetches beyond that wait for a slot.
+    """
+
+    def __init__(self, workers = PARSE_WORKERS, max_pending = None):
+        self.workers = workers
+        self.pool = ProcessPoolExecutor(max_workers = workers) if workers > 0 else None
+        self.pending = asyncio.Semaphore(max_pending or max(workers, 1) * 4)
+
+    async def parse(self, url, html_content):
+        return await self._run(parse_page, url, html_content)
+
+    async def parse_home(self, url, html_content):
+        return await self._run(parse_home_page, url, html_content)
+
+    async def _run(self, function, url, html_content):
+        if self.pool is None:
+            return function(url, html_content)
+
+        async with self.pending:
+            return await asyncio.get_running_loop().run_in_executor(self.pool, function, url, html_content)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait = True, cancel_futures = True)
+            self.pool = None
@@ -0,0 +1,217 @@
+import hashlib
+import mmap
+import os
+import struct
+import time
+
+import msgpack
+
+# Directory holding the published snapshots and the CURRENT pointer file, the API only reads it when set
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR')
+# Seconds between two checks of the CURRENT pointer file by the API
+SNAPSHOT_RELOAD_INTERVAL = float(os.getenv('SNAPSHOT_RELOAD_INTERVAL', '5'))
+
+MAGIC = b'CSNAP001'
+# magic, slot count, key count
+HEADER = struct.Struct('<8sQQ')
+# key hash, payload offset + 1 (0 marks an empty slot)
+SLOT = struct.Struct('<QQ')
+PAYLOAD_LENGTH = struct.Struct('<I')
+
+KEYS_SUFFIX = '.keys'
+PAYLOADS_SUFFIX = '.payloads'
+CURRENT = 'CURRENT'
+
+DOMAIN_KEY = 'd:'
+PHONE_KEY = 'p:'
+FACEBOOK_KEY = 'f:'
+
+
+# 64 bit hashes stand for the keys, a false match needs a collision among 2^64 values
+def key_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size = 8).digest(), 'little')
+
+
+def slot_count(keys):
+    # Load factor of at most one half keeps linear probing short
+    count = 8
+    while count < keys * 2:
+        count *= 2
+    return count
+
+
+class SnapshotWriter:
+    """
+    Writes a snapshot: an open addressing hash table of key hashes (`.keys`) pointing at msgpack payloads (`.payloads`).
+
+    Payloads are appended as documents are added and shared by every key of a document, the table is written by
+    `close()` once every key is known. The first document added for a key wins.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.payloads = open(path + PAYLOADS_SUFFIX, 'wb')
+        self.entries = []
+        self.documents = 0
+
+    def add(self, keys, payload):
+        # Offsets are stored plus one so an empty slot is all zeros
+        offset = self.payloads.tell() + 1
+        packed = msgpack.packb(payload)
+        self.payloads.write(PAYLOAD_LENGTH.pack(len(packed)) + packed)
+        self.entries.extend((key_hash(key), offset) for key in keys)
+        self.documents += 1
+
+    def close(self):
+        self.payloads.close()
+
+        slots = slot_count(len(self.entries))
+        table = bytearray(slots * SLOT.size)
+        mask = slots - 1
+        keys = 0
+        for hashed, offset in self.entries:
+            position = hashed & mask
+            while True:
+                stored_hash, stored_offset = SLOT.unpack_from(table, position * SLOT.size)
+                if not stored_offset:
+                    SLOT.pack_into(table, position * SLOT.size, hashed, offset)
+                    keys += 1
+                    break
+                if stored_hash == hashed:
+                    break
+                position = (position + 1) & mask
+
+        with open(self.path + KEYS_SUFFIX, 'wb') as keys_file:
+            keys_file.write(HEADER.pack(MAGIC, slots, keys))
+            keys_file.write(table)
+        self.entries = []
+        return keys
+
+
+def publish(directory, name, keep = 2):
+    # The pointer is replaced atomically, readers switch on their next check
+    pointer = os.path.join(directory, CURRENT)
+    with open(pointer + '.tmp', 'w') as pointer_file:
+        pointer_file.write(name)
+    os.replace(pointer + '.tmp', pointer)
+
+    # Older snapshots go, the previous one stays for readers that have not switched yet
+    names = sorted({
+        file_name[:-len(suffix)] for file_name in os.listdir(directory) for suffix in (KEYS_SUFFIX, PAYLOADS_SUFFIX)
+        if file_name.endswith(suffix)
+    })
+    for old_name in names[:-keep]:
+        if old_name == name:
+            continue
+        for suffix in (KEYS_SUFFIX, PAYLOADS_SUFFIX):
+            path = os.path.join(directory, old_name + suffix)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class Snapshot:
+    """
+    Read-only view of a snapshot through mmap.
+
+    The files are mapped, not read, so every API process shares the same pages of the OS page cache and a lookup only
+    touches the slots it probes and the payload it returns.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path + KEYS_SUFFIX, 'rb') as keys_file:
+            self.keys = mmap.mmap(keys_file.fileno(), 0, access = mmap.ACCESS_READ)
+        with open(path + PAYLOADS_SUFFIX, 'rb') as payloads_file:
+            self.payloads = mmap.mmap(payloads_file.fileno(), 0, access = mmap.ACCESS_READ) \
+                if os.fstat(payloads_file.fileno()).st_size else None
+
+        magic, self.slots, self.key_count = HEADER.unpack_from(self.keys, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path}{KEYS_SUFFIX} is not a snapshot')
+        self.mask = self.slots - 1
+
+    # Returns the payload offset of a key, None when it is not in the snapshot
+    def find(self, key):
+        hashed = key_hash(key)
+        position = hashed & self.mask
+        while True:
+            stored_hash, stored_offset = SLOT.unpack_from(self.keys, HEADER.size + position * SLOT.size)
+            if not stored_offset:
+                return None
+            if stored_hash == hashed:
+                return stored_offset - 1
+            position = (position + 1) & self.mask
+
+    def payload(self, offset):
+        length, = PAYLOAD_LENGTH.unpack_from(self.payloads, offset)
+        start = offset + PAYLOAD_LENGTH.size
+        return msgpack.unpackb(self.payloads[start:start + length])
+
+    def close(self):
+        self.keys.close()
+        if self.payloads is not None:
+            self.payloads.close()
+
+
+class SnapshotReader:
+    """
+    Follows the snapshot published in `directory`.
+
+    The CURRENT pointer file is checked at most every `reload_interval` seconds, a new snapshot is mapped when it
+    changed. Mappings of the previous snapshot are released once no lookup uses them.
+    """
+
+    def __init__(self, directory = SNAPSHOT_DIR, reload_interval = SNAPSHOT_RELOAD_INTERVAL):
+        self.directory = directory
+        self.reload_interval = reload_interval
+        self.snapshot = None
+        self.pointer_mtime = None
+        self.next_check = 0
+        self.reloads = 0
+
+    def current(self):
+        now = time.monotonic()
+        if now >= self.next_check:
+            self.next_check = now + self.reload_interval
+            self._reload()
+        return self.snapshot
+
+    def _reload(self):
+        pointer = os.path.join(self.directory, CURRENT)
+        try:
+            mtime = os.stat(pointer).st_mtime_ns
+            if mtime == self.pointer_mtime:
+                return
+            with open(pointer) as pointer_file:
+                name = pointer_file.read().strip()
+            self.snapshot = Snapshot(os.path.join(self.directory, name))
+            self.pointer_mtime = mtime
+            self.reloads += 1
+        except (OSError, ValueError):
+            # No snapshot published yet, or a broken one: lookups keep using the previous snapshot or Elasticsearch
+            pass
+
+    def lookup(self, keys):
+        """
+        Returns the payload matching the most keys, the first key breaking ties, or None when no key is known.
+        """
+        snapshot = self.current()
+        if snapshot is None:
+            return None
+
+        matches = {}
+        for key in keys:
+            offset = snapshot.find(key)
+            if offset is not None:
+                matches[offset] = matches.get(offset, 0) + 1
+        if not matches:
+            return None
+        # dict keeps insertion order, max() returns the first of equal counts
+        return snapshot.payload(max(matches, key = matches.get))
+
+    def stats(self):
+        return {
+            "loaded": self.snapshot.path if self.snapshot is not None else None,
+            "keys": self.snapshot.key_count if self.snapshot is not None else 0,
+            "reloads": self.reloads,
+        }
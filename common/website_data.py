@@ -0,0 +1,19 @@
+from dataclasses import dataclass, field
+from typing import List, Dict, Optional
+
+
+@dataclass
+class WebsiteData:
+    url: str
+    phone_numbers: Optional[List[str]] = field(default_factory = list)
+    social_links: Optional[Dict[str, List[str]]] = field(default_factory = dict)
+    emails: Optional[List[str]] = field(default_factory = list)
+    contact_page: Optional[str] = None
+    error: Optional[str] = None
+    # Short class of the error, e.g. http_404 or ClientConnectorError, used by the statistics breakdown
+    error_class: Optional[str] = None
+    # Validators of the home page and time of the crawl, sent back as conditional headers by incremental crawls
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    content_hash: Optional[str] = None
+    crawled_at: Optional[str] = None
@@ -1,51 +1,320 @@
-from fastapi import Depends, HTTPException
+import base64
+import json
+from typing import List, Optional
 
-from db import DatabaseConnection
+from fastapi import Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+
+from cache import CACHE_REDIS_URL, SharedCache, TTLCache
+from common.documents import normalize_domain, normalize_facebook_profile, normalize_phone
+from common.elastic import WEBSITE_DATA_INDEX
+from common.log import get_logger
+from common.metrics import NAME_LOOKUPS, SNAPSHOT_LOOKUPS
+from common.names import normalize_name, phonetic_key, strip_legal_suffixes
+from common.snapshot import DOMAIN_KEY, FACEBOOK_KEY, PHONE_KEY, SNAPSHOT_DIR, SnapshotReader
+from db import AsyncDatabaseConnection
+from models.company_match_query import CompanyMatchQuery
+from models.company_match_result import CompanyMatchResult
 from models.company_query import CompanyQuery
 from models.company_result_query import CompanyResultQuery
+from models.company_search_hit import CompanySearchHit
+from models.company_search_result import CompanySearchResult
+from models.company_suggestion import CompanySuggestion
+
+logger = get_logger(__name__)
+
+# Number of searches sent in a single _msearch request by the batch matching endpoint
+MSEARCH_CHUNK_SIZE = 500
+# Shortest partial phone number matched against the phone number suffixes, the edge n-gram min_gram in the mapping
+PHONE_SUFFIX_MIN_LENGTH = 4
+# Largest page returned by the search endpoint
+SEARCH_MAX_SIZE = 100
+# Largest number of suggestions returned by the typeahead endpoint
+SUGGEST_MAX_SIZE = 20
+
+# Only the fields returned to the caller are fetched from _source
+COMPANY_RESULT_FIELDS = [field for field in CompanyResultQuery.model_fields if field != 'score']
+SUGGESTION_FIELDS = ['url', 'legal_name', 'commercial_names']
+# Relevance first, the domain is unique per document and breaks ties so search_after pages are stable
+SEARCH_SORT = [{"_score": "desc"}, {"domain": "asc"}]
 
 
 class CompanyController:
     def __init__(self, app):
         self.app = app
-        self.db = DatabaseConnection().db
+        self.database = AsyncDatabaseConnection()
+        self.cache = TTLCache(shared = self.create_shared_cache())
+        self.snapshot = SnapshotReader(SNAPSHOT_DIR) if SNAPSHOT_DIR else None
 
-    def register(self):
-        @self.app.get("/company")
-        async def company(query: CompanyQuery = Depends()) -> CompanyResultQuery:
-            must_not_conditions = [{"exists": {"field": "error"}}]
-            should_conditions = []
-
-            if query.website:
-                should_conditions.append({"match_phrase": {"url": query.website.lower()}})
-            if query.phone_number:
-                should_conditions.append({
-                    "wildcard": {
-                        "phone_numbers": f"*{query.phone_number}*"
-                    }
-                })
-            if query.company_name:
-                should_conditions.append(
-                    {"match": {"all_company_names": {"query": query.company_name, "operator": "and"}}})
+    @staticmethod
+    def create_shared_cache():
+        if not CACHE_REDIS_URL:
+            return None
+        return SharedCache(
+            CACHE_REDIS_URL,
+            encode = lambda result: result.model_dump(),
+            decode = lambda payload: CompanyResultQuery(**payload)
+        )
+
+    @staticmethod
+    def cache_key(query: CompanyQuery):
+        return (
+            " ".join(query.company_name.lower().split()) if query.company_name else None,
+            normalize_domain(query.website) if query.website else None,
+            query.phone_number or None,
+            normalize_facebook_profile(query.facebook_profile) if query.facebook_profile else None,
+        )
+
+    @staticmethod
+    def snapshot_keys(query: CompanyQuery):
+        # Name queries are fuzzy, only Elasticsearch answers them
+        if query.company_name:
+            return []
+        keys = []
+        if query.website:
+            keys.append(DOMAIN_KEY + normalize_domain(query.website))
+        if query.phone_number and normalize_phone(query.phone_number):
+            keys.append(PHONE_KEY + normalize_phone(query.phone_number))
+        if query.facebook_profile:
+            keys.append(FACEBOOK_KEY + normalize_facebook_profile(query.facebook_profile))
+        return keys
+
+    # Exact lookups answered from the memory-mapped snapshot, None sends the query to Elasticsearch
+    def lookup_snapshot(self, query: CompanyQuery) -> Optional[CompanyResultQuery]:
+        if self.snapshot is None:
+            return None
+        keys = self.snapshot_keys(query)
+        if not keys:
+            return None
+        payload = self.snapshot.lookup(keys)
+        SNAPSHOT_LOOKUPS.labels('hit' if payload is not None else 'miss').inc()
+        return CompanyResultQuery(**payload) if payload is not None else None
+
+    async def search_company(self, query: CompanyQuery):
+        # Exact and normalized clauses first, fuzzy name matching only runs when they find nothing
+        for fuzzy in self.search_tiers(query):
+            response = await self.database.db.search(index = WEBSITE_DATA_INDEX, body = {
+                "query": self.build_search_query(query, fuzzy),
+                "size": 1,
+                "track_total_hits": False,
+                "_source": COMPANY_RESULT_FIELDS
+            })
+
+            logger.debug("Search response: %s", response)
+
+            if response['hits']['hits']:
+                self.count_name_lookup(query, 'fuzzy' if fuzzy else 'exact')
+                hit = response['hits']['hits'][0]
+                return self.to_company_result(hit), hit['_id']
+
+        self.count_name_lookup(query, 'miss')
+        return None, None
+
+    @staticmethod
+    def search_tiers(query: CompanyQuery):
+        return (False, True) if query.company_name else (False,)
+
+    @staticmethod
+    def count_name_lookup(query: CompanyQuery, tier):
+        if query.company_name:
+            NAME_LOOKUPS.labels(tier).inc()
+
+    @staticmethod
+    def build_search_query(query: CompanyQuery, fuzzy = True):
+        must_not_conditions = [{"exists": {"field": "error"}}]
+        should_conditions = []
+
+        if query.website:
+            should_conditions.append({"term": {"domain": normalize_domain(query.website)}})
+        if query.phone_number:
+            # A number without digits ("+") has no E.164 form, a null term would be rejected by Elasticsearch
+            if normalize_phone(query.phone_number):
+                should_conditions.append({"term": {"phone_numbers_e164": normalize_phone(query.phone_number)}})
+            # Partial numbers match on their suffix, the suffix sub-field is indexed reversed in edge n-grams
+            digits = query.phone_number.lstrip('+')
+            if len(digits) >= PHONE_SUFFIX_MIN_LENGTH:
+                should_conditions.append({"match": {"phone_numbers_e164.suffix": digits}})
+        if query.company_name:
+            # Names are normalized like the names_* fields written by the merge tool, see common.names
+            normalized_name = normalize_name(query.company_name)
+            stripped_name = strip_legal_suffixes(normalized_name)
+            should_conditions.append({"term": {"names_normalized": {"value": normalized_name, "boost": 3}}})
+            should_conditions.append({"term": {"names_stripped": {"value": stripped_name, "boost": 2}}})
+            should_conditions.append(
+                {"match": {"all_company_names": {"query": query.company_name, "operator": "and"}}})
+            if fuzzy:
                 should_conditions.append(
-                    {"fuzzy": {"all_company_names": {"value": query.company_name, "fuzziness": "AUTO"}}})
-            if query.facebook_profile:
-                should_conditions.append({"match": {"social_links.facebook": query.facebook_profile.lower()}})
-
-            search_query = {
-                "bool": {
-                    "must_not": must_not_conditions,
-                    "should": should_conditions,
-                    "minimum_should_match": 1
-                }
+                    {"match": {"names_normalized.prefix": {"query": stripped_name, "operator": "and"}}})
+                should_conditions.append({"term": {"names_phonetic": phonetic_key(stripped_name)}})
+                should_conditions.append({"match": {"all_company_names": {
+                    "query": query.company_name, "fuzziness": "AUTO", "prefix_length": 1, "boost": 0.5}}})
+        if query.facebook_profile:
+            should_conditions.append(
+                {"term": {"social_links.facebook": normalize_facebook_profile(query.facebook_profile)}})
+
+        return {
+            "bool": {
+                "must_not": must_not_conditions,
+                "should": should_conditions,
+                "minimum_should_match": 1
             }
+        }
+
+    @staticmethod
+    def to_company_result(hit) -> CompanyResultQuery:
+        return CompanyResultQuery(**hit['_source'], score = hit['_score'])
+
+    async def match_chunk(self, offset, queries: List[CompanyQuery]) -> List[CompanyMatchResult]:
+        results = {}
+        pending = []
+        for position, query in enumerate(queries):
+            company = self.lookup_snapshot(query)
+            if company is not None:
+                results[position] = CompanyMatchResult(index = offset + position, found = True, company = company)
+            else:
+                pending.append(position)
 
-            response = self.db.search(index = "website_data", body = {"query": search_query})
+        if pending:
+            results.update(await self.search_chunk(offset, queries, pending, fuzzy = False))
 
-            print(response)
+        # Name queries the exact tier missed get a second _msearch with fuzzy matching
+        retry = [position for position in pending if not results[position].found and queries[position].company_name]
+        if retry:
+            results.update(await self.search_chunk(offset, queries, retry, fuzzy = True))
 
-            if not response['hits']['hits']:
+        for position in pending:
+            tier = 'miss' if not results[position].found else 'fuzzy' if position in retry else 'exact'
+            self.count_name_lookup(queries[position], tier)
+        return [results[position] for position in range(len(queries))]
+
+    async def search_chunk(self, offset, queries: List[CompanyQuery], positions, fuzzy = True):
+        body = []
+        for position in positions:
+            body.append({})
+            body.append({
+                "query": self.build_search_query(queries[position], fuzzy),
+                "size": 1,
+                "track_total_hits": False,
+                "_source": COMPANY_RESULT_FIELDS
+            })
+
+        response = await self.database.db.msearch(index = WEBSITE_DATA_INDEX, body = body)
+
+        results = {}
+        for position, item in zip(positions, response['responses']):
+            index = offset + position
+            if 'error' in item:
+                results[position] = CompanyMatchResult(index = index, found = False, error = str(item['error']))
+            elif not item['hits']['hits']:
+                results[position] = CompanyMatchResult(index = index, found = False)
+            else:
+                results[position] = CompanyMatchResult(index = index, found = True,
+                                                       company = self.to_company_result(item['hits']['hits'][0]))
+        return results
+
+    @staticmethod
+    def encode_search_after(sort_values):
+        return base64.urlsafe_b64encode(json.dumps(sort_values).encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def decode_search_after(search_after):
+        try:
+            sort_values = json.loads(base64.urlsafe_b64decode(search_after.encode('ascii')))
+        except ValueError:
+            sort_values = None
+        # Anything but one value per sort key would reach Elasticsearch and come back as a 500
+        if not isinstance(sort_values, list) or len(sort_values) != len(SEARCH_SORT):
+            raise HTTPException(status_code = 422, detail = "Invalid search_after cursor")
+        return sort_values
+
+    async def search_companies(self, query: CompanyQuery, size, search_after = None, includes = None,
+                               excludes = None) -> CompanySearchResult:
+        body = {
+            "query": self.build_search_query(query),
+            "size": size,
+            "sort": SEARCH_SORT,
+            "track_total_hits": False,
+            "_source": {"includes": includes or COMPANY_RESULT_FIELDS, "excludes": excludes or []}
+        }
+        if search_after:
+            body["search_after"] = self.decode_search_after(search_after)
+
+        response = await self.database.db.search(index = WEBSITE_DATA_INDEX, body = body)
+        hits = response['hits']['hits']
+
+        return CompanySearchResult(
+            hits = [
+                CompanySearchHit(id = hit['_id'], score = hit['_score'],
+                                 company = CompanyResultQuery(**hit.get('_source', {})))
+                for hit in hits
+            ],
+            search_after = self.encode_search_after(hits[-1]['sort']) if len(hits) == size else None
+        )
+
+    async def suggest_companies(self, prefix, size) -> List[CompanySuggestion]:
+        response = await self.database.db.search(index = WEBSITE_DATA_INDEX, body = {
+            "suggest": {
+                "names": {
+                    "prefix": prefix,
+                    "completion": {"field": "name_suggest", "size": size, "skip_duplicates": True}
+                }
+            },
+            "_source": SUGGESTION_FIELDS
+        })
+        return [
+            CompanySuggestion(text = option['text'], **option.get('_source', {}))
+            for option in response['suggest']['names'][0]['options']
+        ]
+
+    async def stream_matches(self, queries: List[CompanyQuery]):
+        for offset in range(0, len(queries), MSEARCH_CHUNK_SIZE):
+            for result in await self.match_chunk(offset, queries[offset:offset + MSEARCH_CHUNK_SIZE]):
+                yield result.model_dump_json() + "\n"
+
+    def register(self):
+        @self.app.get("/company")
+        async def company(query: CompanyQuery = Depends()) -> CompanyResultQuery:
+            result = self.lookup_snapshot(query)
+            if result is not None:
+                return result
+
+            result = await self.cache.get_or_load(self.cache_key(query), lambda: self.search_company(query))
+
+            if result is None:
                 raise HTTPException(status_code = 404, detail = "Company not found")
 
-            return CompanyResultQuery(**response['hits']['hits'][0]['_source'],
-                                      score = response['hits']['hits'][0]['_score'])
+            return result
+
+        @self.app.get("/companies/search", response_model_exclude_unset = True)
+        async def search_companies(query: CompanyQuery = Depends(),
+                                   size: int = Query(10, ge = 1, le = SEARCH_MAX_SIZE),
+                                   search_after: Optional[str] = None,
+                                   includes: Optional[List[str]] = Query(None),
+                                   excludes: Optional[List[str]] = Query(None)) -> CompanySearchResult:
+            return await self.search_companies(query, size, search_after, includes, excludes)
+
+        @self.app.get("/companies/suggest")
+        async def suggest_companies(prefix: str = Query(..., min_length = 1),
+                                    size: int = Query(10, ge = 1, le = SUGGEST_MAX_SIZE)) -> List[CompanySuggestion]:
+            return await self.suggest_companies(prefix, size)
+
+        @self.app.get("/cache/stats")
+        async def cache_stats():
+            return self.cache.stats()
+
+        @self.app.get("/snapshot/stats")
+        async def snapshot_stats():
+            return self.snapshot.stats() if self.snapshot is not None else {"loaded": None}
+
+        @self.app.post("/companies/match", response_model = List[CompanyMatchResult])
+        async def match_companies(match_query: CompanyMatchQuery, stream: bool = False):
+            # In streaming mode results are written as NDJSON, one line per input, as each _msearch chunk returns
+            if stream:
+                return StreamingResponse(self.stream_matches(match_query.companies),
+                                         media_type = "application/x-ndjson")
+
+            results = []
+            for offset in range(0, len(match_query.companies), MSEARCH_CHUNK_SIZE):
+                results.extend(
+                    await self.match_chunk(offset, match_query.companies[offset:offset + MSEARCH_CHUNK_SIZE]))
+            return results
@@ -0,0 +1,31 @@
+import time
+
+from fastapi import Request, Response
+
+from common.metrics import API_REQUEST_SECONDS, metrics_payload
+
+
+class MetricsController:
+    def __init__(self, app):
+        self.app = app
+
+    def register(self):
+        @self.app.middleware("http")
+        async def observe_request(request: Request, call_next):
+            start = time.perf_counter()
+            status = 500
+            try:
+                response = await call_next(request)
+                status = response.status_code
+                return response
+            finally:
+                # Labelled by route template, not by path, so query values do not multiply the series
+                route = request.scope.get('route')
+                API_REQUEST_SECONDS.labels(
+                    route.path if route is not None else 'unmatched', request.method, str(status)
+                ).observe(time.perf_counter() - start)
+
+        @self.app.get("/metrics", include_in_schema = False)
+        async def metrics():
+            data, content_type = metrics_payload()
+            return Response(content = data, media_type = content_type)
@@ -1,23 +1,42 @@
-from elasticsearch import Elasticsearch
+from elasticsearch import AsyncElasticsearch
 from dotenv import load_dotenv
 import os
 
 
-class DatabaseConnection:
+# Shared non-blocking client for the API, opened and closed by the FastAPI lifespan hook in app.py
+class AsyncDatabaseConnection:
     _instance = None
 
     def __new__(cls):
         if cls._instance is None:
-            load_dotenv()
-            ELASTIC_USERNAME = os.getenv('ELASTIC_USERNAME')
-            ELASTIC_PASSWORD = os.getenv('ELASTIC_PASSWORD')
-            ELASTIC_URL = os.getenv('ELASTIC_URL')
-
-            cls._instance = super(DatabaseConnection, cls).__new__(cls)
-            cls._instance.db = Elasticsearch(
-                [ELASTIC_URL],
-                basic_auth = (ELASTIC_USERNAME, ELASTIC_PASSWORD),
-                headers = {"Content-Type": "application/json"},
-                api_version = '7.10.1'
-            )
+            cls._instance = super(AsyncDatabaseConnection, cls).__new__(cls)
+            cls._instance.db = None
         return cls._instance
+
+    async def open(self):
+        if self.db is not None:
+            return self.db
+
+        load_dotenv()
+        ELASTIC_USERNAME = os.getenv('ELASTIC_USERNAME')
+        ELASTIC_PASSWORD = os.getenv('ELASTIC_PASSWORD')
+        ELASTIC_URL = os.getenv('ELASTIC_URL')
+        ELASTIC_POOL_SIZE = int(os.getenv('ELASTIC_POOL_SIZE', '50'))
+        ELASTIC_TIMEOUT = float(os.getenv('ELASTIC_TIMEOUT', '10'))
+
+        # `maxsize` bounds the aiohttp connection pool, idle connections are kept alive and reused between requests
+        self.db = AsyncElasticsearch(
+            [ELASTIC_URL],
+            basic_auth = (ELASTIC_USERNAME, ELASTIC_PASSWORD),
+            headers = {"Content-Type": "application/json"},
+            api_version = '7.10.1',
+            maxsize = ELASTIC_POOL_SIZE,
+            timeout = ELASTIC_TIMEOUT,
+            retry_on_timeout = True
+        )
+        return self.db
+
+    async def close(self):
+        if self.db is not None:
+            await self.db.close()
+            self.db = None
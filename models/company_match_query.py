@@ -0,0 +1,7 @@
+from pydantic import BaseModel
+from typing import List
+from models.company_query import CompanyQuery
+
+
+class CompanyMatchQuery(BaseModel):
+    companies: List[CompanyQuery]
@@ -0,0 +1,10 @@
+from pydantic import BaseModel
+from typing import Optional
+from models.company_result_query import CompanyResultQuery
+
+
+class CompanyMatchResult(BaseModel):
+    index: int
+    found: bool
+    company: Optional[CompanyResultQuery] = None
+    error: Optional[str] = None
@@ -12,6 +12,8 @@ class CompanyQuery(BaseModel):
 
     @field_validator('website')
     def change_https_to_http(cls, website_url):
+        if website_url is None:
+            return None
         website_url_str = str(website_url)
         if website_url_str.startswith("https://"):
             return website_url_str.replace("https://", "http://", 1)
@@ -4,10 +4,11 @@ from models.social_links_query import SocialLinksQuery
 
 
 class CompanyResultQuery(BaseModel):
-    url: Optional[str]
-    legal_name: Optional[str]
-    commercial_names: Optional[List[str]]
-    all_company_names: Optional[List[str]]
-    phone_numbers: Optional[List[str]]
-    social_links: Optional[SocialLinksQuery]
-    score: Optional[float]
+    url: Optional[str] = None
+    legal_name: Optional[str] = None
+    commercial_names: Optional[List[str]] = None
+    all_company_names: Optional[List[str]] = None
+    phone_numbers: Optional[List[str]] = None
+    emails: Optional[List[str]] = None
+    social_links: Optional[SocialLinksQuery] = None
+    score: Optional[float] = None
@@ -0,0 +1,9 @@
+from pydantic import BaseModel
+from typing import Optional
+from models.company_result_query import CompanyResultQuery
+
+
+class CompanySearchHit(BaseModel):
+    id: str
+    score: Optional[float]
+    company: CompanyResultQuery
@@ -0,0 +1,8 @@
+from pydantic import BaseModel
+from typing import Optional, List
+from models.company_search_hit import CompanySearchHit
+
+
+class CompanySearchResult(BaseModel):
+    hits: List[CompanySearchHit]
+    search_after: Optional[str] = None
@@ -0,0 +1,9 @@
+from pydantic import BaseModel
+from typing import Optional, List
+
+
+class CompanySuggestion(BaseModel):
+    text: str
+    url: Optional[str] = None
+    legal_name: Optional[str] = None
+    commercial_names: Optional[List[str]] = None
@@ -7,3 +7,5 @@ class SocialLinksQuery(BaseModel):
     twitter: Optional[List[str]] = None
     linkedin: Optional[List[str]] = None
     instagram: Optional[List[str]] = None
+    youtube: Optional[List[str]] = None
+    tiktok: Optional[List[str]] = None
@@ -0,0 +1,96 @@
+import os
+
+import pytest
+
+# The tools create their Elasticsearch client at import time, the tests replace it before any request is sent
+os.environ.setdefault('ELASTIC_URL', 'http://localhost:9200')
+
+
+class FakeIndices:
+    def __init__(self, indices = (), aliases = None):
+        self.indices = set(indices)
+        # alias -> indices behind it
+        self.aliases = aliases or {}
+        self.updates = []
+        self.deleted = []
+        self.refreshed = []
+        self.mappings = []
+        # Raised by put_mapping, e.g. for an index without the analyzers of the current mapping
+        self.mapping_error = None
+
+    def exists(self, index):
+        return index in self.indices or index in self.aliases
+
+    def exists_alias(self, name):
+        return name in self.aliases
+
+    def get_alias(self, name):
+        return {index: {} for index in self.aliases[name]}
+
+    def update_aliases(self, body):
+        self.updates.append(body['actions'])
+
+    def delete(self, index):
+        self.deleted.extend(index.split(','))
+
+    def refresh(self, index):
+        self.refreshed.append(index)
+
+    def put_mapping(self, index, body):
+        if self.mapping_error:
+            raise self.mapping_error
+        self.mappings.append(index)
+
+
+class FakeElasticsearch:
+    """
+    Stands in for the Elasticsearch client of the tools, with the indices and aliases given and the documents indexed.
+    """
+
+    def __init__(self, indices = (), aliases = None):
+        self.indices = FakeIndices(indices, aliases)
+        self.documents = []
+
+    def index(self, index, body):
+        self.documents.append(body)
+
+    def count(self, index):
+        return {'count': len(self.documents)}
+
+
+class FakeAsyncElasticsearch:
+    """
+    Applies the update actions of _bulk requests to the stored documents, by id, the way Elasticsearch does. Other
+    actions, like the change log entries, are accepted and dropped.
+    """
+
+    def __init__(self):
+        self.documents = {}
+
+    async def bulk(self, body):
+        actions = body[0::2]
+        for action, source in zip(actions, body[1::2]):
+            if 'update' not in action:
+                continue
+            document_id = action['update']['_id']
+            if document_id in self.documents:
+                self.documents[document_id].update(source['doc'])
+            elif source.get('doc_as_upsert'):
+                self.documents[document_id] = dict(source['doc'])
+            else:
+                self.documents[document_id] = dict(source['upsert'])
+        return {'errors': False, 'items': [{next(iter(action)): {'status': 200}} for action in actions]}
+
+    async def close(self):
+        pass
+
+
+@pytest.fixture
+def fake_es():
+    # Called with the indices and aliases of the cluster, e.g. fake_es(['website_data-1'], {'website_data': [...]})
+    return FakeElasticsearch
+
+
+@pytest.fixture
+def fake_async_es():
+    return FakeAsyncElasticsearch()
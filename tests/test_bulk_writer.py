@@ -0,0 +1,33 @@
+import asyncio
+
+from common import bulk_writer
+from common.bulk_writer import BulkWriter
+from common.documents import document_id
+from common.website_data import WebsiteData
+
+
+def write(es, add):
+    async def run():
+        async with BulkWriter(es) as writer:
+            await add(writer)
+    asyncio.run(run())
+
+
+def test_a_failed_crawl_keeps_the_fields_of_the_previous_crawl(monkeypatch, fake_async_es):
+    async def record_changes(es, ids):
+        pass
+
+    monkeypatch.setattr(bulk_writer, 'async_record_changes', record_changes)
+    es = fake_async_es
+    good = WebsiteData(url = 'http://good.example', emails = ['info@good.example'], crawled_at = '2024-01-01')
+    error = WebsiteData(url = 'http://good.example', error = 'Failed to crawl', error_class = 'http_503')
+    missing = WebsiteData(url = 'http://missing.example', error = 'Failed to crawl', error_class = 'http_404')
+
+    write(es, lambda writer: writer.add(good))
+    write(es, lambda writer: writer.add_error(error))
+    write(es, lambda writer: writer.add_error(missing))
+
+    stored = es.documents[document_id('http://good.example')]
+    assert stored['emails'] == ['info@good.example']
+    assert stored['error'] is None
+    assert es.documents[document_id('http://missing.example')]['error_class'] == 'http_404'
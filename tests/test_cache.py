@@ -0,0 +1,257 @@
+import asyncio
+import fnmatch
+
+import msgpack
+
+from cache import DocumentChangeListener, SharedCache, TTLCache
+from models.company_result_query import CompanyResultQuery
+from models.social_links_query import SocialLinksQuery
+
+
+class FakeRedisServer:
+    """
+    Local server speaking enough of the Redis protocol (RESP2) for SharedCache, values live in `data`.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.expiries = {}
+        self.commands = []
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+        return f"redis://127.0.0.1:{self.server.sockets[0].getsockname()[1]}/0"
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                args = []
+                for _ in range(int(line[1:])):
+                    size = int((await reader.readline())[1:])
+                    args.append((await reader.readexactly(size + 2))[:-2])
+                writer.write(self.execute(args[0].decode().upper(), args[1:]))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def execute(self, command, args):
+        self.commands.append(command)
+        if command == 'PING':
+            return b'+PONG\r\n'
+        if command == 'GET':
+            return bulk(self.data.get(args[0]))
+        if command == 'SET':
+            self.data[args[0]] = args[1]
+            if len(args) > 3 and args[2].upper() == b'PX':
+                self.expiries[args[0]] = int(args[3])
+            return b'+OK\r\n'
+        if command == 'SADD':
+            members = self.data.setdefault(args[0], set())
+            added = len(set(args[1:]) - members)
+            members.update(args[1:])
+            return integer(added)
+        if command == 'PEXPIRE':
+            self.expiries[args[0]] = int(args[1])
+            return integer(int(args[0] in self.data))
+        if command == 'SMEMBERS':
+            return array([bulk(member) for member in sorted(self.data.get(args[0], set()))])
+        if command in ('DEL', 'UNLINK'):
+            return integer(sum(self.data.pop(key, None) is not None for key in args))
+        if command == 'SCAN':
+            pattern = args[args.index(b'MATCH') + 1].decode() if b'MATCH' in args else '*'
+            keys = [bulk(key) for key in self.data if fnmatch.fnmatchcase(key.decode(), pattern)]
+            return array([bulk(b'0'), array(keys)])
+        return b'-ERR unknown command\r\n'
+
+
+def bulk(value):
+    return b'$-1\r\n' if value is None else b'$%d\r\n%s\r\n' % (len(value), value)
+
+
+def integer(value):
+    return b':%d\r\n' % value
+
+
+def array(items):
+    return b'*%d\r\n' % len(items) + b''.join(items)
+
+
+def create_shared_cache(url):
+    # Encoded like CompanyController.create_shared_cache
+    return SharedCache(url, encode = lambda result: result.model_dump(),
+                       decode = lambda payload: CompanyResultQuery(**payload), timeout = 1)
+
+
+def run_with_server(test):
+    async def run():
+        server = FakeRedisServer()
+        url = await server.start()
+        shared = create_shared_cache(url)
+        try:
+            await test(server, shared)
+        finally:
+            await shared.close()
+            await server.stop()
+
+    asyncio.run(run())
+
+
+COMPANY = CompanyResultQuery(url = 'http://example.com', legal_name = 'Example Inc.', phone_numbers = ['+15551234567'],
+                             social_links = SocialLinksQuery(facebook = ['facebook.com/example']), score = 1.5)
+
+
+def test_shared_cache_round_trips_results_through_msgpack():
+    async def test(server, shared):
+        await shared.set(('example', None, None, None), COMPANY, 'document', ttl = 60)
+
+        cache_key = shared._key(('example', None, None, None)).encode()
+        assert msgpack.unpackb(server.data[cache_key]) == [COMPANY.model_dump(), 'document']
+        assert server.expiries[cache_key] == 60000
+        assert server.data[shared._document_key('document').encode()] == {cache_key}
+
+        assert await shared.get(('example', None, None, None)) == (True, COMPANY, 'document')
+        assert await shared.get(('unknown', None, None, None)) == (False, None, None)
+        # Misses are shared too
+        await shared.set(('missing', None, None, None), None, None, ttl = 5)
+        assert await shared.get(('missing', None, None, None)) == (True, None, None)
+
+    run_with_server(test)
+
+
+def test_shared_cache_falls_back_to_the_process_cache_while_down():
+    async def run():
+        server = FakeRedisServer()
+        url = await server.start()
+        await server.stop()
+        shared = create_shared_cache(url)
+        cache = TTLCache(shared = shared)
+        loads = []
+
+        async def loader():
+            loads.append(1)
+            return COMPANY, 'document'
+
+        try:
+            assert await cache.get_or_load('first', loader) == COMPANY
+            assert shared.errors == 1
+            assert not shared._available()
+
+            # During down_until the shared tier is skipped without another connection attempt
+            assert await cache.get_or_load('second', loader) == COMPANY
+            assert await cache.get_or_load('first', loader) == COMPANY
+            assert shared.errors == 1
+            assert len(loads) == 2
+            assert cache.hits == 1
+
+            shared.down_until = 0
+            assert shared._available()
+        finally:
+            await shared.close()
+
+    asyncio.run(run())
+
+
+def test_shared_cache_invalidates_the_keys_of_rewritten_documents():
+    async def test(server, shared):
+        await shared.set('first', COMPANY, 'rewritten', ttl = 60)
+        await shared.set('second', COMPANY, 'rewritten', ttl = 60)
+        await shared.set('other', COMPANY, 'kept', ttl = 60)
+
+        await shared.invalidate_documents(['rewritten'])
+
+        assert (await shared.get('first'))[0] is False
+        assert (await shared.get('second'))[0] is False
+        assert await shared.get('other') == (True, COMPANY, 'kept')
+        assert shared._document_key('rewritten').encode() not in server.data
+
+    run_with_server(test)
+
+
+def test_get_or_load_coalesces_concurrent_loads_of_a_key():
+    async def test(server, shared):
+        cache = TTLCache(shared = shared)
+        loads = []
+
+        async def loader():
+            loads.append(1)
+            await asyncio.sleep(0.05)
+            return COMPANY, 'document'
+
+        results = await asyncio.gather(*(cache.get_or_load('key', loader) for _ in range(5)))
+
+        assert results == [COMPANY] * 5
+        assert len(loads) == 1
+        assert cache.coalesced == 4
+        # The loaded value went to the shared tier, another process finds it there
+        other_process = TTLCache(shared = shared)
+        assert await other_process.get_or_load('key', loader) == COMPANY
+        assert other_process.shared_hits == 1
+        assert len(loads) == 1
+
+    run_with_server(test)
+
+
+class FakeChangeLog:
+    """
+    Answers the change log searches of DocumentChangeListener from a list of records and keeps the prune requests.
+    """
+
+    def __init__(self, records):
+        self.records = records
+        self.pruned = []
+
+    async def search(self, index, body):
+        since = body['query']['range']['timestamp']['gte']
+        hits = [{'_id': record_id, '_source': source} for record_id, source in self.records
+                if source['timestamp'] >= since]
+        return {'hits': {'hits': hits[:body['size']]}}
+
+    async def delete_by_query(self, index, body, conflicts):
+        self.pruned.append(body['query']['range']['timestamp']['lt'])
+
+
+class FakeDatabase:
+    def __init__(self, db):
+        self.db = db
+
+
+def test_listener_forgets_reset_records_behind_the_overlap_window():
+    change_log = FakeChangeLog([('reset-1', {'ids': [], 'reset': True, 'timestamp': 1000})])
+    cache = TTLCache()
+    listener = DocumentChangeListener(FakeDatabase(change_log), cache, overlap = 1)
+    listener.last_seen = 1000
+    cache.set('key', 'value', 'document')
+
+    asyncio.run(listener.poll())
+    assert cache.get('key') == (False, None)
+    assert 'reset-1' in listener.resets_seen
+
+    # A later change moves the window past the reset record
+    change_log.records.append(('change-1', {'ids': ['other'], 'timestamp': 5000}))
+    cache.set('key', 'value', 'document')
+    asyncio.run(listener.poll())
+    assert cache.get('key') == (True, 'value')
+    assert listener.resets_seen == {}
+
+
+def test_listener_prunes_the_change_log_once_per_interval():
+    change_log = FakeChangeLog([])
+    listener = DocumentChangeListener(FakeDatabase(change_log), TTLCache(), overlap = 30, prune_interval = 600,
+                                      retention = 3600)
+
+    async def prune_twice():
+        await listener.prune()
+        await listener.prune()
+
+    asyncio.run(prune_twice())
+    assert len(change_log.pruned) == 1
@@ -0,0 +1,179 @@
+import asyncio
+import json
+import time
+
+import httpx
+
+from app import app, company_controller
+from controllers.company_controller import CompanyController
+from models.company_query import CompanyQuery
+
+ES_DELAY = 0.2
+
+
+class DelayedElasticsearch:
+    """
+    Stands in for AsyncElasticsearch, every search takes `ES_DELAY` seconds and records how many overlap.
+    """
+
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def search(self, index, body):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(ES_DELAY)
+        finally:
+            self.in_flight -= 1
+        domain = body['query']['bool']['should'][0]['term']['domain']
+        return {'hits': {'hits': [{'_id': domain, '_score': 1.0, '_source': {'url': f'http://{domain}'}}]}}
+
+
+def test_concurrent_company_requests_overlap_their_searches():
+    es = DelayedElasticsearch()
+    company_controller.database.db = es
+    company_controller.cache.clear()
+
+    async def run():
+        async with httpx.AsyncClient(transport = httpx.ASGITransport(app = app), base_url = 'http://api') as client:
+            start = time.monotonic()
+            responses = await asyncio.gather(
+                client.get('/company', params = {'website': 'http://first.example'}),
+                client.get('/company', params = {'website': 'http://second.example'}),
+            )
+            return responses, time.monotonic() - start
+
+    try:
+        responses, elapsed = asyncio.run(run())
+    finally:
+        company_controller.database.db = None
+        company_controller.cache.clear()
+
+    assert [response.json()['url'] for response in responses] == ['http://first.example', 'http://second.example']
+    assert es.max_in_flight == 2
+    assert elapsed < ES_DELAY * 1.75
+
+
+def test_phone_number_without_digits_sends_no_null_term():
+    query = CompanyController.build_search_query(CompanyQuery(phone_number = '+'))
+
+    assert query['bool']['should'] == []
+
+
+class MatchingElasticsearch:
+    """
+    Stands in for AsyncElasticsearch in _msearch requests, a search with a domain term finds that domain.
+    """
+
+    def __init__(self):
+        self.searches = []
+
+    async def msearch(self, index, body):
+        responses = []
+        for search in body[1::2]:
+            self.searches.append(search)
+            domains = [clause['term']['domain'] for clause in search['query']['bool']['should']
+                       if 'domain' in clause.get('term', {})]
+            hits = [{'_id': domain, '_score': 1.0, '_source': {'url': f'http://{domain}'}} for domain in domains]
+            responses.append({'hits': {'hits': hits[:1]}})
+        return {'responses': responses}
+
+
+def call_api(es, method, path, **kwargs):
+    company_controller.database.db = es
+    company_controller.cache.clear()
+
+    async def run():
+        async with httpx.AsyncClient(transport = httpx.ASGITransport(app = app), base_url = 'http://api') as client:
+            return await client.request(method, path, **kwargs)
+
+    try:
+        return asyncio.run(run())
+    finally:
+        company_controller.database.db = None
+
+
+def match_companies(params = None):
+    es = MatchingElasticsearch()
+    companies = [{'website': 'http://first.example'}, {'company_name': 'Second Company', 'website': None}]
+    return call_api(es, 'POST', '/companies/match', params = params, json = {'companies': companies}), es
+
+
+def test_match_companies_ignores_a_null_website():
+    response, es = match_companies()
+
+    assert response.status_code == 200
+    assert [(result['index'], result['found']) for result in response.json()] == [(0, True), (1, False)]
+    assert response.json()[0]['company']['url'] == 'http://first.example'
+    # The null website of the name query sends no domain term, in the exact nor the fuzzy tier
+    assert len(es.searches) == 3
+    assert all('domain' not in clause.get('term', {})
+               for search in es.searches[1:] for clause in search['query']['bool']['should'])
+
+
+def test_match_companies_streams_one_ndjson_line_per_company():
+    response, _ = match_companies({'stream': 'true'})
+
+    assert response.headers['content-type'].startswith('application/x-ndjson')
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [(result['index'], result['found']) for result in lines] == [(0, True), (1, False)]
+
+
+class PagingElasticsearch:
+    """
+    Stands in for AsyncElasticsearch in searches sorted by domain, with search_after and completion suggestions.
+    """
+
+    def __init__(self, domains):
+        self.domains = sorted(domains)
+        self.searches = []
+
+    async def search(self, index, body):
+        self.searches.append(body)
+        if 'suggest' in body:
+            prefix = body['suggest']['names']['prefix'].lower()
+            options = [{'text': domain, '_source': {'url': f'http://{domain}'}}
+                       for domain in self.domains if domain.startswith(prefix)]
+            return {'suggest': {'names': [{'options': options[:body['suggest']['names']['completion']['size']]}]}}
+
+        after = body.get('search_after', [None, ''])[1]
+        domains = [domain for domain in self.domains if domain > after][:body['size']]
+        return {'hits': {'hits': [{'_id': domain, '_score': 1.0, 'sort': [1.0, domain],
+                                   '_source': {'url': f'http://{domain}'}} for domain in domains]}}
+
+
+def test_search_companies_pages_with_the_search_after_cursor():
+    es = PagingElasticsearch(['a.example', 'b.example', 'c.example'])
+    params = {'company_name': 'example', 'size': 2}
+
+    first = call_api(es, 'GET', '/companies/search', params = params).json()
+    second = call_api(es, 'GET', '/companies/search', params = {**params, 'search_after': first['search_after']}).json()
+
+    assert [hit['id'] for hit in first['hits']] == ['a.example', 'b.example']
+    assert [hit['id'] for hit in second['hits']] == ['c.example']
+    assert second.get('search_after') is None
+    assert es.searches[1]['search_after'] == [1.0, 'b.example']
+
+
+def test_search_companies_rejects_malformed_cursors():
+    es = PagingElasticsearch(['a.example'])
+    cursors = ['not base64!', CompanyController.encode_search_after({'score': 1.0}),
+               CompanyController.encode_search_after([1.0]), CompanyController.encode_search_after('a.example')]
+
+    for cursor in cursors:
+        response = call_api(es, 'GET', '/companies/search', params = {'company_name': 'a', 'search_after': cursor})
+        assert response.status_code == 422, cursor
+    assert es.searches == []
+
+
+def test_suggest_companies_returns_the_completion_options():
+    es = PagingElasticsearch(['acme.example', 'acorn.example', 'zenith.example'])
+
+    response = call_api(es, 'GET', '/companies/suggest', params = {'prefix': 'ac', 'size': 5})
+
+    assert response.status_code == 200
+    assert [suggestion['text'] for suggestion in response.json()] == ['acme.example', 'acorn.example']
+    assert response.json()[0]['url'] == 'http://acme.example'
+    assert call_api(es, 'GET', '/companies/suggest', params = {'prefix': ''}).status_code == 422
@@ -0,0 +1,43 @@
+from common.documents import document_id
+from tools.dedup_website_data import main as dedup
+
+DOCUMENTS = {
+    'old-ok': {'url': 'http://ok.example'},
+    'old-conflict': {'url': 'http://conflict.example', 'error': 'Failed to crawl'},
+    'old-rejected': {'url': 'http://rejected.example'},
+}
+# Outcome of the move of each document, 409 is a failed crawl whose new id is already taken
+MOVE_STATUSES = {
+    document_id('http://ok.example'): 200,
+    document_id('http://conflict.example'): 409,
+    document_id('http://rejected.example'): 400,
+}
+
+
+def test_old_copies_are_only_deleted_after_their_move(monkeypatch, fake_es):
+    requests = []
+
+    def scan(es, index, query, size):
+        return ({'_id': old_id, '_source': source} for old_id, source in DOCUMENTS.items())
+
+    def streaming_bulk(es, actions, **kwargs):
+        actions = list(actions)
+        requests.append(actions)
+        for action in actions:
+            status = MOVE_STATUSES.get(action['_id'], 200)
+            yield status < 300, {action['_op_type']: {'_id': action['_id'], 'status': status, 'error': 'rejected'}}
+
+    changes = []
+    monkeypatch.setattr(dedup, 'es', fake_es())
+    monkeypatch.setattr(dedup.helpers, 'scan', scan)
+    monkeypatch.setattr(dedup.helpers, 'streaming_bulk', streaming_bulk)
+    monkeypatch.setattr(dedup, 'record_changes', lambda es, ids: changes.extend(ids))
+
+    dedup.main()
+
+    moves, deletes = requests
+    assert [action['_op_type'] for action in moves] == ['update', 'create', 'update']
+    # The rejected move keeps its only copy
+    assert [action['_id'] for action in deletes] == ['old-ok', 'old-conflict']
+    assert set(changes) == {'old-ok', 'old-conflict', document_id('http://ok.example'),
+                            document_id('http://conflict.example')}
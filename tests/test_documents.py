@@ -0,0 +1,22 @@
+from common.documents import refresh_document
+
+
+def test_refresh_document_backfills_lookup_fields():
+    source = {
+        'url': 'http://www.Example.com/',
+        'phone_numbers': ['(555) 123-4567'],
+        'social_links': {'facebook': ['https://www.facebook.com/Example/']},
+        'legal_name': 'Example Inc.',
+    }
+
+    document = refresh_document(source)
+
+    assert document['domain'] == 'example.com'
+    assert document['phone_numbers_e164'] == ['+15551234567']
+    assert document['social_links']['facebook'] == ['facebook.com/example']
+    assert document['legal_name'] == 'Example Inc.'
+    assert refresh_document(document) == document
+
+
+def test_refresh_document_keeps_documents_without_url():
+    assert refresh_document({'error': 'Failed to crawl'}) == {'error': 'Failed to crawl'}
@@ -0,0 +1,38 @@
+import time
+
+from common.extraction import Extractor, merge_website_data, parse_page
+
+HTML = """
+<html><body>
+<p>Call (555) 123-4567 or write to Info@Example.co.uk, <a href="mailto:john.doe+sales@sub.example.com">John</a></p>
+<img src="logo@2x.png">
+<footer><a href="https://www.facebook.com/example">Facebook</a> <a href="https://www.tiktok.com/@example">TikTok</a></footer>
+</body></html>
+"""
+
+
+def test_extracts_every_rule():
+    data = parse_page('http://example.com', HTML)
+
+    assert data.phone_numbers == ['5551234567']
+    assert sorted(data.emails) == ['info@example.co.uk', 'john.doe+sales@sub.example.com']
+    assert data.social_links['facebook'] == ['facebook.com/example']
+    assert data.social_links['tiktok'] == ['tiktok.com/@example']
+    assert data.social_links['twitter'] == []
+
+
+def test_long_words_are_scanned_in_linear_time():
+    extractor = Extractor()
+    # An unbounded email local part made this quadratic, about two minutes for 2 MB
+    for text in ('x' * 2 * 1024 * 1024, 'a@' + 'b' * 2 * 1024 * 1024, 'x.' * 1024 * 1024):
+        start = time.monotonic()
+        extraction = extractor.extract(text)
+        assert time.monotonic() - start < 2
+        assert extraction.emails == []
+
+
+def test_merge_website_data_keeps_values_unique():
+    data = parse_page('http://example.com', HTML)
+    merge_website_data(data, parse_page('http://example.com/contact', 'Mail info@example.co.uk or bob@example.com'))
+
+    assert sorted(data.emails) == ['bob@example.com', 'info@example.co.uk', 'john.doe+sales@sub.example.com']
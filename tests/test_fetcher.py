@@ -0,0 +1,197 @@
+import asyncio
+import socket
+import time
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.abc import AbstractResolver
+from aiohttp.test_utils import TestServer
+
+from common.fetcher import PERMANENT, RETRYABLE, FetchError, Fetcher, classify_error
+
+PAGE = '<html><body><a href="/contact">Contact</a></body></html>'
+# A footer per article, the contact details come after the first one
+FOOTERS_PAGE = ('<html><body><article>News<footer>Posted today</footer></article>'
+                '<p>Write to info@example.com</p></body><script>tracking()</script></html>')
+SLOW_DELAY = 0.3
+
+
+class FlakyServer:
+    """
+    Local HTTP server with slow and failing pages, requests are counted per path with their HTTP version.
+    """
+
+    def __init__(self):
+        self.requests = {}
+        app = web.Application()
+        app.router.add_get('/ok', self.ok)
+        app.router.add_get('/slow', self.slow)
+        app.router.add_get('/flaky', self.flaky)
+        app.router.add_get('/missing', self.missing)
+        app.router.add_get('/footers', self.footers)
+        self.server = TestServer(app)
+
+    def url(self, path):
+        return str(self.server.make_url(path))
+
+    def record(self, request):
+        self.requests.setdefault(request.path, []).append(request.version)
+        return len(self.requests[request.path])
+
+    async def ok(self, request):
+        self.record(request)
+        return web.Response(text = PAGE, content_type = 'text/html')
+
+    async def slow(self, request):
+        self.record(request)
+        await asyncio.sleep(SLOW_DELAY)
+        return web.Response(text = PAGE, content_type = 'text/html')
+
+    async def flaky(self, request):
+        if self.record(request) == 1:
+            return web.Response(status = 503)
+        return web.Response(text = PAGE, content_type = 'text/html')
+
+    async def missing(self, request):
+        self.record(request)
+        return web.Response(status = 404)
+
+    async def footers(self, request):
+        self.record(request)
+        return web.Response(text = FOOTERS_PAGE, content_type = 'text/html')
+
+
+class FailingResolver(AbstractResolver):
+    def __init__(self):
+        self.calls = 0
+
+    async def resolve(self, host, port = 0, family = socket.AF_INET):
+        self.calls += 1
+        raise OSError(socket.EAI_NONAME, 'Name or service not known')
+
+    async def close(self):
+        pass
+
+
+def run_with_server(test, **fetcher_options):
+    async def run():
+        server = FlakyServer()
+        await server.server.start_server()
+        session = aiohttp.ClientSession()
+        fetcher = Fetcher(session, **{'backoff': 0.01, **fetcher_options})
+        try:
+            return await test(server, fetcher)
+        finally:
+            await fetcher.close()
+            await session.close()
+            await server.server.close()
+
+    return asyncio.run(run())
+
+
+async def measure_loop_lag(stop, interval = 0.01):
+    # Largest delay between when a sleep should have ended and when the loop actually resumed the probe
+    lag = 0
+    while not stop.is_set():
+        start = time.monotonic()
+        await asyncio.sleep(interval)
+        lag = max(lag, time.monotonic() - start - interval)
+    return lag
+
+
+def test_loop_latency_stays_flat_while_pages_are_slow_or_failing():
+    async def test(server, fetcher):
+        stop = asyncio.Event()
+        probe = asyncio.create_task(measure_loop_lag(stop))
+
+        urls = [server.url(path) for path in ('/slow', '/flaky', '/missing', '/ok') for _ in range(10)]
+        start = time.monotonic()
+        results = await asyncio.gather(*(fetcher.fetch_text(url) for url in urls), return_exceptions = True)
+        elapsed = time.monotonic() - start
+
+        stop.set()
+        return results, elapsed, await probe
+
+    results, elapsed, lag = run_with_server(test, timeout = 5)
+
+    assert sum(isinstance(result, FetchError) for result in results) == 10
+    # The slow pages were fetched concurrently and the loop kept serving the probe meanwhile
+    assert elapsed < SLOW_DELAY * 3
+    assert lag < 0.1
+
+
+def test_timeouts_and_5xx_are_retried_through_the_fallback_session():
+    async def test(server, fetcher):
+        assert await fetcher.fetch_text(server.url('/flaky')) == PAGE
+        with pytest.raises(FetchError) as error:
+            await fetcher.fetch_text(server.url('/slow'))
+        return server.requests, error.value
+
+    requests, error = run_with_server(test, timeout = SLOW_DELAY / 3)
+
+    # The fallback session speaks HTTP/1.0
+    assert requests['/flaky'] == [aiohttp.HttpVersion11, aiohttp.HttpVersion10]
+    assert len(requests['/slow']) == 2
+    assert error.kind == RETRYABLE
+
+
+def test_4xx_is_not_retried():
+    async def test(server, fetcher):
+        with pytest.raises(FetchError) as error:
+            await fetcher.fetch_text(server.url('/missing'))
+        return server.requests, error.value
+
+    requests, error = run_with_server(test)
+
+    assert len(requests['/missing']) == 1
+    assert (error.kind, error.status, error.reason) == (PERMANENT, 404, 'http_404')
+
+
+def test_reading_stops_at_the_end_of_the_body_not_at_the_first_footer():
+    async def test(server, fetcher):
+        return await fetcher.fetch_text(server.url('/footers')), fetcher.stats()
+
+    text, stats = run_with_server(test, chunk_size = 16)
+
+    assert 'info@example.com' in text
+    assert 'tracking' not in text
+    assert stats['stopped_early'] == 1
+
+
+def test_stopping_at_the_first_footer_is_opt_in():
+    async def test(server, fetcher):
+        return await fetcher.fetch_text(server.url('/footers'))
+
+    text = run_with_server(test, chunk_size = 16, stop_at_footer = True)
+
+    assert 'Posted today</footer' in text
+    assert 'info@example.com' not in text
+
+
+def test_dns_errors_are_not_retried():
+    async def run():
+        resolver = FailingResolver()
+        session = aiohttp.ClientSession(connector = aiohttp.TCPConnector(resolver = resolver))
+        fetcher = Fetcher(session, backoff = 0.01)
+        try:
+            with pytest.raises(FetchError) as error:
+                await fetcher.fetch_text('http://unknown-host.invalid/')
+        finally:
+            await fetcher.close()
+            await session.close()
+        return resolver.calls, error.value
+
+    calls, error = asyncio.run(run())
+
+    assert calls == 1
+    assert error.kind == PERMANENT
+    assert isinstance(error.__cause__, aiohttp.ClientConnectorError)
+
+
+def test_classify_error():
+    assert classify_error(asyncio.TimeoutError()) == RETRYABLE
+    assert classify_error(aiohttp.ServerDisconnectedError()) == RETRYABLE
+    assert classify_error(FetchError('http://example.com', RETRYABLE, 'HTTP 503', status = 503)) == RETRYABLE
+    assert classify_error(FetchError('http://example.com', PERMANENT, 'HTTP 404', status = 404)) == PERMANENT
+    assert classify_error(aiohttp.InvalidURL('not a url')) == PERMANENT
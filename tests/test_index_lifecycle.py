@@ -0,0 +1,65 @@
+import sys
+
+import pytest
+from elasticsearch.exceptions import RequestError
+
+from common.index_lifecycle import swap_alias
+from tools.create_index import main as create_index
+from tools.manage_index import main as manage_index
+
+
+def test_swap_keeping_old_refuses_to_drop_the_legacy_index(fake_es):
+    es = fake_es(['website_data', 'website_data-1'], {})
+
+    with pytest.raises(ValueError):
+        swap_alias(es, 'website_data-1', 'website_data', drop_old = False)
+    assert es.indices.updates == []
+
+
+def test_swap_removes_the_legacy_index_in_the_alias_update(fake_es):
+    es = fake_es(['website_data', 'website_data-1'], {})
+
+    swap_alias(es, 'website_data-1', 'website_data')
+
+    assert es.indices.updates == [[{"remove_index": {"index": "website_data"}},
+                                   {"add": {"index": "website_data-1", "alias": "website_data"}}]]
+    # The API caches are reset through the change log
+    assert es.documents[0]['reset'] is True
+
+
+def test_swap_keeps_old_versioned_indices_when_asked(fake_es):
+    es = fake_es(['website_data-1', 'website_data-2'], {'website_data': ['website_data-1']})
+
+    assert swap_alias(es, 'website_data-2', 'website_data', drop_old = False) == ['website_data-1']
+    assert es.indices.deleted == []
+
+
+def test_manage_index_rejects_keep_old_for_the_legacy_index(monkeypatch, fake_es):
+    monkeypatch.setattr(manage_index, 'es', fake_es(['website_data'], {}))
+
+    # Refused before any index is created, the fake has no indices.create
+    with pytest.raises(SystemExit):
+        manage_index.reset(manage_index.parser.parse_args(['reset', '--keep-old']))
+
+
+def test_create_index_updates_the_mapping_of_an_existing_index(monkeypatch, fake_es):
+    es = fake_es(['website_data-1'], {'website_data': ['website_data-1']})
+    monkeypatch.setattr(create_index, 'es', es)
+    monkeypatch.setattr(sys, 'argv', ['create_index'])
+
+    create_index.main()
+
+    assert es.indices.mappings == ['website_data']
+
+
+def test_create_index_fails_when_the_mapping_needs_a_reindex(monkeypatch, capsys, fake_es):
+    es = fake_es(['website_data-1'], {'website_data': ['website_data-1']})
+    es.indices.mapping_error = RequestError(400, 'mapper_parsing_exception', 'analyzer [name_prefix] not found')
+    monkeypatch.setattr(create_index, 'es', es)
+    monkeypatch.setattr(sys, 'argv', ['create_index'])
+
+    with pytest.raises(SystemExit) as exit_info:
+        create_index.main()
+
+    assert exit_info.value.code != 0
+    assert 'manage_index.main --alias website_data reindex' in capsys.readouterr().err
@@ -0,0 +1,51 @@
+import sys
+
+from tools.merge_company_data import main as merge
+
+CSV = """domain,company_commercial_name,company_legal_name,company_all_available_names
+first.example,First,FIRST INC.,First | FIRST INC.
+second.example,Second,,Second
+third.example,Third,THIRD LLC,Third | THIRD LLC
+"""
+
+
+def run_merge(monkeypatch, csv_path, checkpoint_path, fail_on = None):
+    merged = []
+
+    def streaming_bulk(es, actions, **kwargs):
+        for action in actions:
+            if fail_on and action['doc']['legal_name'] == fail_on:
+                raise KeyboardInterrupt
+            merged.append(action['doc']['commercial_names'][0])
+            yield True, {'update': {'_id': action['_id'], 'status': 200}}
+
+    monkeypatch.setattr(merge.helpers, 'streaming_bulk', streaming_bulk)
+    monkeypatch.setattr(merge, 'record_changes', lambda es, ids: None)
+    monkeypatch.setattr(sys, 'argv', ['merge_company_data', '--csv', str(csv_path), '--chunk-size', '1',
+                                      '--checkpoint', str(checkpoint_path)])
+    try:
+        merge.main()
+    except KeyboardInterrupt:
+        pass
+    return merged
+
+
+def test_a_finished_merge_runs_again_from_the_first_row(monkeypatch, tmp_path):
+    csv_path = tmp_path / 'companies.csv'
+    csv_path.write_text(CSV)
+    checkpoint_path = tmp_path / 'merge.checkpoint'
+
+    assert run_merge(monkeypatch, csv_path, checkpoint_path) == ['First', 'Second', 'Third']
+    assert not checkpoint_path.exists()
+    assert run_merge(monkeypatch, csv_path, checkpoint_path) == ['First', 'Second', 'Third']
+
+
+def test_an_interrupted_merge_resumes_after_the_merged_rows(monkeypatch, tmp_path):
+    csv_path = tmp_path / 'companies.csv'
+    csv_path.write_text(CSV)
+    checkpoint_path = tmp_path / 'merge.checkpoint'
+
+    assert run_merge(monkeypatch, csv_path, checkpoint_path, fail_on = 'THIRD LLC') == ['First', 'Second']
+    assert checkpoint_path.read_text() == '2'
+    assert run_merge(monkeypatch, csv_path, checkpoint_path) == ['Third']
+    assert not checkpoint_path.exists()
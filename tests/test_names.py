@@ -0,0 +1,31 @@
+from common.names import name_fields, normalize_name, phonetic_key, soundex, strip_legal_suffixes
+
+
+def test_normalize_name():
+    assert normalize_name('  Café & Bäckerei, L.L.C. ') == 'cafe and backerei llc'
+    assert normalize_name("O'Reilly Media") == 'oreilly media'
+    assert normalize_name(None) == ''
+
+
+def test_strip_legal_suffixes():
+    assert strip_legal_suffixes(normalize_name('The Acme Widgets Co., Inc.')) == 'acme widgets'
+    assert strip_legal_suffixes(normalize_name('ACME Widgets GmbH')) == 'acme widgets'
+    # A name made of a legal form only is kept
+    assert strip_legal_suffixes('holdings') == 'holdings'
+
+
+def test_soundex():
+    assert soundex('robert') == soundex('rupert') == 'r163'
+    assert soundex('tymczak') == 't522'
+    assert soundex('pfister') == 'p236'
+    assert phonetic_key('jonsons plumbing') == phonetic_key('johnsons plumbing')
+
+
+def test_name_fields():
+    fields = name_fields(['Acme Widgets, Inc.', 'ACME Widgets LLC'])
+
+    assert fields['names_normalized'] == ['acme widgets inc', 'acme widgets llc']
+    assert fields['names_stripped'] == ['acme widgets']
+    assert fields['names_phonetic'] == [phonetic_key('acme widgets')]
+    assert fields['name_suggest'] == {'input': ['Acme Widgets, Inc.', 'ACME Widgets LLC', 'acme widgets']}
+    assert name_fields([])['name_suggest'] is None
@@ -0,0 +1,125 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from celery.signals import task_prerun
+
+from tools.scalable_scraper import main as scalable_scraper
+
+PAGES = {
+    '/': '<html><body><a href="/contact-us">Contact</a> write to info@example.com</body></html>',
+    '/contact-us': '<html><body>Call (555) 123-4567 <footer>facebook.com/example</footer></body></html>',
+}
+
+
+class SiteHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        # The second host name of the server stands for a site whose home page is gone
+        page = PAGES.get(self.path) if self.headers['Host'].startswith('127.0.0.1') else None
+        if page is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = page.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def site_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SiteHandler)
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def run_pipeline(monkeypatch, es, urls):
+    monkeypatch.setattr(scalable_scraper, 'create_async_client', lambda: es)
+    monkeypatch.setattr(scalable_scraper, 'PAGE_STORE_DIR', None)
+    monkeypatch.setattr(scalable_scraper, 'SITE_FETCH_SITEMAP', False)
+    monkeypatch.setattr(scalable_scraper.celery_app.conf, 'broker_url', 'memory://')
+    monkeypatch.setattr(scalable_scraper.celery_app.conf, 'task_always_eager', True)
+
+    stages = []
+
+    def record_stage(task, args, **kwargs):
+        stages.append((task.name, args[0]))
+
+    task_prerun.connect(record_stage)
+    try:
+        scalable_scraper.fetch_websites_task.delay(urls)
+    finally:
+        task_prerun.disconnect(record_stage)
+        scalable_scraper.close_worker_context()
+    return stages
+
+
+def test_pipeline_runs_every_stage_with_the_memory_broker(site_server, monkeypatch, fake_async_es):
+    working_site = f'http://127.0.0.1:{site_server}/'
+    missing_site = f'http://localhost:{site_server}/'
+    es = fake_async_es
+    stages = run_pipeline(monkeypatch, es, [working_site, missing_site])
+
+    names = [name for name, _ in stages]
+    assert names == ['tasks.fetch_websites_task', 'tasks.parse_websites_task', 'tasks.index_websites_task',
+                     'tasks.index_websites_task']
+
+    _, fetch_batch = stages[0]
+    assert fetch_batch == [working_site, missing_site]
+
+    # The parse stage gets the fetched pages of the working site, home page first
+    _, parse_batch = stages[1]
+    assert [site['url'] for site in parse_batch] == [working_site]
+    assert [url for url, _ in parse_batch[0]['pages']] == [working_site, working_site + 'contact-us']
+
+    # The parsed site is indexed, the missing one goes straight from the fetch stage to the index stage
+    _, parsed_documents = stages[2]
+    _, error_documents = stages[3]
+    assert [document['url'] for document in parsed_documents] == [working_site]
+    assert [document['url'] for document in error_documents] == [missing_site]
+    assert error_documents[0]['error_class'] == 'http_404'
+
+    written = {document['url']: document for document in es.documents.values()}
+    assert written[working_site]['emails'] == ['info@example.com']
+    assert written[working_site]['phone_numbers'] == ['5551234567']
+    assert written[working_site]['contact_page'] == working_site + 'contact-us'
+    assert written[missing_site]['error_class'] == 'http_404'
+
+
+def test_websites_too_big_for_a_parse_task_are_parsed_by_the_fetch_worker(site_server, monkeypatch, fake_async_es):
+    monkeypatch.setattr(scalable_scraper, 'PARSE_BATCH_BYTES', 64)
+    working_site = f'http://127.0.0.1:{site_server}/'
+    es = fake_async_es
+    stages = run_pipeline(monkeypatch, es, [working_site])
+
+    assert [name for name, _ in stages] == ['tasks.fetch_websites_task', 'tasks.index_websites_task']
+    written = {document['url']: document for document in es.documents.values()}
+    assert written[working_site]['emails'] == ['info@example.com']
+
+
+def test_parse_batches_are_capped_by_count_and_size():
+    sites = [scalable_scraper.FetchedSite(url = f'http://site{size}.example', pages = [['/', 'x' * size]])
+             for size in (10, 10, 10, 30, 100, 5)]
+
+    batches, oversized = scalable_scraper.parse_batches(sites, batch_size = 2, batch_bytes = 40)
+
+    assert [[site.url for site in batch] for batch in batches] == [
+        ['http://site10.example', 'http://site10.example'], ['http://site10.example', 'http://site30.example'],
+        ['http://site5.example']]
+    assert [site.url for site in oversized] == ['http://site100.example']
+
+
+def test_an_empty_fetch_batch_fetches_nothing():
+    context = scalable_scraper.WorkerContext()
+    try:
+        assert context.run(scalable_scraper.fetch_batch([], context)) == []
+    finally:
+        context.close()
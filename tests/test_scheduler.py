@@ -0,0 +1,39 @@
+import asyncio
+
+from tools.scraper.scheduler import CrawlScheduler
+
+SITES = [(row, f'http://site{row}.example') for row in range(5)]
+
+
+def run_crawl(checkpoint_path, stop_after = None):
+    crawled = []
+
+    async def handler(scheduler, job):
+        crawled.append(job.row)
+        if stop_after is not None and len(crawled) == stop_after:
+            scheduler.stop()
+        scheduler.complete(job.row)
+
+    scheduler = CrawlScheduler(handler, concurrency = 1, per_host_delay = 0, queue_size = 1,
+                               checkpoint_path = str(checkpoint_path))
+    asyncio.run(scheduler.run(SITES))
+    return crawled
+
+
+def test_a_finished_crawl_runs_again_from_the_start(tmp_path):
+    checkpoint_path = tmp_path / 'scraper.checkpoint'
+
+    assert run_crawl(checkpoint_path) == [0, 1, 2, 3, 4]
+    assert not checkpoint_path.exists()
+    assert run_crawl(checkpoint_path) == [0, 1, 2, 3, 4]
+
+
+def test_a_stopped_crawl_resumes_after_the_completed_rows(tmp_path):
+    checkpoint_path = tmp_path / 'scraper.checkpoint'
+
+    crawled = run_crawl(checkpoint_path, stop_after = 2)
+    assert crawled[:2] == [0, 1]
+    assert checkpoint_path.read_text() == str(len(crawled))
+
+    assert run_crawl(checkpoint_path) == list(range(len(crawled), 5))
+    assert not checkpoint_path.exists()
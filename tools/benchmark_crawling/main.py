@@ -0,0 +1,133 @@
+import argparse
+import asyncio
+import threading
+import time
+
+import aiohttp
+import pandas as pd
+from aiohttp import web
+
+from common.fetcher import HTTP_LIMIT, Fetcher, create_session
+from common.log import get_logger
+from tools.scalable_scraper.main import CRAWL_BATCH_SIZE, FetchedSite, WorkerContext, fetch_batch, fetch_website
+
+parser = argparse.ArgumentParser(description = "Compare the sites/sec of one Celery fetch worker process.")
+parser.add_argument('--sites', type = int, default = 500, help = 'Number of websites crawled per mode.')
+parser.add_argument('--latency', type = float, default = 0.05,
+                    help = 'Seconds the local server waits before each response, the network round-trip.')
+parser.add_argument('--csv', help = 'Crawl the domains of this CSV instead of the local server, over the network.')
+parser.add_argument('--batch-size', type = int, default = CRAWL_BATCH_SIZE, help = 'Websites per fetch task.')
+
+logger = get_logger(__name__)
+
+HOME_PAGE = ('<html><body><a href="contact-us">Contact</a><a href="about">About</a>'
+             'Welcome to company {site}</body></html>')
+CONTACT_PAGE = '<html><body>Call (555) 123-{site:04d} or write to info@company{site}.example.com</body></html>'
+ABOUT_PAGE = ('<html><body>About company {site}, <a href="https://facebook.com/company{site}">Facebook</a>'
+              '</body></html>')
+PAGES = {'': HOME_PAGE, 'contact-us': CONTACT_PAGE, 'about': ABOUT_PAGE}
+
+
+# Synthetic websites under /site<n>/, every response waits `latency` seconds like a remote server
+def create_site_app(latency):
+    async def page(request):
+        await asyncio.sleep(latency)
+        template = PAGES.get(request.match_info['page'])
+        if template is None:
+            raise web.HTTPNotFound()
+        return web.Response(text = template.format(site = int(request.match_info['site']) % 10000),
+                            content_type = 'text/html')
+
+    app = web.Application()
+    app.router.add_get(r'/site{site:\d+}/{page:.*}', page)
+    return app
+
+
+# The server runs its own loop in a thread, the crawl modes create and close loops of their own
+class SiteServer:
+    def __init__(self, latency):
+        self.loop = asyncio.new_event_loop()
+        self.runner = web.AppRunner(create_site_app(latency), access_log = None)
+        self.loop.run_until_complete(self.runner.setup())
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        self.loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+        self.thread = threading.Thread(target = self.loop.run_forever, daemon = True)
+        self.thread.start()
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+def count_crawled(results):
+    return sum(isinstance(result, FetchedSite) for result in results)
+
+
+# What a worker process did before: a new event loop and a new ClientSession (pool, DNS cache) for every website
+def crawl_per_website(urls):
+    async def crawl(url):
+        async with aiohttp.ClientSession() as session:
+            fetcher = Fetcher(session)
+            try:
+                return await fetch_website(url, fetcher)
+            finally:
+                await fetcher.close()
+
+    return count_crawled([asyncio.run(crawl(url)) for url in urls])
+
+
+# The fetch stage now: the loop and the tuned session of the worker process, a batch of websites per task
+def crawl_in_batches(urls, batch_size, session_options):
+    context = WorkerContext()
+    context.page_store = None
+
+    # Like WorkerContext.fetcher, with the session options of the benchmark
+    async def open_fetcher():
+        context.session = create_session(**session_options)
+        context._fetcher = Fetcher(context.session)
+
+    context.run(open_fetcher())
+    try:
+        crawled = 0
+        for offset in range(0, len(urls), batch_size):
+            crawled += count_crawled(context.run(fetch_batch(urls[offset:offset + batch_size], context)))
+        return crawled
+    finally:
+        context.close()
+
+
+def main():
+    args = parser.parse_args()
+
+    server = None
+    if args.csv:
+        domains = pd.read_csv(args.csv, usecols = ['domain'], nrows = args.sites)['domain']
+        urls = [f'http://{domain}' for domain in domains]
+        session_options = {}
+    else:
+        server = SiteServer(args.latency)
+        urls = [f'http://127.0.0.1:{server.port}/site{number}/' for number in range(args.sites)]
+        # Every synthetic website has the same host, the per-host limit of the real crawl does not apply
+        session_options = {'limit_per_host': HTTP_LIMIT}
+
+    modes = {
+        'per-website': lambda: crawl_per_website(urls),
+        'batched': lambda: crawl_in_batches(urls, args.batch_size, session_options),
+    }
+    try:
+        for name, crawl in modes.items():
+            start_time = time.perf_counter()
+            crawled = crawl()
+            elapsed_time = time.perf_counter() - start_time
+            logger.info(f'{name:<12} {len(urls) / elapsed_time:>8.2f} sites/sec'
+                        f' ({crawled} of {len(urls)} websites crawled in {elapsed_time:.2f} seconds)')
+    finally:
+        if server is not None:
+            server.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+import argparse
+import asyncio
+import random
+import time
+
+from common.bulk_writer import BulkWriter
+from common.documents import document_id, to_document
+from common.elastic import create_async_client, create_client, WEBSITE_DATA_INDEX
+from common.index_lifecycle import create_versioned_index
+from common.log import get_logger
+from common.website_data import WebsiteData
+
+parser = argparse.ArgumentParser(description = "Compare the docs/sec of per-document and bulk writes of crawl results.")
+parser.add_argument('--documents', type = int, default = 10000,
+                    help = 'Number of synthetic documents written per mode.')
+parser.add_argument('--max-docs', type = int, default = 500, help = 'Documents per _bulk request of the bulk writer.')
+parser.add_argument('--keep', action = 'store_true', help = 'Keep the benchmark indices.')
+parser.add_argument('--seed', type = int, default = 1, help = 'Seed of the synthetic documents.')
+
+# Initialize Elasticsearch client
+es = create_client(timeout = 60)
+logger = get_logger(__name__)
+
+
+def synthetic_data(number, rng):
+    return WebsiteData(
+        url = f'http://www.company{number}.example.com/',
+        phone_numbers = [f'({rng.randint(200, 999)}) {rng.randint(200, 999)}-{rng.randint(1000, 9999)}'],
+        social_links = {'facebook': [f'facebook.com/company{number}']},
+        emails = [f'info@company{number}.example.com'],
+        contact_page = f'http://www.company{number}.example.com/contact',
+    )
+
+
+# What both scrapers did before the bulk writer, one blocking es.index round-trip per site
+async def write_per_document(index, documents):
+    for data in documents:
+        es.index(index = index, body = to_document(data))
+
+
+# The write path of the scrapers, without the change log entries the old path did not write either
+async def write_bulk(index, documents, max_docs):
+    async_es = create_async_client(timeout = 60)
+    try:
+        async with BulkWriter(async_es, index = index, max_docs = max_docs) as writer:
+            for data in documents:
+                doc = to_document(data)
+                action = {"update": {"_index": index, "_id": document_id(doc['url'])}}
+                await writer.add_action(action, {"doc": doc, "doc_as_upsert": True}, key = doc['url'],
+                                        record_change = False)
+        if writer.failures:
+            logger.error(f'{len(writer.failures)} documents failed, first: {writer.failures[0]}')
+    finally:
+        await async_es.close()
+
+
+def modes(max_docs):
+    return {
+        'per-document': write_per_document,
+        'bulk': lambda index, documents: write_bulk(index, documents, max_docs),
+    }
+
+
+def main():
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    documents = [synthetic_data(number, rng) for number in range(args.documents)]
+
+    for name, write in modes(args.max_docs).items():
+        # Regular index settings, the crawlers write to the live index
+        index = create_versioned_index(es, f'{WEBSITE_DATA_INDEX}-benchmark-{name}', replicas = 0, bulk_load = False)
+        try:
+            start_time = time.perf_counter()
+            asyncio.run(write(index, documents))
+            elapsed_time = time.perf_counter() - start_time
+            es.indices.refresh(index = index)
+            count = es.count(index = index)['count']
+            logger.info(f'{name:<14} {len(documents) / elapsed_time:>10.1f} docs/sec'
+                        f' ({count} documents in {elapsed_time:.2f} seconds)')
+        finally:
+            if not args.keep:
+                es.indices.delete(index = index)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+import argparse
+import random
+import statistics
+import time
+
+from elasticsearch import helpers
+
+from common.documents import document_id, to_document
+from common.elastic import create_client, WEBSITE_DATA_INDEX
+from common.index_lifecycle import create_versioned_index, finish_bulk_load
+from common.log import get_logger
+from common.names import name_fields
+from controllers.company_controller import CompanyController
+from models.company_query import CompanyQuery
+
+parser = argparse.ArgumentParser(description = "Compare the latency of the lookup query shapes on website_data.")
+parser.add_argument('--index', default = WEBSITE_DATA_INDEX, help = 'Index or alias queried without --documents.')
+parser.add_argument('--documents', type = int, default = 0,
+                    help = 'Load this many synthetic documents into a new index and query it instead.')
+parser.add_argument('--keep', action = 'store_true', help = 'Keep the synthetic index.')
+parser.add_argument('--queries', type = int, default = 1000, help = 'Number of lookups per query shape.')
+parser.add_argument('--seed', type = int, default = 1, help = 'Seed of the synthetic documents and samples.')
+
+# Initialize Elasticsearch client
+es = create_client(timeout = 60)
+logger = get_logger(__name__)
+
+WORDS = ['acme', 'blue', 'river', 'summit', 'pioneer', 'golden', 'harbor', 'maple', 'quantum', 'atlas', 'cedar',
+         'evergreen', 'liberty', 'north', 'prime', 'silver', 'united', 'valley', 'western', 'zenith']
+SUFFIXES = ['Inc.', 'LLC', 'Ltd', 'Corp.', 'GmbH', '']
+
+
+def synthetic_document(number, rng):
+    phone_number = f'{rng.randint(200, 999)}{rng.randint(200, 999)}{rng.randint(1000, 9999)}'
+    name = ' '.join(rng.sample(WORDS, 2)).title() + f' {number} ' + rng.choice(SUFFIXES)
+    return {
+        'url': f'http://www.company{number}.example.com/',
+        'phone_numbers': [phone_number],
+        'emails': [f'info@company{number}.example.com'],
+        'social_links': {'facebook': [f'facebook.com/company{number}']},
+        'legal_name': name.strip(),
+        'all_company_names': [name.strip()],
+        **name_fields([name.strip()]),
+    }
+
+
+def generate_documents(index, documents, seed):
+    rng = random.Random(seed)
+    for number in range(documents):
+        doc = to_document(synthetic_document(number, rng))
+        yield {"_op_type": "index", "_index": index, "_id": document_id(doc['url']), "_source": doc}
+
+
+def load_synthetic_index(documents, seed):
+    index = create_versioned_index(es, f'{WEBSITE_DATA_INDEX}-benchmark')
+    start_time = time.time()
+    for ok, result in helpers.streaming_bulk(es, generate_documents(index, documents, seed), chunk_size = 5000,
+                                             raise_on_error = False):
+        if not ok:
+            logger.error(f'Failed to index a synthetic document: {result}')
+    finish_bulk_load(es, index, replicas = 0)
+    es.indices.forcemerge(index = index, max_num_segments = 1, request_timeout = 3600)
+    logger.info(f'Loaded {documents} documents into {index} in {time.time() - start_time:.0f} seconds.')
+    return index
+
+
+# Lookups are sampled from stored documents, so every query shape looks for a company that exists
+def sample_documents(index, count, seed):
+    response = es.search(index = index, body = {
+        "size": count,
+        "query": {"function_score": {"query": {"exists": {"field": "phone_numbers"}},
+                                     "random_score": {"seed": seed, "field": "_seq_no"}}},
+        "_source": ['url', 'phone_numbers', 'social_links', 'all_company_names'],
+    })
+    return [hit['_source'] for hit in response['hits']['hits']]
+
+
+def phone_sample(source):
+    return source['phone_numbers'][0]
+
+
+def name_sample(source):
+    return (source.get('all_company_names') or ['unknown'])[0]
+
+
+# Swaps two letters of the first word, a typo only the fuzzy tier finds
+def misspelled_name_sample(source):
+    name = name_sample(source)
+    return name[0] + name[2] + name[1] + name[3:] if len(name) > 3 else name
+
+
+# What /company sent for names before the normalized fields, a match and a fuzzy query in one search
+def match_and_fuzzy_name(name):
+    return {"bool": {"must_not": [{"exists": {"field": "error"}}], "should": [
+        {"match": {"all_company_names": {"query": name, "operator": "and"}}},
+        {"fuzzy": {"all_company_names": {"value": name, "fuzziness": "AUTO"}}},
+    ], "minimum_should_match": 1}}
+
+
+# Like CompanyController.search_company, the fuzzy tier only runs when the exact one finds nothing
+def tiered_name(name):
+    query = CompanyQuery(company_name = name)
+    return [CompanyController.build_search_query(query, fuzzy) for fuzzy in CompanyController.search_tiers(query)]
+
+
+def query_shapes():
+    return {
+        # What /company sent before the explicit mapping
+        'website match_phrase': lambda source: {"match_phrase": {"url": source['url'].lower()}},
+        'website term': lambda source: CompanyController.build_search_query(CompanyQuery(website = source['url'])),
+        'phone wildcard': lambda source: {"wildcard": {"phone_numbers": f"*{phone_sample(source)}*"}},
+        'phone term': lambda source: CompanyController.build_search_query(
+            CompanyQuery(phone_number = phone_sample(source))),
+        'partial phone wildcard': lambda source: {"wildcard": {"phone_numbers": f"*{phone_sample(source)[-7:]}*"}},
+        'partial phone suffix': lambda source: CompanyController.build_search_query(
+            CompanyQuery(phone_number = phone_sample(source)[-7:])),
+        'name match and fuzzy': lambda source: match_and_fuzzy_name(name_sample(source)),
+        'name tiered': lambda source: tiered_name(name_sample(source)),
+        'typo name match and fuzzy': lambda source: match_and_fuzzy_name(misspelled_name_sample(source)),
+        'typo name tiered': lambda source: tiered_name(misspelled_name_sample(source)),
+    }
+
+
+# A list of queries is tried in order until one finds a document, the latency covers all of them
+def measure(index, build_query, samples):
+    latencies = []
+    for source in samples:
+        queries = build_query(source)
+        start = time.perf_counter()
+        for query in queries if isinstance(queries, list) else [queries]:
+            response = es.search(index = index, body = {"query": query, "size": 1, "_source": False},
+                                 request_cache = False)
+            if response['hits']['hits']:
+                break
+        latencies.append((time.perf_counter() - start) * 1000)
+    percentiles = statistics.quantiles(latencies, n = 100)
+    return percentiles[49], percentiles[98]
+
+
+def main():
+    args = parser.parse_args()
+    index = load_synthetic_index(args.documents, args.seed) if args.documents else args.index
+    try:
+        samples = sample_documents(index, args.queries, args.seed)
+        count = es.count(index = index)['count']
+        logger.info(f'{len(samples)} lookups per query shape on {index} ({count} documents)')
+        for name, build_query in query_shapes().items():
+            p50, p99 = measure(index, build_query, samples)
+            logger.info(f'{name:<24} p50 {p50:>8.2f} ms  p99 {p99:>8.2f} ms')
+    finally:
+        if args.documents and not args.keep:
+            es.indices.delete(index = index)
+
+
+if __name__ == '__main__':
+    main()
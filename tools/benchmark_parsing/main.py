@@ -0,0 +1,158 @@
+import argparse
+import asyncio
+import glob
+import os
+import random
+import re
+import time
+
+from common.extraction import EXTRACTOR
+from common.html_links import BACKENDS
+from common.log import get_logger
+from common.page_store import PAGE_STORE_DIR, list_segments, read_index, read_pages
+from common.parse_pool import PageParser
+
+parser = argparse.ArgumentParser(description = "Measure the pages per second of the parsing stages.")
+parser.add_argument('--html-dir', help = 'Directory of saved .html pages.')
+parser.add_argument('--page-store', default = PAGE_STORE_DIR, help = 'Directory of stored page segments.')
+parser.add_argument('--limit', type = int, default = 1000, help = 'Number of pages read from the corpus.')
+parser.add_argument('--synthetic', type = int, default = 200,
+                    help = 'Number of generated pages used when no saved pages are given.')
+parser.add_argument('--repeat', type = int, default = 3, help = 'Passes over the corpus, the fastest one counts.')
+parser.add_argument('--workers', help = 'Comma separated PageParser pool sizes to sweep (e.g. 0,1,2,4), 0 is inline.')
+
+logger = get_logger(__name__)
+
+
+def load_html_dir(directory, limit):
+    for path in sorted(glob.glob(os.path.join(directory, '**', '*.htm*'), recursive = True))[:limit]:
+        with open(path, encoding = 'utf-8', errors = 'replace') as html_file:
+            yield html_file.read()
+
+
+def load_page_store(directory, limit):
+    count = 0
+    for segment_path in list_segments(directory):
+        for _, html_content in read_pages(segment_path, read_index(segment_path)):
+            if count == limit:
+                return
+            count += 1
+            yield html_content
+
+
+# Pages shaped like the crawled ones: navigation, long text, contact details and a footer with social links
+def synthetic_page(seed):
+    rng = random.Random(seed)
+    words = ['service', 'quality', 'customer', 'family', 'owned', 'since', 'local', 'repair', 'install', 'free']
+    navigation = ''.join(f'<li><a href="/{word}">{word.title()}</a></li>' for word in rng.sample(words, 6))
+    paragraphs = ''.join(
+        f'<p>{" ".join(rng.choice(words) for _ in range(120))}</p>' for _ in range(rng.randint(20, 60))
+    )
+    return (
+        f'<html><head><title>Company {seed}</title></head><body><nav><ul>{navigation}'
+        f'<li><a href="/contact-us">Contact</a></li></ul></nav>{paragraphs}'
+        f'<p>Call ({rng.randint(200, 999)}) {rng.randint(200, 999)}-{rng.randint(1000, 9999)} '
+        f'or write to info@company{seed}.com</p>'
+        f'<footer><a href="https://www.facebook.com/company{seed}">Facebook</a>'
+        f'<a href="https://twitter.com/company{seed}">Twitter</a><a href="/impressum">Impressum</a></footer>'
+        f'</body></html>'
+    )
+
+
+def load_corpus(args):
+    if args.html_dir:
+        return list(load_html_dir(args.html_dir, args.limit))
+    if args.page_store:
+        return list(load_page_store(args.page_store, args.limit))
+    return [synthetic_page(seed) for seed in range(args.synthetic)]
+
+
+# Every rule as a named group of one alternation, a single pass over the page
+ALTERNATION_PATTERN = re.compile('|'.join(f'(?P<{rule.name}>{rule.pattern})' for rule in EXTRACTOR.rules.values()))
+
+
+def extract_alternation(html_content):
+    return [(match.lastgroup, match.group()) for match in ALTERNATION_PATTERN.finditer(html_content)]
+
+
+def measure(function, pages, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for html_content in pages:
+            function(html_content)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def link_benchmark(backend):
+    # Backends are generators, the links are only found once they are consumed
+    return lambda html_content: list(backend(html_content))
+
+
+def benchmarks():
+    functions = {
+        'extract engine': EXTRACTOR.extract,
+        'extract alternation': extract_alternation,
+    }
+    for name, backend in BACKENDS.items():
+        if backend is None:
+            logger.info(f'links {name} skipped, its package is not installed')
+            continue
+        functions[f'links {name}'] = link_benchmark(backend)
+    return functions
+
+
+# Every page is handed to the parser at once like concurrent fetches do, the pending limit of the parser applies
+async def parse_all(page_parser, pages):
+    await asyncio.gather(*(page_parser.parse(f'http://company{number}.example.com/', html_content)
+                           for number, html_content in enumerate(pages)))
+
+
+def measure_workers(workers, pages, repeat):
+    async def run():
+        page_parser = PageParser(workers)
+        try:
+            # The first pass starts the worker processes, it is not timed
+            await parse_all(page_parser, pages[:max(workers, 1)])
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                await parse_all(page_parser, pages)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            return best
+        finally:
+            page_parser.close()
+
+    return asyncio.run(run())
+
+
+def main():
+    args = parser.parse_args()
+    pages = load_corpus(args)
+    if not pages:
+        parser.error('The corpus is empty.')
+    megabytes = sum(len(html_content) for html_content in pages) / 1024 / 1024
+    logger.info(f'{len(pages)} pages, {megabytes:.1f} MB')
+
+    for name, function in benchmarks().items():
+        elapsed = measure(function, pages, args.repeat)
+        logger.info(f'{name:<24} {len(pages) / elapsed:>10.1f} pages/s {megabytes / elapsed:>8.1f} MB/s')
+
+    # parse_page throughput of the crawler with each pool size, on as many cores as the machine has
+    if args.workers:
+        logger.info(f'PageParser sweep on {os.cpu_count()} cores')
+        inline = None
+        for workers in [int(workers) for workers in args.workers.split(',')]:
+            elapsed = measure_workers(workers, pages, args.repeat)
+            if workers == 0 and inline is None:
+                inline = elapsed
+            speedup = f' {inline / elapsed:>6.2f}x inline' if inline else ''
+            logger.info(f'{f"parse workers {workers}":<24} {len(pages) / elapsed:>10.1f} pages/s'
+                        f' {megabytes / elapsed:>8.1f} MB/s{speedup}')
+
+
+if __name__ == '__main__':
+    main()
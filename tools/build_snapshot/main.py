@@ -0,0 +1,63 @@
+import argparse
+import os
+import time
+
+from elasticsearch import helpers
+
+from common.elastic import create_client, WEBSITE_DATA_INDEX
+from common.log import get_logger
+from common.snapshot import DOMAIN_KEY, FACEBOOK_KEY, PHONE_KEY, SNAPSHOT_DIR, SnapshotWriter, publish
+from models.company_result_query import CompanyResultQuery
+
+parser = argparse.ArgumentParser(description = "Export the exact-match keys of website_data into a lookup snapshot.")
+parser.add_argument('--index', default = WEBSITE_DATA_INDEX, help = 'Index or alias to export.')
+parser.add_argument('--output', default = SNAPSHOT_DIR, help = 'Directory the snapshot is published to.')
+parser.add_argument('--keep', type = int, default = 2, help = 'Number of snapshots kept in the directory.')
+
+# Initialize Elasticsearch client
+es = create_client()
+logger = get_logger(__name__)
+
+# Payloads hold what /company returns, the key fields are only read to build the keys
+PAYLOAD_FIELDS = [field for field in CompanyResultQuery.model_fields if field != 'score']
+KEY_FIELDS = ['domain', 'phone_numbers_e164', 'social_links.facebook']
+
+
+# Keys are built from the normalized fields written by to_document, the API normalizes queries the same way
+def document_keys(source):
+    keys = []
+    if source.get('domain'):
+        keys.append(DOMAIN_KEY + source['domain'])
+    keys.extend(PHONE_KEY + phone for phone in source.get('phone_numbers_e164') or [])
+    keys.extend(FACEBOOK_KEY + profile for profile in (source.get('social_links') or {}).get('facebook') or [])
+    return keys
+
+
+def main():
+    args = parser.parse_args()
+    if not args.output:
+        parser.error('Set SNAPSHOT_DIR or pass --output.')
+    os.makedirs(args.output, exist_ok = True)
+
+    start_time = time.time()
+    name = f"snapshot-{time.strftime('%Y%m%d%H%M%S')}"
+    writer = SnapshotWriter(os.path.join(args.output, name))
+    query = {
+        "query": {"bool": {"must_not": {"exists": {"field": "error"}}}},
+        "_source": PAYLOAD_FIELDS + KEY_FIELDS,
+    }
+    for hit in helpers.scan(es, index = args.index, query = query, size = 5000):
+        source = hit['_source']
+        keys = document_keys(source)
+        if keys:
+            writer.add(keys, {field: source.get(field) for field in PAYLOAD_FIELDS})
+
+    keys = writer.close()
+    publish(args.output, name, args.keep)
+    logger.info(
+        f'Published {name} with {keys} keys for {writer.documents} documents in {time.time() - start_time:.2f} seconds.'
+    )
+
+
+if __name__ == '__main__':
+    main()
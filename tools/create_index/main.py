@@ -0,0 +1,40 @@
+import argparse
+
+from elasticsearch.exceptions import RequestError
+
+from common.elastic import create_client, WEBSITE_DATA_INDEX
+from common.index_lifecycle import create_versioned_index, swap_alias
+from common.log import get_logger
+from common.mappings import WEBSITE_DATA_MAPPINGS
+
+parser = argparse.ArgumentParser(description = "Create the website_data index with its explicit mapping.")
+parser.add_argument('--index', default = WEBSITE_DATA_INDEX, help = 'Alias of the index to create.')
+parser.add_argument('--shards', type = int, default = 1, help = 'Number of primary shards.')
+parser.add_argument('--replicas', type = int, default = 1, help = 'Number of replicas.')
+
+# Initialize Elasticsearch client
+es = create_client()
+logger = get_logger(__name__)
+
+
+def main():
+    args = parser.parse_args()
+
+    if es.indices.exists(index = args.index):
+        # New fields can be added to a live index, changed ones and new analyzers need a reindex
+        try:
+            es.indices.put_mapping(index = args.index, body = WEBSITE_DATA_MAPPINGS)
+        except RequestError as e:
+            parser.error(f'Index {args.index} already exists and its mapping cannot be updated in place ({e}).'
+                         f' Copy it into a new index with the current mapping:'
+                         f' python -m tools.manage_index.main --alias {args.index} reindex')
+        logger.info(f'Index {args.index} already exists, added the new fields to its mapping.')
+        return
+
+    index = create_versioned_index(es, args.index, args.shards, args.replicas, bulk_load = False)
+    swap_alias(es, index, args.index)
+    logger.info(f'Created index {index} behind the alias {args.index}.')
+
+
+if __name__ == '__main__':
+    main()
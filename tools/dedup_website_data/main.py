@@ -0,0 +1,83 @@
+from elasticsearch import helpers
+
+from common.change_log import record_changes
+from common.documents import document_id, refresh_document
+from common.elastic import create_client, WEBSITE_DATA_INDEX
+from common.log import get_logger
+
+# Initialize Elasticsearch client
+es = create_client()
+logger = get_logger(__name__)
+
+
+# Move every document that is not stored under its deterministic id onto that id, the old copies are deleted in a
+# second pass once their move succeeded. Successful crawls are upserted so they win over failed ones, failed crawls are
+# only created when nothing is there.
+def generate_move_actions(stats, moves):
+    for hit in helpers.scan(es, index = WEBSITE_DATA_INDEX, query = {"query": {"match_all": {}}}, size = 1000):
+        stats['scanned'] += 1
+        if not hit['_source'].get('url'):
+            continue
+
+        new_id = document_id(hit['_source']['url'])
+        if hit['_id'] == new_id:
+            continue
+        source = refresh_document(hit['_source'])
+
+        stats['moved'] += 1
+        moves.setdefault(new_id, []).append(hit['_id'])
+        if source.get('error'):
+            yield {"_op_type": "create", "_index": WEBSITE_DATA_INDEX, "_id": new_id, "_source": source}
+        else:
+            yield {"_op_type": "update", "_index": WEBSITE_DATA_INDEX, "_id": new_id,
+                   "doc": {**source, "error": None}, "doc_as_upsert": True}
+
+
+def generate_delete_actions(old_ids):
+    for old_id in old_ids:
+        yield {"_op_type": "delete", "_index": WEBSITE_DATA_INDEX, "_id": old_id}
+
+
+# Returns the ids whose action failed, `ignored_statuses` are outcomes that still count as done
+def run_bulk(actions, ignored_statuses, description):
+    failed_ids = set()
+    for ok, result in helpers.streaming_bulk(es, actions, chunk_size = 1000, raise_on_error = False,
+                                             max_retries = 3):
+        if ok:
+            continue
+        outcome = next(iter(result.values()))
+        if outcome.get('status') in ignored_statuses:
+            continue
+        failed_ids.add(outcome.get('_id'))
+        logger.error(f"Failed to {description} {outcome.get('_id')}: {outcome.get('error')}")
+    return failed_ids
+
+
+def main():
+    stats = {'scanned': 0, 'moved': 0}
+    # deterministic id -> ids of the documents moved onto it
+    moves = {}
+
+    # A failed crawl whose deterministic id already holds a document is a duplicate, not a failure
+    failed_moves = run_bulk(generate_move_actions(stats, moves), {409}, 'move')
+
+    # Old copies are only deleted when every move onto their new id succeeded, a failed one keeps its only copy.
+    # Bulk items are applied independently, so the deletes cannot go in the same request as the moves.
+    old_ids = [old_id for new_id, ids in moves.items() if new_id not in failed_moves for old_id in ids]
+    failed_deletes = run_bulk(generate_delete_actions(old_ids), {404}, 'delete the old copy')
+
+    moved_ids = [new_id for new_id in moves if new_id not in failed_moves]
+    record_changes(es, moved_ids + [old_id for old_id in old_ids if old_id not in failed_deletes])
+    es.indices.refresh(index = WEBSITE_DATA_INDEX)
+    count_response = es.count(index = WEBSITE_DATA_INDEX)
+
+    kept = sum(len(moves[new_id]) for new_id in failed_moves if new_id in moves)
+    logger.info(
+        f"Scanned {stats['scanned']} documents, moved {stats['moved']} onto deterministic ids,"
+        f" {kept} kept under their old id after a failed move, {len(failed_deletes)} old copies not deleted."
+        f" {count_response['count']} documents remain."
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+import argparse
+
+from common.elastic import create_client, WEBSITE_DATA_INDEX
+from common.index_lifecycle import (alias_indices, create_versioned_index, finish_bulk_load, is_concrete_index,
+                                    reindex, swap_alias)
+from common.log import get_logger
+
+parser = argparse.ArgumentParser(description = "Manage the versioned indices behind the website_data alias.")
+parser.add_argument('--alias', default = WEBSITE_DATA_INDEX, help = 'Alias read by the API and the tools.')
+parser.add_argument('--shards', type = int, default = 1, help = 'Number of primary shards of a new index.')
+parser.add_argument('--replicas', type = int, default = 1, help = 'Number of replicas once an index is live.')
+commands = parser.add_subparsers(dest = 'command', required = True)
+
+commands.add_parser('status', help = 'Show the indices behind the alias.')
+commands.add_parser(
+    'create', help = 'Create an index tuned for bulk loading (no refresh, no replicas) and print its name.'
+)
+swap_parser = commands.add_parser(
+    'swap', help = 'Restore the settings of a loaded index, point the alias at it and delete the previous index.'
+)
+swap_parser.add_argument('index', help = 'Index to put behind the alias.')
+swap_parser.add_argument('--keep-old', action = 'store_true', help = 'Keep the previous versioned index.')
+reset_parser = commands.add_parser('reset', help = 'Replace the data behind the alias with an empty index.')
+reset_parser.add_argument('--keep-old', action = 'store_true', help = 'Keep the previous versioned index.')
+reindex_parser = commands.add_parser(
+    'reindex', help = 'Copy the data behind the alias into a new index with the current mapping, then swap.'
+)
+reindex_parser.add_argument('--keep-old', action = 'store_true', help = 'Keep the previous versioned index.')
+
+# Initialize Elasticsearch client
+es = create_client()
+logger = get_logger(__name__)
+
+
+def status(args):
+    if is_concrete_index(es, args.alias):
+        logger.info(f'{args.alias} is an index, run reindex to move it behind an alias.')
+        return
+    indices = alias_indices(es, args.alias)
+    logger.info(f"{args.alias} points at {', '.join(indices) if indices else 'no index'}.")
+
+
+def create(args):
+    index = create_versioned_index(es, args.alias, args.shards, args.replicas)
+    logger.info(f'Created {index}, fill it with python -m tools.scraper.main --index {index} then swap it in.')
+
+
+# The index from before the alias shares its name, a swap always deletes it
+def check_keep_old(args):
+    if args.keep_old and is_concrete_index(es, args.alias):
+        parser.error(
+            f'{args.alias} is an index from before the alias, --keep-old cannot keep it. Run reindex without '
+            f'--keep-old to move its data into a versioned index behind the alias first.'
+        )
+
+
+def swap(args):
+    check_keep_old(args)
+    finish_bulk_load(es, args.index, args.replicas)
+    old_indices = swap_alias(es, args.index, args.alias, drop_old = not args.keep_old)
+    logger.info(
+        f"{args.alias} now points at {args.index}"
+        f"{', deleted ' + ', '.join(old_indices) if old_indices and not args.keep_old else ''}."
+    )
+
+
+def reset(args):
+    check_keep_old(args)
+    # One index deletion instead of a delete_by_query over every document
+    index = create_versioned_index(es, args.alias, args.shards, args.replicas, bulk_load = False)
+    args.index = index
+    swap(args)
+
+
+def reindex_alias(args):
+    check_keep_old(args)
+    index = create_versioned_index(es, args.alias, args.shards, args.replicas)
+    response = reindex(es, args.alias, index)
+    logger.info(f"Copied {response.get('total')} documents into {index} in {response.get('took')} ms.")
+    if response.get('failures'):
+        logger.error(f"Reindex failures, {args.alias} is left unchanged: {response['failures'][:10]}")
+        return
+    args.index = index
+    swap(args)
+
+
+COMMANDS = {
+    'status': status,
+    'create': create,
+    'swap': swap,
+    'reset': reset,
+    'reindex': reindex_alias,
+}
+
+
+def main():
+    args = parser.parse_args()
+    COMMANDS[args.command](args)
+
+
+if __name__ == '__main__':
+    main()
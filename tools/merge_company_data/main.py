@@ -1,93 +1,145 @@
+import argparse
 import os
+import time
+
 import pandas as pd
-from dotenv import load_dotenv
-from elasticsearch import Elasticsearch
+from elasticsearch import helpers
 
-load_dotenv()
-ELASTIC_USERNAME = os.getenv('ELASTIC_USERNAME')
-ELASTIC_PASSWORD = os.getenv('ELASTIC_PASSWORD')
-ELASTIC_URL = os.getenv('ELASTIC_URL')
+from common.change_log import record_changes
+from common.documents import document_id
+from common.elastic import create_client, WEBSITE_DATA_INDEX
+from common.log import get_logger
+from common.names import name_fields
 
-# Initialize Elasticsearch client
-es = Elasticsearch(
-    [ELASTIC_URL],
-    basic_auth = (ELASTIC_USERNAME, ELASTIC_PASSWORD),
-    headers = {"Content-Type": "application/json"},
-    api_version = '7.10.1'
-)
+NAME_SEPARATOR = ' | '
 
+parser = argparse.ArgumentParser(description = "Merge company names into the scraped website data.")
+parser.add_argument(
+    '--csv', default = os.path.join(os.path.curdir, 'assets/csvs/sample-websites-company-names.csv'),
+    help = 'CSV file with the company names.'
+)
+parser.add_argument('--chunk-size', type = int, default = 50000, help = 'Number of CSV rows processed at once.')
+parser.add_argument('--bulk-size', type = int, default = 1000, help = 'Number of updates per bulk request.')
+parser.add_argument(
+    '--checkpoint', default = os.path.join(os.path.curdir, '.merge_company_data.checkpoint'),
+    help = 'File recording how many rows were merged, used to resume an interrupted run.'
+)
+parser.add_argument('--restart', action = 'store_true', help = 'Ignore the checkpoint and start from the first row.')
 
-def get_record_id(url):
-    query = {
-        "query": {
-            "match": {
-                "url": url
+# Initialize Elasticsearch client
+es = create_client()
+logger = get_logger(__name__)
+
+
+def read_checkpoint(path):
+    if not os.path.exists(path):
+        return 0
+    with open(path) as checkpoint_file:
+        return int(checkpoint_file.read().strip() or 0)
+
+
+def write_checkpoint(path, rows):
+    # Write then rename so an interrupted run never leaves a truncated checkpoint
+    with open(path + '.tmp', 'w') as checkpoint_file:
+        checkpoint_file.write(str(rows))
+    os.replace(path + '.tmp', path)
+
+
+def to_nullable(series):
+    return series.astype(object).where(series.notna(), None)
+
+
+def build_company_fields(chunk):
+    domains = chunk['domain'].astype(str)
+    urls = domains.where(domains.str.startswith('http'), 'http://' + domains)
+
+    commercial_names = chunk['company_commercial_name'].str.split(NAME_SEPARATOR, regex = False)
+    legal_names = chunk['company_legal_name']
+
+    # Commercial names, then the legal name, then every other available name, without duplicates
+    all_names = chunk['company_commercial_name'].str.cat(
+        [legal_names, chunk['company_all_available_names']], sep = NAME_SEPARATOR, na_rep = ''
+    ).str.split(NAME_SEPARATOR, regex = False)
+    all_names = [list(dict.fromkeys(name for name in names if name)) for names in all_names]
+
+    return pd.DataFrame({
+        'id': urls.map(document_id),
+        'legal_name': to_nullable(legal_names),
+        'commercial_names': to_nullable(commercial_names),
+        'all_company_names': all_names,
+        'name_fields': [name_fields(names) for names in all_names],
+    }, index = chunk.index)
+
+
+def generate_update_actions(fields):
+    for record_id, legal_name, commercial_names, all_company_names, names in zip(
+            fields['id'], fields['legal_name'], fields['commercial_names'], fields['all_company_names'],
+            fields['name_fields']):
+        # Documents are addressed by their deterministic id and updated with a partial doc, no script involved
+        yield {
+            "_op_type": "update",
+            "_index": WEBSITE_DATA_INDEX,
+            "_id": record_id,
+            "doc": {
+                "legal_name": legal_name,
+                "commercial_names": commercial_names,
+                "all_company_names": all_company_names,
+                **names,
             }
         }
-    }
-
-    # Execute the search query
-    response = es.search(index = 'website_data', body = query)
-
-    # Extract the records from the response
-    records = response['hits']['hits']
-
-    if records:
-        return records[0]['_id']
-    else:
-        return None
 
 
-def main():
-    company_data_df = pd.read_csv(os.path.join(os.path.curdir, 'assets/csvs/sample-websites-company-names.csv'))
-
-    company_data_df['domain'] = company_data_df['domain'].apply(
-        lambda x: 'http://' + x if not x.startswith('http') else x)
-
-    for index, row in company_data_df.iterrows():
-        url = row['domain']
-        all_company_names = []
-        commercial_names = None
-        legal_name = None
+def merge_chunk(chunk, bulk_size):
+    fields = build_company_fields(chunk)
 
-        if pd.notna(row['company_commercial_name']):
-            commercial_names = row['company_commercial_name'].split(' | ')
-            all_company_names.extend(commercial_names)
+    updated = 0
+    for ok, result in helpers.streaming_bulk(es, generate_update_actions(fields), chunk_size = bulk_size,
+                                             raise_on_error = False, max_retries = 3):
+        if ok:
+            updated += 1
+        else:
+            logger.error(f'Failed to merge company data: {result}')
 
-        if pd.notna(row['company_legal_name']):
-            legal_name = row['company_legal_name']
-            all_company_names.append(legal_name)
+    record_changes(es, fields['id'])
+    return updated
 
-        if pd.notna(row['company_all_available_names']):
-            company_all_available_names = row['company_all_available_names'].split(' | ')
-            [all_company_names.append(company_name) for company_name in company_all_available_names if
-             company_name not in all_company_names]
 
-        record_id = get_record_id(url)
-
-        new_fields = {
-            "legal_name": legal_name,
-            "commercial_names": commercial_names,
-            "all_company_names": all_company_names,
-        }
-
-        response = es.update(
-            index = 'website_data',
-            id = record_id,
-            body = {
-                "script": {
-                    "source": "ctx._source.putAll(params.new_fields)",
-                    "params": {
-                        "new_fields": new_fields
-                    }
-                }
-            }
-        )
-
-        print(
-            f'{url} - {commercial_names} - {legal_name}  -  {all_company_names} -  {record_id}'
-        )
-        print(response)
+def main():
+    args = parser.parse_args()
+
+    rows_done = 0 if args.restart else read_checkpoint(args.checkpoint)
+    if rows_done:
+        logger.info(f'Resuming after {rows_done} merged rows.')
+
+    chunks = pd.read_csv(
+        args.csv,
+        chunksize = args.chunk_size,
+        skiprows = range(1, rows_done + 1),
+        dtype = str,
+        usecols = ['domain', 'company_commercial_name', 'company_legal_name', 'company_all_available_names']
+    )
+
+    start_time = time.time()
+    rows_merged = 0
+    documents_updated = 0
+
+    for chunk in chunks:
+        documents_updated += merge_chunk(chunk, args.bulk_size)
+        rows_merged += len(chunk)
+        write_checkpoint(args.checkpoint, rows_done + rows_merged)
+
+        elapsed_time = time.time() - start_time
+        logger.info(f'Merged {rows_done + rows_merged} rows ({rows_merged / elapsed_time:.2f} rows/sec).')
+
+    # The whole CSV is merged, a rerun starts over from the first row
+    if os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+
+    elapsed_time = time.time() - start_time
+    logger.info(
+        f'Merged company data into {documents_updated} documents from {rows_merged} rows'
+        f' in {elapsed_time:.2f} seconds.'
+    )
 
 
 if __name__ == '__main__':
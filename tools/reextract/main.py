@@ -0,0 +1,117 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from elasticsearch import helpers
+
+from common.change_log import record_changes
+from common.crawl_state import CRAWL_STATE_FIELDS
+from common.discovery import pick_contact_page
+from common.documents import document_id, to_document
+from common.elastic import create_client, WEBSITE_DATA_INDEX
+from common.extraction import merge_website_data, parse_page
+from common.log import get_logger
+from common.page_store import PAGE_STORE_DIR, group_sites, list_segments, read_index, read_pages
+
+parser = argparse.ArgumentParser(description = "Extract the data of stored pages again and update website_data.")
+parser.add_argument('--page-store', default = PAGE_STORE_DIR, help = 'Directory of the stored page segments.')
+parser.add_argument('--workers', type = int, default = os.cpu_count(), help = 'Number of extraction processes.')
+parser.add_argument('--batch-size', type = int, default = 500, help = 'Number of websites extracted per task.')
+parser.add_argument('--bulk-size', type = int, default = 1000, help = 'Number of updates per bulk request.')
+
+# Initialize Elasticsearch client
+es = create_client()
+logger = get_logger(__name__)
+
+
+# Runs in a worker process: reads the pages of a batch of websites and extracts their data
+def extract_batch(segment_path, sites):
+    documents = []
+    for records in sites:
+        pages = list(read_pages(segment_path, records))
+        home_url, home_html = pages[0]
+        data = parse_page(home_url, home_html)
+        for url, html_content in pages[1:]:
+            merge_website_data(data, parse_page(url, html_content))
+        data.contact_page = pick_contact_page([url for url, _ in pages[1:]])
+
+        # The crawl state describes the last crawl, it is left as it is
+        doc = to_document(data)
+        for field in CRAWL_STATE_FIELDS:
+            doc.pop(field, None)
+        documents.append(doc)
+    return documents
+
+
+def generate_batches(segments, batch_size):
+    for segment_path in segments:
+        sites = group_sites(read_index(segment_path))
+        for offset in range(0, len(sites), batch_size):
+            yield segment_path, sites[offset:offset + batch_size]
+
+
+def generate_update_actions(documents):
+    for doc in documents:
+        yield {
+            "_op_type": "update",
+            "_index": WEBSITE_DATA_INDEX,
+            "_id": document_id(doc['url']),
+            "doc": doc,
+            "doc_as_upsert": True
+        }
+
+
+def update_documents(documents, bulk_size):
+    updated = 0
+    for ok, result in helpers.streaming_bulk(es, generate_update_actions(documents), chunk_size = bulk_size,
+                                             raise_on_error = False, max_retries = 3):
+        if ok:
+            updated += 1
+        else:
+            logger.error('Failed to update re-extracted data: %s', result)
+
+    record_changes(es, (document_id(doc['url']) for doc in documents))
+    return updated
+
+
+def main():
+    args = parser.parse_args()
+    if not args.page_store:
+        parser.error('Set PAGE_STORE_DIR or pass --page-store.')
+
+    segments = list_segments(args.page_store)
+    logger.info('Re-extracting %d segments with %d processes.', len(segments), args.workers)
+
+    start_time = time.time()
+    sites_extracted = 0
+    documents_updated = 0
+
+    with ProcessPoolExecutor(max_workers = args.workers) as pool:
+        # Keep a few batches per process in flight, so reading, extraction and indexing overlap
+        batches = generate_batches(segments, args.batch_size)
+        pending = []
+        for batch in batches:
+            pending.append(pool.submit(extract_batch, *batch))
+            if len(pending) < args.workers * 2:
+                continue
+            documents = pending.pop(0).result()
+            documents_updated += update_documents(documents, args.bulk_size)
+            sites_extracted += len(documents)
+            logger.info('Re-extracted %d websites (%.2f sites/sec).', sites_extracted,
+                        sites_extracted / (time.time() - start_time))
+
+        for future in pending:
+            documents = future.result()
+            documents_updated += update_documents(documents, args.bulk_size)
+            sites_extracted += len(documents)
+
+    elapsed_time = time.time() - start_time
+    logger.info(
+        f'Re-extracted {sites_extracted} websites into {documents_updated} documents in {elapsed_time:.2f} seconds'
+        f' ({sites_extracted / elapsed_time:.2f} sites/sec).'
+    )
+
+
+if __name__ == '__main__':
+    main()
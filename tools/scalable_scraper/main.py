@@ -1,201 +1,342 @@
 import asyncio
 import os
-import random
-import re
-from urllib.parse import urljoin
+import time
+from dataclasses import asdict, dataclass
+from typing import List, Optional
 
-import aiohttp
 import pandas as pd
-import requests
-from bs4 import BeautifulSoup
 from celery import Celery
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown
 from dotenv import load_dotenv
-from elasticsearch import Elasticsearch
 
-from typing import List, Dict, Optional
-from dataclasses import dataclass, field
+from common.bulk_writer import BulkWriter
+from common.crawl_state import crawled_at
+from common.discovery import SITE_FETCH_SITEMAP, SITE_PAGE_BUDGET, pick_contact_page, rank_candidates, read_sitemap
+from common.elastic import CRAWL_INDEX, create_async_client
+from common.extraction import merge_website_data, parse_page
+from common.fetcher import Fetcher, create_session, error_class
+from common.html_links import extract_links
+from common.log import get_logger
+from common.metrics import FOLLOW_UP, PARSE, mark_process_dead, stage_timer, start_metrics_server
+from common.page_store import PAGE_STORE_DIR, PageStore
+from common.website_data import WebsiteData
 
 # Load environment variables
 load_dotenv()
-ELASTIC_USERNAME = os.getenv('ELASTIC_USERNAME')
-ELASTIC_PASSWORD = os.getenv('ELASTIC_PASSWORD')
-ELASTIC_URL = os.getenv('ELASTIC_URL')
+logger = get_logger(__name__)
 RABBITMQ_DEFAULT_USER = os.getenv('RABBITMQ_DEFAULT_USER')
 RABBITMQ_DEFAULT_PASS = os.getenv('RABBITMQ_DEFAULT_PASS')
 RABBITMQ_HOST = os.getenv('RABBITMQ_HOST')
 RABBITMQ_VHOST = os.getenv('RABBITMQ_VHOST')
+# Number of websites sent in one task and crawled concurrently by a worker process
+CRAWL_BATCH_SIZE = int(os.getenv('CRAWL_BATCH_SIZE', '50'))
+CRAWL_BATCH_CONCURRENCY = int(os.getenv('CRAWL_BATCH_CONCURRENCY', '50'))
+
+# Each stage has its own queue, workers consume one of them and scale independently
+FETCH_QUEUE = 'fetch'
+PARSE_QUEUE = 'parse'
+INDEX_QUEUE = 'index'
+
+# memory:// runs the pipeline without RabbitMQ, with CELERY_TASK_ALWAYS_EAGER every stage runs inline in the producer
+CELERY_BROKER_URL = os.getenv(
+    'CELERY_BROKER_URL', f'amqp://{RABBITMQ_DEFAULT_USER}:{RABBITMQ_DEFAULT_PASS}@{RABBITMQ_HOST}/{RABBITMQ_VHOST}'
+)
+CELERY_TASK_ALWAYS_EAGER = os.getenv('CELERY_TASK_ALWAYS_EAGER', 'false').lower() == 'true'
+# Number of fetched websites sent in one parse task, their pages travel in the message
+PARSE_BATCH_SIZE = int(os.getenv('PARSE_BATCH_SIZE', '10'))
+# Largest size of the pages in one parse task, a website with more is parsed by the fetch worker instead
+PARSE_BATCH_BYTES = int(os.getenv('PARSE_BATCH_BYTES', str(4 * 1024 * 1024)))
+
+
+# Celery app configuration, no result backend: nothing reads the task results
+celery_app = Celery('tasks', broker = CELERY_BROKER_URL)
+celery_app.conf.update(
+    task_ignore_result = True,
+    task_always_eager = CELERY_TASK_ALWAYS_EAGER,
+    task_routes = {
+        'tasks.fetch_websites_task': {'queue': FETCH_QUEUE},
+        'tasks.parse_websites_task': {'queue': PARSE_QUEUE},
+        'tasks.index_websites_task': {'queue': INDEX_QUEUE},
+    },
+    # A batch is acknowledged once its stage is done, a worker that dies hands it to another one
+    task_acks_late = True,
+    task_reject_on_worker_lost = True,
+    # Batches are long tasks, a process only reserves the next one when it is free
+    worker_prefetch_multiplier = 1,
+    # Parse tasks carry whole pages, up to PARSE_BATCH_BYTES of them
+    task_compression = 'gzip',
+)
 
 
 @dataclass
-class WebsiteData:
+class FetchedSite:
     url: str
-    phone_numbers: Optional[List[str]] = field(default_factory = list)
-    social_links: Optional[Dict[str, List[str]]] = field(default_factory = dict)
+    # [url, html] of the fetched pages, home page first
+    pages: List[List[str]]
     contact_page: Optional[str] = None
-    error: Optional[str] = None
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    content_hash: Optional[str] = None
+    crawled_at: Optional[str] = None
 
 
-# Celery app configuration
-celery_app = Celery(
-    'tasks',
-    broker = f'amqp://{RABBITMQ_DEFAULT_USER}:{RABBITMQ_DEFAULT_PASS}@{RABBITMQ_HOST}/{RABBITMQ_VHOST}',
-    backend = 'rpc://'
-)
+async def fetch_home_page(url, fetcher: Fetcher):
+    page = await fetcher.fetch_page(url)
+    with stage_timer(PARSE):
+        links = extract_links(url, page.text)
+    return page, links
 
-# Initialize Elasticsearch client
-es = Elasticsearch(
-    [ELASTIC_URL],
-    basic_auth = (ELASTIC_USERNAME, ELASTIC_PASSWORD),
-    headers = {"Content-Type": "application/json"},
-    api_version = '7.10.1'
-)
 
-# Load the list of websites
-websites_df = pd.read_csv(os.path.join(os.path.curdir, 'assets/csvs/sample-websites.csv'))
-websites = ['http://' + domain if not domain.startswith('http') else domain for domain in
-            websites_df['domain'].tolist()]
-
-# Regex patterns for data extraction
-PHONE_PATTERN = r'\(\d{3}\) \d{3}-\d{4}'
-SOCIAL_PATTERNS = {
-    'facebook': r'facebook\.com/[a-zA-Z0-9_.-]+',
-    'twitter': r'twitter\.com/[a-zA-Z0-9_.-]+',
-    'linkedin': r'linkedin\.com/[a-zA-Z0-9_.-]+',
-    'instagram': r'instagram\.com/[a-zA-Z0-9_.-]+'
-}
-
-# Headers to mimic a regular browser
-HEADERS_LIST = [
-    {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
-    },
-    {
-        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.0.3 Safari/605.1.15'
-    },
-    {
-        'User-Agent': 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:88.0) Gecko/20100101 Firefox/88.0'
-    }
-]
+async def fetch_candidate_page(url, fetcher: Fetcher):
+    try:
+        with stage_timer(FOLLOW_UP):
+            return [url, await fetcher.fetch_text(url)]
+    except Exception as e:
+        logger.info("Failed to crawl page %s: %s", url, e)
+        return None
 
 
-# Extract data from a single website using multiple methods
-async def extract_data(url, session):
+# The home page and the sitemap load together, then the best ranked pages of the site are fetched concurrently.
+# Returns the fetched pages, or the error document when the home page failed.
+async def fetch_website(url, fetcher: Fetcher, page_store: Optional[PageStore] = None):
     try:
-        # Method 1: Using aiohttp
-        headers = random.choice(HEADERS_LIST)
-        async with session.get(url, headers = headers, timeout = 10) as response:
-            if response.status == 200:
-                html_content = await response.text()
-                soup = BeautifulSoup(html_content, 'html.parser')
-                return await parse_data(url, soup, html_content, session)
-    except Exception as e:
-        print(f"aiohttp failed for {url}: {e}")
+        sitemap = read_sitemap(fetcher, url) if SITE_FETCH_SITEMAP else asyncio.sleep(0, [])
+        (page, links), sitemap_links = await asyncio.gather(fetch_home_page(url, fetcher), sitemap)
 
+        candidates = rank_candidates(url, links, sitemap_links, SITE_PAGE_BUDGET)
+        pages = [[url, page.text]]
+        pages.extend(filter(None, await asyncio.gather(*(fetch_candidate_page(candidate, fetcher)
+                                                         for candidate in candidates))))
+        if page_store is not None:
+            await store_pages(page_store, url, pages)
+
+        return FetchedSite(url = url, pages = pages, contact_page = pick_contact_page(candidates), etag = page.etag,
+                           last_modified = page.last_modified, content_hash = page.content_hash,
+                           crawled_at = crawled_at())
+
+    except Exception as e:
+        # If an error occurs, store the URL in Elasticsearch with an error message
+        error_message = f"Failed to crawl {url}: {e}"
+        logger.info(error_message)
+        return WebsiteData(url = url, error = error_message, error_class = error_class(e), crawled_at = crawled_at())
+
+
+def parse_website(site: FetchedSite) -> WebsiteData:
+    (home_url, home_html), *other_pages = site.pages
+    data = parse_page(home_url, home_html)
+    for page_url, html_content in other_pages:
+        merge_website_data(data, parse_page(page_url, html_content))
+    data.contact_page = site.contact_page
+    data.etag, data.last_modified, data.content_hash = site.etag, site.last_modified, site.content_hash
+    data.crawled_at = site.crawled_at
+    return data
+
+
+def parse_sites(sites: List[FetchedSite]) -> List[WebsiteData]:
+    documents = []
+    for site in sites:
+        try:
+            documents.append(parse_website(site))
+        except Exception as e:
+            error_message = f"Failed to parse {site.url}: {e}"
+            logger.info(error_message)
+            documents.append(WebsiteData(url = site.url, error = error_message, error_class = error_class(e),
+                                         crawled_at = site.crawled_at))
+    return documents
+
+
+def pages_size(site: FetchedSite):
+    return sum(len(html_content.encode('utf-8')) for _, html_content in site.pages)
+
+
+# Splits the fetched websites into parse tasks of at most `batch_size` websites and `batch_bytes` of pages. Returns
+# the batches and the websites too big for any task.
+def parse_batches(sites: List[FetchedSite], batch_size = PARSE_BATCH_SIZE, batch_bytes = PARSE_BATCH_BYTES):
+    batches, oversized = [], []
+    batch, size = [], 0
+    for site in sites:
+        site_size = pages_size(site)
+        if site_size > batch_bytes:
+            oversized.append(site)
+            continue
+        if batch and (len(batch) == batch_size or size + site_size > batch_bytes):
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append(site)
+        size += site_size
+    if batch:
+        batches.append(batch)
+    return batches, oversized
+
+
+async def store_pages(page_store: PageStore, url, pages):
     try:
-        # Method 2: Using BeautifulSoup with requests
-        headers = random.choice(HEADERS_LIST)
-        response = requests.get(url, headers = headers, timeout = 10)
-        if response.status_code == 200:
-            html_content = response.text
-            soup = BeautifulSoup(html_content, 'html.parser')
-            return await parse_data(url, soup, html_content, session)
+        await page_store.async_write_site(url, pages)
     except Exception as e:
-        print(f"BeautifulSoup with requests failed for {url}: {e}")
+        logger.warning("Failed to store the pages of %s: %s", url, e)
 
-    return None
 
+class WorkerContext:
+    """
+    Event loop, HTTP session and bulk writer kept for the lifetime of a worker process.
 
-# Parse data using BeautifulSoup
-async def parse_data(url, soup, html_content, session):
-    # Extract phone numbers
-    phone_numbers = re.findall(PHONE_PATTERN, html_content)
+    Tasks run on this loop instead of creating a loop, a connection pool and a DNS cache for every website. A worker
+    only consumes one stage, so the fetcher and the writer are opened by the first task that needs them.
+    """
 
-    # Extract social media links
-    social_links = {key: [] for key in SOCIAL_PATTERNS.keys()}
-    for platform, pattern in SOCIAL_PATTERNS.items():
-        matches = re.findall(pattern, html_content)
-        matches = [url.lower() for url in matches]
-        if matches:
-            social_links[platform].extend(matches)
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self._fetcher = None
+        self._writer = None
+        self.page_store = PageStore(PAGE_STORE_DIR) if PAGE_STORE_DIR else None
 
-    # Extract all links on the page
-    links = [urljoin(url, a['href']) for a in soup.find_all('a', href = True)]
+    @property
+    def fetcher(self) -> Fetcher:
+        if self._fetcher is None:
+            self.session = create_session()
+            self._fetcher = Fetcher(self.session)
+        return self._fetcher
 
-    contact_page = None
-    # Find and scrape 'contact' page if available
-    for link in links:
-        if 'contact' in link.lower():
-            contact_page = link
+    @property
+    def writer(self) -> BulkWriter:
+        if self._writer is None:
+            self.es = create_async_client()
+            self._writer = BulkWriter(self.es, CRAWL_INDEX)
+            self._writer.start()
+        return self._writer
 
-    phone_numbers = list(set(phone_numbers))
-    phone_numbers = [re.sub(r'[^\d+]', '', number) for number in phone_numbers]
+    async def _close(self):
+        if self._writer is not None:
+            await self._writer.close()
+            await self.es.close()
+        if self._fetcher is not None:
+            await self._fetcher.close()
+            await self.session.close()
+        if self.page_store is not None:
+            self.page_store.close()
 
-    for key in social_links:
-        social_links[key] = list(set(social_links[key]))
+    def run(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
 
-    return WebsiteData(url = url, phone_numbers = phone_numbers, social_links = social_links,
-                       contact_page = contact_page)
+    def close(self):
+        self.loop.run_until_complete(self._close())
+        self.loop.close()
 
 
-def write_data_to_elastic_search(data: WebsiteData, url):
-    try:
-        response = es.index(index = 'website_data', body = data.__dict__)
-        print(response)
-    except Exception as e:
-        print(f"Failed to index data for {url}: {e}")
+worker_context = None
 
 
-async def crawl_website(url, session):
-    try:
-        data = await extract_data(url, session)
-        print('data: ', data)
-        if data:
-            if data.contact_page:
-                contact_data = await extract_data(data.contact_page, session)
-                print('contact_data: ', contact_data)
-                if contact_data:
-                    data.phone_numbers.extend(contact_data.phone_numbers)
-                    for key in data.social_links:
-                        data.social_links[key].extend(contact_data.social_links[key])
-
-            # Remove duplicates using a set
-            data.phone_numbers = list(set(data.phone_numbers))
-            data.phone_numbers = [re.sub(r'[^\d+]', '', number) for number in data.phone_numbers]
-
-            for key in data.social_links:
-                data.social_links[key] = list(set(data.social_links[key]))
-
-            write_data_to_elastic_search(data, url)
+def get_worker_context():
+    # Pools that do not fork (solo, threads) never send worker_process_init, the context is then created on first use
+    global worker_context
+    if worker_context is None:
+        worker_context = WorkerContext()
+    return worker_context
+
+
+def close_worker_context():
+    global worker_context
+    if worker_context is not None:
+        worker_context.close()
+        worker_context = None
 
+
+# The main worker process serves /metrics, set PROMETHEUS_MULTIPROC_DIR so it aggregates the pool processes
+@worker_init.connect
+def init_worker(**kwargs):
+    start_metrics_server()
+
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    get_worker_context()
+
+
+@worker_process_shutdown.connect
+def shutdown_worker_process(**kwargs):
+    close_worker_context()
+    mark_process_dead(os.getpid())
+
+
+async def fetch_batch(urls, context: WorkerContext):
+    if not urls:
+        return []
+    semaphore = asyncio.Semaphore(CRAWL_BATCH_CONCURRENCY)
+
+    async def fetch(url):
+        async with semaphore:
+            return await fetch_website(url, context.fetcher, context.page_store)
+
+    start_time = time.time()
+    results = await asyncio.gather(*(fetch(url) for url in urls))
+
+    elapsed_time = time.time() - start_time
+    logger.info("Fetched %d websites in %.2f seconds (%.2f sites/sec).", len(urls), elapsed_time,
+                len(urls) / elapsed_time)
+    return results
+
+
+async def index_batch(documents, context: WorkerContext):
+    for document in documents:
+        data = WebsiteData(**document)
+        if data.error:
+            await context.writer.add_error(data)
         else:
-            error_message = f"Failed to crawl {url}: No data extracted."
-            data = WebsiteData(url = url, error = error_message)
-            write_data_to_elastic_search(data, url)
-            print(error_message)
+            await context.writer.add(data)
+    # The loop only runs during a task, buffered documents are written before the task is acknowledged
+    await context.writer.flush()
 
-    except Exception as e:
-        # If an error occurs, store the URL in Elasticsearch with an error message
-        error_message = f"Failed to crawl {url}: {e}"
-        data = WebsiteData(url = url, error = error_message)
-        write_data_to_elastic_search(data, url)
-        print(error_message)
+
+# Messages carry plain dicts, the JSON serializer does not know dataclasses
+def publish_documents(documents):
+    if documents:
+        index_websites_task.delay([asdict(data) for data in documents])
+
+
+# Fetch stage: I/O bound, each process fetches a batch of websites concurrently on its event loop
+@celery_app.task(name = 'tasks.fetch_websites_task')
+def fetch_websites_task(urls):
+    context = get_worker_context()
+    results = context.run(fetch_batch(urls, context))
+
+    # Downstream tasks are published outside the loop, in eager mode they run right here
+    sites = [result for result in results if isinstance(result, FetchedSite)]
+    batches, oversized = parse_batches(sites, PARSE_BATCH_SIZE, PARSE_BATCH_BYTES)
+    for batch in batches:
+        parse_websites_task.delay([asdict(site) for site in batch])
+    # Websites that failed already have their error document and skip the parse stage, like the websites whose pages
+    # would not fit in a parse task: they are parsed here rather than sent through the broker
+    publish_documents([result for result in results if isinstance(result, WebsiteData)] + parse_sites(oversized))
 
 
-# Celery task for crawling websites
-@celery_app.task(name = 'tasks.crawl_website_task')
-def crawl_website_task(url):
-    asyncio.run(crawl_single_website(url))
+# Parse stage: CPU bound, run it in a prefork pool with one process per core
+@celery_app.task(name = 'tasks.parse_websites_task')
+def parse_websites_task(sites):
+    publish_documents(parse_sites([FetchedSite(**site) for site in sites]))
 
 
-async def crawl_single_website(url):
-    async with aiohttp.ClientSession() as session:
-        await crawl_website(url, session)
+# Index stage: each task is written in _bulk requests, a few processes are enough
+@celery_app.task(name = 'tasks.index_websites_task')
+def index_websites_task(documents):
+    context = get_worker_context()
+    context.run(index_batch(documents, context))
 
 
 # Run the crawler and distribute tasks with Celery
 def main():
-    for website in websites:
-        crawl_website_task.delay(website)
+    # Load the list of websites
+    websites_df = pd.read_csv(os.path.join(os.path.curdir, 'assets/csvs/sample-websites.csv'))
+    websites = ['http://' + domain if not domain.startswith('http') else domain for domain in
+                websites_df['domain'].tolist()]
+
+    # Batches are published over one connection instead of acquiring a producer for every message
+    with celery_app.producer_pool.acquire(block = True) as producer:
+        for offset in range(0, len(websites), CRAWL_BATCH_SIZE):
+            fetch_websites_task.apply_async((websites[offset:offset + CRAWL_BATCH_SIZE],), producer = producer)
+
+    if CELERY_TASK_ALWAYS_EAGER:
+        close_worker_context()
 
 
 if __name__ == "__main__":
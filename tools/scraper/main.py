@@ -1,185 +1,288 @@
+import argparse
 import asyncio
 import os
-import random
-import re
 import time
-from urllib.parse import urljoin
+from dataclasses import dataclass
+from typing import Optional
 
-import aiohttp
 import pandas as pd
-import requests
-from bs4 import BeautifulSoup
 from dotenv import load_dotenv
-from elasticsearch import Elasticsearch
 
-from models.website_data import WebsiteData
+from common.bulk_writer import BulkWriter
+from common.crawl_state import CRAWL_STALE_AFTER_HOURS, conditional_headers, crawled_at, is_fresh, with_crawl_states
+from common.discovery import SITE_FETCH_SITEMAP, SITE_PAGE_BUDGET, pick_contact_page, rank_candidates, read_sitemap
+from common.elastic import CRAWL_INDEX, create_async_client
+from common.extraction import merge_website_data
+from common.fetcher import Fetcher, create_session, error_class
+from common.log import get_logger
+from common.metrics import FOLLOW_UP, METRICS_PORT, stage_timer, start_metrics_server
+from common.page_store import PAGE_STORE_DIR, PageStore
+from common.parse_pool import PageParser, PARSE_WORKERS
+from common.website_data import WebsiteData
+from tools.scraper.scheduler import CrawlScheduler, CrawlJob, HOME_PRIORITY
 
 # Load environment variables
 load_dotenv()
-ELASTIC_USERNAME = os.getenv('ELASTIC_USERNAME')
-ELASTIC_PASSWORD = os.getenv('ELASTIC_PASSWORD')
-ELASTIC_URL = os.getenv('ELASTIC_URL')
-
-# Initialize Elasticsearch client
-es = Elasticsearch(
-    [ELASTIC_URL],
-    basic_auth = (ELASTIC_USERNAME, ELASTIC_PASSWORD),
-    headers = {"Content-Type": "application/json"},
-    api_version = '7.10.1'
-)
-
-# Load the list of websites
-websites_df = pd.read_csv(os.path.join(os.path.curdir, 'assets/csvs/sample-websites.csv'))
-websites = ['http://' + domain if not domain.startswith('http') else domain for domain in
-            websites_df['domain'].tolist()]
-
-# websites = websites[:100]  # Limit the number of websites to crawl
-
-# Regex patterns for data extraction
-PHONE_PATTERN = r'\(\d{3}\) \d{3}-\d{4}'
-SOCIAL_PATTERNS = {
-    'facebook': r'facebook\.com/[a-zA-Z0-9_.-]+',
-    'twitter': r'twitter\.com/[a-zA-Z0-9_.-]+',
-    'linkedin': r'linkedin\.com/[a-zA-Z0-9_.-]+',
-    'instagram': r'instagram\.com/[a-zA-Z0-9_.-]+'
-}
-
-# Headers to mimic a regular browser
-HEADERS_LIST = [
-    {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
-    },
-    {
-        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/14.0.3 Safari/605.1.15'
-    },
-    {
-        'User-Agent': 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:88.0) Gecko/20100101 Firefox/88.0'
-    }
-]
-
-
-# Extract data from a single website using multiple methods
-async def extract_data(url, session):
-    try:
-        # Method 1: Using aiohttp
-        headers = random.choice(HEADERS_LIST)
-        async with session.get(url, headers = headers, timeout = 10) as response:
-            if response.status == 200:
-                html_content = await response.text()
-                soup = BeautifulSoup(html_content, 'html.parser')
-                return await parse_data(url, soup, html_content, session)
-    except Exception as e:
-        print(f"aiohttp failed for {url}: {e}")
-
-    try:
-        # Method 2: Using BeautifulSoup with requests
-        headers = random.choice(HEADERS_LIST)
-        response = requests.get(url, headers = headers, timeout = 10)
-        if response.status_code == 200:
-            html_content = response.text
-            soup = BeautifulSoup(html_content, 'html.parser')
-            return await parse_data(url, soup, html_content, session)
-    except Exception as e:
-        print(f"BeautifulSoup with requests failed for {url}: {e}")
-
-    return None
+logger = get_logger(__name__)
 
+parser = argparse.ArgumentParser(description = "Crawl the websites and store their data in Elasticsearch.")
+parser.add_argument(
+    '--csv', default = os.path.join(os.path.curdir, 'assets/csvs/sample-websites.csv'),
+    help = 'CSV file with a domain column listing the websites to crawl.'
+)
+parser.add_argument(
+    '--index', default = CRAWL_INDEX,
+    help = 'Index to write to, a versioned index from python -m tools.manage_index.main create for a full re-crawl.'
+)
+parser.add_argument('--concurrency', type = int, default = 200, help = 'Number of pages fetched at the same time.')
+parser.add_argument('--per-host-concurrency', type = int, default = 4, help = 'Concurrent requests to one host.')
+parser.add_argument('--per-host-delay', type = float, default = 0.25, help = 'Seconds between requests to one host.')
+parser.add_argument('--queue-size', type = int, default = 2000, help = 'Number of websites read ahead of the crawl.')
+parser.add_argument(
+    '--checkpoint', default = os.path.join(os.path.curdir, '.scraper.checkpoint'),
+    help = 'File recording the crawl progress, used to resume a stopped crawl.'
+)
+parser.add_argument('--restart', action = 'store_true', help = 'Ignore the checkpoint and crawl every website.')
+parser.add_argument(
+    '--incremental', action = 'store_true',
+    help = 'Only re-crawl stale websites, with conditional requests, skipping the pages that did not change.'
+)
+parser.add_argument(
+    '--stale-after', type = float, default = CRAWL_STALE_AFTER_HOURS,
+    help = 'Hours after which an incremental crawl checks a website again.'
+)
+parser.add_argument('--limit', type = int, help = 'Limit the number of websites to crawl.')
+parser.add_argument(
+    '--site-page-budget', type = int, default = SITE_PAGE_BUDGET,
+    help = 'Number of contact, about or impressum pages fetched per website besides the home page.'
+)
+parser.add_argument(
+    '--no-sitemap', action = 'store_true', default = not SITE_FETCH_SITEMAP,
+    help = 'Do not read sitemap.xml when looking for the pages to fetch.'
+)
+parser.add_argument(
+    '--page-store', default = PAGE_STORE_DIR,
+    help = 'Directory where the fetched pages are stored, for python -m tools.reextract.main.'
+)
+parser.add_argument(
+    '--metrics-port', type = int, default = METRICS_PORT,
+    help = 'Port serving the crawl metrics in the Prometheus format, 0 disables it.'
+)
+parser.add_argument(
+    '--parse-workers', type = int, default = PARSE_WORKERS,
+    help = 'Number of processes parsing the fetched pages, 0 parses on the event loop.'
+)
+parser.add_argument(
+    '--parse-queue-size', type = int, default = None,
+    help = 'Number of fetched pages waiting for a parse worker before fetching pauses.'
+)
 
-# Parse data using BeautifulSoup
-async def parse_data(url, soup, html_content, session):
-    # Extract phone numbers
-    phone_numbers = re.findall(PHONE_PATTERN, html_content)
-
-    # Extract social media links
-    social_links = {key: [] for key in SOCIAL_PATTERNS.keys()}
-    for platform, pattern in SOCIAL_PATTERNS.items():
-        matches = re.findall(pattern, html_content)
-        matches = [url.lower() for url in matches]
-        if matches:
-            social_links[platform].extend(matches)
-
-    # Extract all links on the page
-    links = [urljoin(url, a['href']) for a in soup.find_all('a', href = True)]
-
-    contact_page = None
-    # Find and scrape 'contact' page if available
-    for link in links:
-        if 'contact' in link.lower():
-            contact_page = link
-
-    phone_numbers = list(set(phone_numbers))
-    phone_numbers = [re.sub(r'[^\d+]', '', number) for number in phone_numbers]
-
-    for key in social_links:
-        social_links[key] = list(set(social_links[key]))
-
-    return WebsiteData(url = url, phone_numbers = phone_numbers, social_links = social_links,
-                       contact_page = contact_page)
 
+# Read the websites lazily, numbered by their row in the CSV
+def read_websites(path, limit = None, chunk_size = 10000):
+    row = 0
+    for chunk in pd.read_csv(path, usecols = ['domain'], dtype = str, chunksize = chunk_size):
+        for domain in chunk['domain']:
+            if limit is not None and row >= limit:
+                return
+            yield row, ('http://' + domain if not domain.startswith('http') else domain)
+            row += 1
+
+
+# Pages of a website still being fetched, the last one to finish writes the merged data
+@dataclass
+class SiteCrawl:
+    data: WebsiteData
+    pending: int
+    # (url, html) of the fetched pages, home page first, kept when a page store is used
+    pages: Optional[list] = None
+
+
+# Fetch a single page within the politeness limits of its host, then extract its data
+async def extract_data(url, scheduler: CrawlScheduler, fetcher: Fetcher, page_parser: PageParser, pages = None):
+    async with scheduler.host_slot(url):
+        html_content = await fetcher.fetch_text(url)
+    if pages is not None:
+        pages.append((url, html_content))
+    return await page_parser.parse(url, html_content)
+
+
+async def fetch_home_page(url, scheduler: CrawlScheduler, fetcher: Fetcher, headers = None):
+    async with scheduler.host_slot(url):
+        return await fetcher.fetch_page(url, headers)
+
+
+async def read_site_sitemap(url, scheduler: CrawlScheduler, fetcher: Fetcher):
+    async with scheduler.host_slot(url):
+        return await read_sitemap(fetcher, url)
+
+
+async def write_error(url, error, writer: BulkWriter):
+    # Store the URL in Elasticsearch with an error message
+    error_message = f"Failed to crawl {url}: {error}"
+    await writer.add_error(WebsiteData(url = url, error = error_message, error_class = error_class(error),
+                                       crawled_at = crawled_at()))
+    logger.info(error_message)
+
+
+async def write_site(site: SiteCrawl, writer: BulkWriter, page_store: Optional[PageStore]):
+    await writer.add(site.data)
+    if page_store is not None:
+        try:
+            await page_store.async_write_site(site.data.url, site.pages)
+        except Exception as e:
+            logger.warning("Failed to store the pages of %s: %s", site.data.url, e)
+
+
+# Websites skipped by an incremental crawl
+@dataclass
+class RefreshStats:
+    fresh: int = 0
+    unchanged: int = 0
+
+
+# Fetch the home page, unless an incremental crawl finds it fresh or unchanged, and queue the best ranked pages of the
+# site as follow-ups. Returns True once the site is done, False when its follow-ups complete it.
+async def crawl_home(scheduler: CrawlScheduler, job: CrawlJob, fetcher: Fetcher, page_parser: PageParser,
+                     writer: BulkWriter, page_store: Optional[PageStore], args, refresh_stats: RefreshStats):
+    url = job.url
+    # Stored crawl state of the site, only read by incremental crawls
+    state = job.payload
+    if state and is_fresh(state, args.stale_after):
+        refresh_stats.fresh += 1
+        return True
+
+    # Without a stored state the sitemap is read while the home page loads, so it adds no round-trip to the site.
+    # Otherwise it waits for the home page, which is most likely unchanged.
+    read_sitemap_first = not args.no_sitemap and not state
+    sitemap = read_site_sitemap(url, scheduler, fetcher) if read_sitemap_first else asyncio.sleep(0, [])
+    page, sitemap_links = await asyncio.gather(
+        fetch_home_page(url, scheduler, fetcher, conditional_headers(state)), sitemap
+    )
 
-def write_data_to_elastic_search(data: WebsiteData, url):
+    if state and (page.not_modified or page.content_hash == state.get('content_hash')):
+        refresh_stats.unchanged += 1
+        await writer.touch(url, {"crawled_at": crawled_at()})
+        return True
+
+    if not args.no_sitemap and state:
+        sitemap_links = await read_site_sitemap(url, scheduler, fetcher)
+
+    data, links = await page_parser.parse_home(url, page.text)
+    logger.debug('data: %s', data)
+    data.etag, data.last_modified, data.content_hash = page.etag, page.last_modified, page.content_hash
+    data.crawled_at = crawled_at()
+
+    candidates = rank_candidates(url, links, sitemap_links, args.site_page_budget)
+    data.contact_page = pick_contact_page(candidates)
+    site = SiteCrawl(data, len(candidates), [(url, page.text)] if page_store else None)
+    if not candidates:
+        await write_site(site, writer, page_store)
+        return True
+
+    for candidate in candidates:
+        scheduler.submit_follow_up(candidate, job.row, site)
+    return False
+
+
+# The site is written once the home page and all its follow-ups are done
+async def crawl_job(scheduler: CrawlScheduler, job: CrawlJob, fetcher: Fetcher, page_parser: PageParser,
+                    writer: BulkWriter, page_store: Optional[PageStore], args, refresh_stats: RefreshStats):
+    if job.priority == HOME_PRIORITY:
+        try:
+            if not await crawl_home(scheduler, job, fetcher, page_parser, writer, page_store, args, refresh_stats):
+                return
+        except Exception as e:
+            await write_error(job.url, e, writer)
+        scheduler.complete(job.row)
+        return
+
+    site = job.payload
     try:
-        response = es.index(index = 'website_data', body = data.__dict__)
-        print(response)
+        with stage_timer(FOLLOW_UP):
+            page_data = await extract_data(job.url, scheduler, fetcher, page_parser, site.pages)
+        logger.debug('page_data: %s', page_data)
+        merge_website_data(site.data, page_data)
     except Exception as e:
-        print(f"Failed to index data for {url}: {e}")
+        logger.info("Failed to crawl page %s: %s", job.url, e)
 
-
-async def crawl_website(url, session):
+    site.pending -= 1
+    if site.pending:
+        return
     try:
-        data = await extract_data(url, session)
-        print('data: ', data)
-        if data:
-            if data.contact_page:
-                contact_data = await extract_data(data.contact_page, session)
-                print('contact_data: ', contact_data)
-                if contact_data:
-                    data.phone_numbers.extend(contact_data.phone_numbers)
-                    for key in data.social_links:
-                        data.social_links[key].extend(contact_data.social_links[key])
-
-            # Remove duplicates using a set
-            data.phone_numbers = list(set(data.phone_numbers))
-            data.phone_numbers = [re.sub(r'[^\d+]', '', number) for number in data.phone_numbers]
-
-            for key in data.social_links:
-                data.social_links[key] = list(set(data.social_links[key]))
-
-            write_data_to_elastic_search(data, url)
-
-        else:
-            error_message = f"Failed to crawl {url}: No data extracted."
-            data = WebsiteData(url = url, error = error_message)
-            write_data_to_elastic_search(data, url)
-            print(error_message)
-
+        await write_site(site, writer, page_store)
     except Exception as e:
-        # If an error occurs, store the URL in Elasticsearch with an error message
-        error_message = f"Failed to crawl {url}: {e}"
-        data = WebsiteData(url = url, error = error_message)
-        write_data_to_elastic_search(data, url)
-        print(error_message)
+        await write_error(site.data.url, e, writer)
+    scheduler.complete(job.row)
 
 
-# Crawl all websites concurrently and store data in Elasticsearch
-async def crawl_websites(sites):
-    async with aiohttp.ClientSession() as session:
-        tasks = [crawl_website(website, session) for website in sites]
-        return await asyncio.gather(*tasks)
+# Crawl the websites through the scheduler and store data in Elasticsearch
+async def crawl_websites(sites, args):
+    es = create_async_client()
+    try:
+        async with create_session(limit = args.concurrency, limit_per_host = args.per_host_concurrency) as session, \
+                BulkWriter(es, args.index) as writer:
+            fetcher = Fetcher(session)
+            page_parser = PageParser(args.parse_workers, args.parse_queue_size)
+            page_store = PageStore(args.page_store) if args.page_store else None
+            refresh_stats = RefreshStats()
+            scheduler = CrawlScheduler(
+                lambda scheduler, job: crawl_job(scheduler, job, fetcher, page_parser, writer, page_store, args,
+                                                 refresh_stats),
+                concurrency = args.concurrency,
+                per_host_concurrency = args.per_host_concurrency,
+                per_host_delay = args.per_host_delay,
+                queue_size = args.queue_size,
+                checkpoint_path = args.checkpoint
+            )
+            if args.restart and os.path.exists(args.checkpoint):
+                os.remove(args.checkpoint)
+            if args.incremental:
+                # Home jobs carry the stored crawl state of their site
+                sites = with_crawl_states(es, sites, index = args.index)
+            try:
+                await scheduler.run(sites)
+            finally:
+                await fetcher.close()
+                page_parser.close()
+                if page_store is not None:
+                    page_store.close()
+        return scheduler, writer, fetcher, refresh_stats
+    finally:
+        await es.close()
 
 
 # Run the crawler and analyze results
 def main():
+    args = parser.parse_args()
+    start_metrics_server(args.metrics_port)
     start_time = time.time()
-    asyncio.run(crawl_websites(websites))
+    scheduler, writer, fetcher, refresh_stats = asyncio.run(crawl_websites(read_websites(args.csv, args.limit), args))
     end_time = time.time()
     elapsed_time = end_time - start_time
     elapsed_minutes = int(elapsed_time // 60)
     elapsed_seconds = elapsed_time % 60
-    print(
+    logger.info(
         f"Data extraction and indexing to Elasticsearch completed"
         f" in {elapsed_minutes} minutes and {elapsed_seconds:.2f} seconds."
     )
+    logger.info(f"Crawled {scheduler.completed} websites ({scheduler.completed / elapsed_time:.2f} sites/sec).")
+    logger.info(
+        f"Indexed {writer.indexed} documents in {writer.requests} bulk requests"
+        f" ({writer.indexed / elapsed_time:.2f} docs/sec), {len(writer.failures)} failed."
+    )
+    fetch_stats = fetcher.stats()
+    logger.info(
+        f"Read {fetch_stats['bytes_read'] / 1024 / 1024:.2f} MB, largest page {fetch_stats['peak_body_bytes'] / 1024:.0f} KB"
+        f" (limit {fetcher.max_bytes / 1024:.0f} KB), {fetch_stats['truncated']} truncated,"
+        f" {fetch_stats['stopped_early']} stopped at the end of the content,"
+        f" {fetch_stats['rejected_content_types']} rejected content types."
+    )
+    if args.incremental:
+        logger.info(
+            f"Skipped {refresh_stats.fresh} fresh websites and {refresh_stats.unchanged} unchanged home pages"
+            f" ({fetch_stats['not_modified']} answered 304 Not Modified)."
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,199 @@
+import asyncio
+import itertools
+import os
+import signal
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from common.documents import normalize_domain
+from common.log import get_logger
+
+logger = get_logger(__name__)
+
+# Lower runs first, follow-ups of sites already started go before new sites
+FOLLOW_UP_PRIORITY = 0
+HOME_PRIORITY = 1
+
+
+@dataclass(order = True)
+class CrawlJob:
+    priority: int
+    sequence: int
+    url: str = field(compare = False)
+    row: int = field(compare = False)
+    payload: Any = field(compare = False, default = None)
+
+
+@dataclass
+class HostState:
+    semaphore: asyncio.Semaphore
+    next_request: float = 0
+    users: int = 0
+
+
+# Sites are (row, url) or (row, url, payload) tuples, from a regular or an async iterable
+async def iterate_sites(sites):
+    if hasattr(sites, '__aiter__'):
+        async for site in sites:
+            yield site
+    else:
+        for site in sites:
+            yield site
+
+
+class CrawlScheduler:
+    """
+    Feeds crawl jobs to a fixed pool of workers with per-host politeness.
+
+    At most `concurrency` jobs run at once and at most `queue_size` sites are queued ahead of the workers, the source
+    is only read as space frees up. Requests to one host are limited to `per_host_concurrency` at a time and spaced by
+    `per_host_delay` seconds. Sites are numbered by their row in the source, the first row not yet completed is saved
+    to `checkpoint_path` so a stopped crawl resumes where it left off. A crawl that reaches the end of the source
+    removes the checkpoint, the next run starts over. The handler calls `complete(row)` once a site,
+    follow-ups included, is done.
+    """
+
+    HOSTS_PRUNE_SIZE = 10000
+
+    def __init__(self, handler, concurrency = 100, per_host_concurrency = 2, per_host_delay = 1.0, queue_size = 1000,
+                 checkpoint_path: Optional[str] = None, checkpoint_interval = 5.0):
+        self.handler = handler
+        self.concurrency = concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.per_host_delay = per_host_delay
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+
+        self.queue = asyncio.PriorityQueue()
+        self.queued_sites = asyncio.Semaphore(queue_size)
+        self.sequence = itertools.count()
+        self.hosts = {}
+
+        self.completed_rows = set()
+        self.watermark = 0
+        self.last_checkpoint = 0
+
+        self.stopping = False
+        self.completed = 0
+
+    def read_checkpoint(self):
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return 0
+        with open(self.checkpoint_path) as checkpoint_file:
+            return int(checkpoint_file.read().strip() or 0)
+
+    def write_checkpoint(self):
+        if not self.checkpoint_path:
+            return
+        with open(self.checkpoint_path + '.tmp', 'w') as checkpoint_file:
+            checkpoint_file.write(str(self.watermark))
+        os.replace(self.checkpoint_path + '.tmp', self.checkpoint_path)
+        self.last_checkpoint = time.monotonic()
+
+    def remove_checkpoint(self):
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def stop(self):
+        if not self.stopping:
+            logger.info('Stopping the crawl, waiting for the sites in progress to finish...')
+        self.stopping = True
+
+    def submit_follow_up(self, url, row, payload = None):
+        self.queue.put_nowait(CrawlJob(FOLLOW_UP_PRIORITY, next(self.sequence), url, row, payload))
+
+    def complete(self, row):
+        self.completed += 1
+        self.completed_rows.add(row)
+        while self.watermark in self.completed_rows:
+            self.completed_rows.remove(self.watermark)
+            self.watermark += 1
+
+        if time.monotonic() - self.last_checkpoint >= self.checkpoint_interval:
+            self.write_checkpoint()
+
+    @asynccontextmanager
+    async def host_slot(self, url):
+        host = normalize_domain(url)
+        state = self.hosts.get(host)
+        if state is None:
+            if len(self.hosts) >= self.HOSTS_PRUNE_SIZE:
+                self._prune_hosts()
+            state = self.hosts[host] = HostState(asyncio.Semaphore(self.per_host_concurrency))
+
+        state.users += 1
+        try:
+            async with state.semaphore:
+                delay = state.next_request - time.monotonic()
+                state.next_request = max(state.next_request, time.monotonic()) + self.per_host_delay
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                yield
+        finally:
+            state.users -= 1
+
+    def _prune_hosts(self):
+        # Idle hosts are forgotten once their delay has passed, keeping the table as small as the crawl frontier
+        now = time.monotonic()
+        for host in [host for host, state in self.hosts.items() if state.users == 0 and state.next_request <= now]:
+            del self.hosts[host]
+
+    async def run(self, sites):
+        start_row = self.read_checkpoint()
+        self.watermark = start_row
+        if start_row:
+            logger.info('Resuming the crawl at row %d.', start_row)
+
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signal_number, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+        workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+        finished = False
+        try:
+            await self._feed(sites, start_row)
+            await self.queue.join()
+            finished = not self.stopping
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions = True)
+            for signal_number in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    loop.remove_signal_handler(signal_number)
+                except (NotImplementedError, RuntimeError):
+                    pass
+            # Only an interrupted or stopped crawl resumes, a finished one would skip every row next time
+            if finished:
+                self.remove_checkpoint()
+            else:
+                self.write_checkpoint()
+
+    async def _feed(self, sites, start_row):
+        async for row, url, *payload in iterate_sites(sites):
+            if row < start_row:
+                continue
+            await self.queued_sites.acquire()
+            if self.stopping:
+                break
+            self.queue.put_nowait(CrawlJob(HOME_PRIORITY, next(self.sequence), url, row, *payload))
+
+    async def _work(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                if job.priority == HOME_PRIORITY:
+                    self.queued_sites.release()
+                    # Sites not started yet are dropped on shutdown, the checkpoint brings them back on resume
+                    if self.stopping:
+                        continue
+                await self.handler(self, job)
+            except Exception as e:
+                logger.error("Crawl job for %s failed: %s", job.url, e)
+            finally:
+                self.queue.task_done()
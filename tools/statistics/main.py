@@ -1,75 +1,131 @@
-from elasticsearch import Elasticsearch
-from dotenv import load_dotenv
-import os
-from models.website_data import WebsiteData
-
-
-load_dotenv()
-ELASTIC_USERNAME = os.getenv('ELASTIC_USERNAME')
-ELASTIC_PASSWORD = os.getenv('ELASTIC_PASSWORD')
-ELASTIC_URL = os.getenv('ELASTIC_URL')
-
-es = Elasticsearch(
-    [ELASTIC_URL],
-    basic_auth = (ELASTIC_USERNAME, ELASTIC_PASSWORD),
-    headers = {"Content-Type": "application/json"},
-    api_version = '7.10.1'
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+from common.elastic import create_client, WEBSITE_DATA_INDEX
+from common.log import get_logger
+from common.mappings import WEBSITE_DATA_MAPPINGS
+
+parser = argparse.ArgumentParser(description = "Report statistics about the scraped website data.")
+parser.add_argument('--index', default = WEBSITE_DATA_INDEX, help = 'Index to report on.')
+parser.add_argument(
+    '--slices', type = int, default = 4,
+    help = 'Parallel scroll slices reading the documents written before the per-document counts existed.'
 )
+parser.add_argument('--error-classes', type = int, default = 20, help = 'Number of error classes listed.')
 
+# Initialize Elasticsearch client
+es = create_client()
+logger = get_logger(__name__)
 
-def main():
-    # Get the count of all records in the 'website_data' index
-    count_response = es.count(index = 'website_data')
-    total_records = count_response['count']
-
-    print(f'Total number of websites in queue: {total_records}')
-
-    # Query to get the count of records where the 'error' field is null
-    query = {
-        "query": {
-            "bool": {
-                "must_not": {
-                    "exists": {
-                        "field": "error"
-                    }
+PLATFORMS = list(WEBSITE_DATA_MAPPINGS['properties']['social_links']['properties'])
+LIST_FIELDS = ['phone_numbers', 'emails'] + [f'social_links.{platform}' for platform in PLATFORMS]
+
+SUCCESSFUL = {"bool": {"must_not": {"exists": {"field": "error"}}}}
+FAILED = {"exists": {"field": "error"}}
+# Documents written before the counts were stored, their data points are counted by the scroll fallback
+WITHOUT_COUNTS = {"bool": {"must_not": [{"exists": {"field": "error"}}, {"exists": {"field": "counts.data_points"}}]}}
+
+
+def build_aggregations(error_classes):
+    successful = {
+        "data_points": {"sum": {"field": "counts.data_points"}},
+        "without_counts": {"filter": {"bool": {"must_not": {"exists": {"field": "counts.data_points"}}}}},
+    }
+    for field in LIST_FIELDS:
+        name = field.replace('social_links.', '')
+        # Values are counted from the doc values of the keyword fields, nothing is read on the client
+        successful[f'{name}_values'] = {"value_count": {"field": field}}
+        successful[f'{name}_websites'] = {"filter": {"exists": {"field": field}}}
+
+    return {
+        "successful": {"filter": SUCCESSFUL, "aggs": successful},
+        "failed": {
+            "filter": FAILED,
+            "aggs": {
+                "error_classes": {
+                    "terms": {"field": "error_class", "size": error_classes, "missing": "unclassified"}
                 }
             }
         }
     }
 
-    # Execute the count query
-    count_response = es.count(index = 'website_data', body = query)
-    total_records_successfully_scraped = count_response['count']
 
-    if total_records > 0:
-        percentage_successfully_scraped = (total_records_successfully_scraped / total_records) * 100
-        print(
-            f'Total number of website successfully scraped: {total_records_successfully_scraped} ( {percentage_successfully_scraped:.2f}% )')
-    else:
-        print('No records found in the index.')
+def count_slice(index, slice_id, slices):
+    body = {"query": WITHOUT_COUNTS, "_source": LIST_FIELDS, "size": 1000, "sort": ["_doc"]}
+    if slices > 1:
+        body["slice"] = {"id": slice_id, "max": slices}
 
-    # Initialize the scroll
-    response = es.search(index = 'website_data', body = query, scroll = '2m', size = 1000)
-    scroll_id = response['_scroll_id']
-    all_records = response['hits']['hits']
+    data_points = 0
+    response = es.search(index = index, body = body, scroll = '2m')
+    scroll_id = response.get('_scroll_id')
+    try:
+        # Pages are summed and dropped as they arrive, only one page per slice is held in memory
+        while response['hits']['hits']:
+            for hit in response['hits']['hits']:
+                source = hit['_source']
+                data_points += len(source.get('phone_numbers') or []) + len(source.get('emails') or [])
+                data_points += sum(len(links or []) for links in (source.get('social_links') or {}).values())
+            response = es.scroll(scroll_id = scroll_id, scroll = '2m')
+            scroll_id = response.get('_scroll_id', scroll_id)
+    finally:
+        if scroll_id:
+            es.clear_scroll(scroll_id = scroll_id)
+    return data_points
 
-    # Scroll through the results
-    while len(response['hits']['hits']):
-        response = es.scroll(scroll_id = scroll_id, scroll = '2m')
-        scroll_id = response['_scroll_id']
-        all_records.extend(response['hits']['hits'])
 
-    data_points = 0
+# Sliced scroll, every slice streamed by its own thread
+def count_data_points_without_counts(index, slices):
+    with ThreadPoolExecutor(max_workers = slices) as executor:
+        return sum(executor.map(lambda slice_id: count_slice(index, slice_id, slices), range(slices)))
+
 
-    for record in all_records:
-        data = WebsiteData(**record['_source'])
-        data_points += len(data.phone_numbers)
-        data_points += len(data.social_links['facebook'])
-        data_points += len(data.social_links['twitter'])
-        data_points += len(data.social_links['linkedin'])
-        data_points += len(data.social_links['instagram'])
+def percentage(part, total):
+    return part / total * 100 if total else 0
 
-    print(f'Total data points extracted: {data_points}')
+
+def main():
+    args = parser.parse_args()
+
+    response = es.search(index = args.index, body = {
+        "size": 0,
+        "track_total_hits": True,
+        "aggs": build_aggregations(args.error_classes)
+    })
+    total = response['hits']['total']['value']
+    if not total:
+        logger.info('No records found in the index.')
+        return
+
+    successful = response['aggregations']['successful']
+    failed = response['aggregations']['failed']
+    logger.info(f'Total number of websites in queue: {total}')
+    logger.info(
+        f"Total number of website successfully scraped: {successful['doc_count']}"
+        f" ( {percentage(successful['doc_count'], total):.2f}% )"
+    )
+
+    data_points = int(successful['data_points']['value'])
+    without_counts = successful['without_counts']['doc_count']
+    if without_counts:
+        logger.info(f'Counting the data points of {without_counts} documents without stored counts.')
+        data_points += count_data_points_without_counts(args.index, args.slices)
+    logger.info(f'Total data points extracted: {data_points}')
+
+    logger.info('Data points by type (values, websites with at least one):')
+    for field in LIST_FIELDS:
+        name = field.replace('social_links.', '')
+        websites = successful[f'{name}_websites']['doc_count']
+        logger.info(
+            f"  {name}: {int(successful[f'{name}_values']['value'])},"
+            f" {websites} ( {percentage(websites, successful['doc_count']):.2f}% )"
+        )
+
+    logger.info(f"Failed websites by error class ({failed['doc_count']} failed):")
+    for bucket in failed['error_classes']['buckets']:
+        logger.info(f"  {bucket['key']}: {bucket['doc_count']} ( {percentage(bucket['doc_count'], total):.2f}% )")
+    other_errors = failed['error_classes']['sum_other_doc_count']
+    if other_errors:
+        logger.info(f'  other: {other_errors}')
 
 
 if __name__ == "__main__":